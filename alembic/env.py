@@ -10,6 +10,13 @@ from app.database.database import Base
 
 from app.models.user import User
 from app.models.habit import Habit
+from app.models.habit_log import HabitLog
+from app.models.habit_stats import HabitStats
+from app.models.habit_tombstone import HabitTombstone
+from app.models.habit_version import HabitVersion
+from app.models.revoked_token import RevokedToken
+from app.models.refresh_token import RefreshToken
+from app.models.user_shard import UserShard
 
 load_dotenv()
 
@@ -67,7 +74,8 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    connectable = os.getenv("DATABASE_URL")
+    # app.database.migrate passes the URL it checked, so both look at the same database.
+    connectable = config.attributes.get("database_url") or os.getenv("DATABASE_URL")
 
     if connectable is not None:
         connectable = create_engine(connectable)
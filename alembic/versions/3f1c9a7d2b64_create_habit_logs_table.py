@@ -0,0 +1,38 @@
+"""create habit_logs table
+
+Revision ID: 3f1c9a7d2b64
+Revises: dbd7b4528a16
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, Sequence[str], None] = 'dbd7b4528a16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('habit_logs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('logged_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habits.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_habit_logs_habit_id_logged_at', 'habit_logs', ['habit_id', 'logged_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_habit_logs_habit_id_logged_at', table_name='habit_logs')
+    op.drop_table('habit_logs')
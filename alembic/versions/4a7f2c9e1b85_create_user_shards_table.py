@@ -0,0 +1,34 @@
+"""create user shards table
+
+Revision ID: 4a7f2c9e1b85
+Revises: 9d3a6c1f5e48
+Create Date: 2026-10-18 23:41:08.215734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a7f2c9e1b85'
+down_revision: Union[str, Sequence[str], None] = '9d3a6c1f5e48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('shard_id', sa.Integer(), nullable=False),
+    sa.Column('moving', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_shards')
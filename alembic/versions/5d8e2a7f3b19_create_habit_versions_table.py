@@ -0,0 +1,34 @@
+"""create habit_versions table
+
+Revision ID: 5d8e2a7f3b19
+Revises: c47a05e9d1f3
+Create Date: 2026-10-18 15:02:41.183920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8e2a7f3b19'
+down_revision: Union[str, Sequence[str], None] = 'c47a05e9d1f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('habit_versions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Users without a row are at version 0; the row is created by their next habit change.
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('habit_versions')
@@ -0,0 +1,47 @@
+"""create habit_stats table
+
+Revision ID: 8b2e4f61c0d9
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 12:20:07.718342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4f61c0d9'
+down_revision: Union[str, Sequence[str], None] = '3f1c9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('habit_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(), nullable=False),
+    sa.Column('habit_count', sa.Integer(), nullable=False),
+    sa.Column('total_checkins', sa.Integer(), nullable=False),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('longest_streak', sa.Integer(), nullable=False),
+    sa.Column('day_start', sa.DateTime(), nullable=True),
+    sa.Column('day_checkins', sa.Integer(), nullable=False),
+    sa.Column('day_completed', sa.Integer(), nullable=False),
+    sa.Column('week_start', sa.DateTime(), nullable=True),
+    sa.Column('week_checkins', sa.Integer(), nullable=False),
+    sa.Column('week_completed', sa.Integer(), nullable=False),
+    sa.Column('month_start', sa.DateTime(), nullable=True),
+    sa.Column('month_checkins', sa.Integer(), nullable=False),
+    sa.Column('month_completed', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'category')
+    )
+    # Existing data is rolled up with `python -m app.database.rollups backfill` after upgrading.
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('habit_stats')
@@ -0,0 +1,50 @@
+"""track habit revisions and tombstones
+
+Revision ID: 9d3a6c1f5e48
+Revises: 2b8f6d4e9c17
+Create Date: 2026-10-18 21:12:54.630187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3a6c1f5e48'
+down_revision: Union[str, Sequence[str], None] = '2b8f6d4e9c17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('habits', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+    # Existing habits count as changed at their owner's current version, so they are part of the next sync.
+    op.execute(
+        "UPDATE habits SET revision = COALESCE("
+        "(SELECT version FROM habit_versions WHERE habit_versions.user_id = habits.user_id), 0)"
+    )
+    op.create_index('ix_habits_user_id_revision', 'habits', ['user_id', 'revision'], unique=False)
+    op.create_table('habit_tombstones',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'habit_id')
+    )
+    op.create_index('ix_habit_tombstones_user_id_revision', 'habit_tombstones', ['user_id', 'revision'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_habit_tombstones_user_id_revision', table_name='habit_tombstones')
+    op.drop_table('habit_tombstones')
+    op.drop_index('ix_habits_user_id_revision', table_name='habits')
+    # On SQLite the batch op rebuilds the table, and the rebuild loses expression indexes, so this one is put back.
+    op.drop_index('ix_habits_user_id_lower_name_id', table_name='habits')
+    with op.batch_alter_table('habits') as batch_op:
+        batch_op.drop_column('revision')
+    op.create_index('ix_habits_user_id_lower_name_id', 'habits', ['user_id', sa.text('lower(name)'), 'id'], unique=False)
@@ -0,0 +1,29 @@
+"""add version to habits
+
+Revision ID: a91c3e5f7d20
+Revises: 5d8e2a7f3b19
+Create Date: 2026-10-18 15:48:10.402731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a91c3e5f7d20'
+down_revision: Union[str, Sequence[str], None] = '5d8e2a7f3b19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('habits', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('habits') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,48 @@
+"""index habits by user and cascade deletes
+
+Revision ID: c47a05e9d1f3
+Revises: 8b2e4f61c0d9
+Create Date: 2026-10-18 13:02:51.114870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47a05e9d1f3'
+down_revision: Union[str, Sequence[str], None] = '8b2e4f61c0d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite doesn't name foreign keys, so batch mode needs a naming convention to find the one we replace.
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def _habits_user_fk_name() -> str:
+    if op.get_bind().dialect.name == "postgresql":
+        return 'habits_user_id_fkey'
+    return 'fk_habits_user_id_users'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Both indexes duplicate the primary key index.
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_index(op.f('ix_habits_id'), table_name='habits')
+    with op.batch_alter_table('habits', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(_habits_user_fk_name(), type_='foreignkey')
+        batch_op.create_foreign_key('habits_user_id_fkey', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_index('ix_habits_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('habits', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_index('ix_habits_user_id_id')
+        batch_op.drop_constraint('habits_user_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('habits_user_id_fkey', 'users', ['user_id'], ['id'])
+    op.create_index(op.f('ix_habits_id'), 'habits', ['id'], unique=False)
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
@@ -0,0 +1,41 @@
+"""index habit filters and name search
+
+Revision ID: e6b1d3f8a2c5
+Revises: a91c3e5f7d20
+Create Date: 2026-10-18 17:21:36.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b1d3f8a2c5'
+down_revision: Union[str, Sequence[str], None] = 'a91c3e5f7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_habits_user_id_category_id', 'habits', ['user_id', 'category', 'id'], unique=False)
+    op.create_index('ix_habits_user_id_streak_id', 'habits', ['user_id', 'streak', 'id'], unique=False)
+    op.create_index('ix_habits_user_id_last_logged_id', 'habits', ['user_id', 'last_logged', 'id'], unique=False)
+    op.create_index('ix_habits_user_id_lower_name_id', 'habits', ['user_id', sa.text('lower(name)'), 'id'], unique=False)
+    # LIKE 'q%' only uses a btree under a non-C collation with text_pattern_ops, so the search has its own index.
+    if op.get_bind().dialect.name == "postgresql":
+        op.create_index(
+            'ix_habits_user_id_lower_name_pattern', 'habits', ['user_id', sa.text('lower(name) text_pattern_ops')], unique=False,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index('ix_habits_user_id_lower_name_pattern', table_name='habits')
+    op.drop_index('ix_habits_user_id_lower_name_id', table_name='habits')
+    op.drop_index('ix_habits_user_id_last_logged_id', table_name='habits')
+    op.drop_index('ix_habits_user_id_streak_id', table_name='habits')
+    op.drop_index('ix_habits_user_id_category_id', table_name='habits')
@@ -1,95 +1,367 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from app.database.database import get_db
-from app.models.habit import Habit as HabitModel
-from app.models.user import User as UserModel
-from app.schemas.habit import HabitCreate, HabitUpdate, Habit as HabitSchema
+from app.database import crud
+from app.database import rollups
+from app.database.database import run_db
+from app.database.replicas import ReadSession, get_read_session, note_write, release_read_session, run_read, stream_read_rows
+from app.database.sharding import get_shard_read_session, get_shard_session
+from app.schemas.auth import AuthenticatedUser
+from app.schemas.habit import (
+    HabitBatch, HabitBatchResult, HabitChanges, HabitCreate, HabitFilters, HabitImportResult, HabitRow, HabitSort, HabitUpdate, Habit as HabitSchema,
+)
+from app.schemas.stats import HabitStats as HabitStatsSchema
+from app.core import change_feed, habit_transfer
+from app.core.instrumentation import InstrumentedRoute
 from app.core.auth import get_current_user
+from app.core.cache import CachedResponse, response_cache
+from app.core.config import settings
+from app.core.etags import (
+    cached_json_response, etag_matches, expected_habit_versions, habit_etag, habit_list_etag,
+    not_modified, precondition_failed, response_cache_key,
+)
+from app.core.streaks import utcnow
+from app.core.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_BATCH_SIZE,
+    decode_cursor, encode_cursor, next_page_headers,
+)
 
-router = APIRouter()
+# InstrumentedRoute lets the Server-Timing header tell serialization time apart from the handler itself.
+router = APIRouter(route_class=InstrumentedRoute)
+
+# The handlers are async and hand their database work to `run_db`, so in async mode (DB_MODE=async)
+# they never block the event loop, and in sync mode the queries still run in the threadpool.
+# Reads take a ReadSession and go through `run_read` instead, which sends them to a read replica when there is one.
+# Both kinds of session are bound to the shard the user's habits are on (see app/database/sharding.py).
+
+# The read endpoints select plain rows and serialize them to bytes themselves: no per-row validation,
+# and the bytes can be kept in the response cache. The adapters are built once, at import time.
+_habit_row_adapter = TypeAdapter(HabitRow)
+_habit_rows_adapter = TypeAdapter(List[HabitRow])
+_habit_changes_adapter = TypeAdapter(HabitChanges)
 
 @router.post("/", response_model=HabitSchema, status_code=status.HTTP_201_CREATED)
-def create_habit(
-    habit: HabitCreate, 
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)
+async def create_habit(
+    habit: HabitCreate,
+    response: Response,
+    db: Session = Depends(get_shard_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
 
     # Now, instead of a hardcoded user_id, we use the ID from the authenticated user.
-    db_habit = HabitModel(**habit.model_dump(), user_id=current_user.id)
-    db.add(db_habit)
-    db.commit()
-    db.refresh(db_habit)
+    db_habit = await run_db(db, crud.create_habit, current_user.id, habit)
+    await note_write(current_user.id)
+    await change_feed.publish_habit(current_user.id, db_habit)
+    response.headers["ETag"] = habit_etag(db_habit.id, db_habit.version)
     return db_habit
 
 
+# Applies many creates, updates and deletes in one request and one transaction, e.g. when an offline client syncs.
+# Each item gets its own result, so one missing habit doesn't fail the whole batch.
+@router.post("/batch", response_model=HabitBatchResult)
+async def batch_habits(
+    batch: HabitBatch,
+    db: Session = Depends(get_shard_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    results = await run_db(db, crud.apply_habit_batch, current_user.id, batch)
+    await note_write(current_user.id)
+    await change_feed.publish_changes(
+        current_user.id,
+        habits=[result.habit for result in results if result.habit is not None],
+        deleted_ids=[result.id for result in results if result.op == "delete" and result.status == 204],
+    )
+    return {"results": results}
+
+
+# The filter and sort query parameters of GET /v1/habits/, collected into HabitFilters.
+def habit_filters(
+    category: Optional[str] = None,
+    frequency: Optional[str] = None,
+    streak_gte: Optional[int] = Query(None, ge=0),
+    logged_after: Optional[datetime] = None,
+    logged_before: Optional[datetime] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=100, description="Case-insensitive prefix of the habit name"),
+    sort: HabitSort = "id",
+) -> HabitFilters:
+    return HabitFilters(
+        category=category, frequency=frequency, streak_gte=streak_gte,
+        logged_after=logged_after, logged_before=logged_before, q=q, sort=sort,
+    )
+
+
 @router.get("/", response_model=List[HabitSchema])
-def read_habits(
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)):
+async def read_habits(
+    request: Request,
+    filters: HabitFilters = Depends(habit_filters),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    read_db: ReadSession = Depends(get_shard_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)):
+
+    # We filter the query to only return habits that belong to the current user,
+    # and to those matching the filters; the database does the filtering, sorting and search.
+    sort_key = filters.sort.lstrip("-")
+    after_key = decode_cursor(after, filters.sort, crud.HABIT_SORT_VALUE_TYPES[sort_key], crud.HABIT_SORT_KEYS[sort_key][1])
+    db = await read_db.for_user(current_user.id)
+
+    # NDJSON mode streams every remaining habit, one JSON object per line.
+    # Rows come from a server-side cursor, so only one batch of rows is held in memory at a time.
+    if response_format == "ndjson":
+        query = crud.habits_query(current_user.id, after_key, filters)
+
+        async def ndjson_lines():
+            async for rows in stream_read_rows(db, query, STREAM_BATCH_SIZE):
+                yield habit_transfer.ndjson_batch(rows)
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    # Polling clients send back the ETag they got; if the user's habits haven't changed since, they get a 304
+    # after a single primary key lookup of the habit version, without reading any habits.
+    version = await run_read(db, crud.get_habit_version, current_user.id)
+    etag = habit_list_etag(current_user.id, version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified(etag)
 
-    # We filter the query to only return habits that belong to the current user.
-    habits = db.query(HabitModel).filter(HabitModel.user_id == current_user.id).all()
-    return habits
+    cache_key = response_cache_key(
+        current_user.id, version, f"list:{filters.model_dump_json(exclude_defaults=True)}:{after}:{limit}"
+    )
+    cached = await response_cache.get(cache_key)
+    if cached is None:
+        # We fetch one extra row to know whether there is a next page without running a COUNT query.
+        habits = await run_read(db, crud.get_habits_page, current_user.id, after_key, limit + 1, filters)
+        next_cursor = None
+        if len(habits) > limit:
+            habits = habits[:limit]
+            # The id orders have no separate sort key: the id is the sort value.
+            next_cursor = encode_cursor(habits[-1]["id"], filters.sort, habits[-1].get("sort_key", habits[-1]["id"]))
+        body = _habit_rows_adapter.dump_json(habits)
+        cached = CachedResponse(body, {**next_page_headers(request, next_cursor, limit), "ETag": etag})
+        await response_cache.set(cache_key, cached, settings.RESPONSE_CACHE_TTL_SECONDS)
+    return cached_json_response(cached)
+
+
+# Downloads the user's habits (optionally filtered and sorted like the list) as CSV or NDJSON, e.g. for backups.
+# Rows are streamed from a server-side cursor, one batch at a time, so memory use doesn't grow with the export.
+# Like the routes below, this must be declared before "/{habit_id}".
+@router.get("/export")
+async def export_habits(
+    filters: HabitFilters = Depends(habit_filters),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    read_db: ReadSession = Depends(get_shard_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    db = await read_db.for_user(current_user.id)
+    query = crud.habits_query(current_user.id, None, filters)
+    encode = habit_transfer.csv_batch if export_format == "csv" else habit_transfer.ndjson_batch
+
+    async def export_lines():
+        if export_format == "csv":
+            yield habit_transfer.csv_header()
+        async for rows in stream_read_rows(db, query, STREAM_BATCH_SIZE):
+            yield encode(rows)
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="habits.{export_format}"'}
+    return StreamingResponse(export_lines(), media_type=media_type, headers=headers)
+
+
+# Delta sync for offline clients: only the habits changed and the ids of those deleted since the client's last sync.
+# The client stores the returned watermark and sends it as `since` next time (0, or nothing, for a first sync).
+# When nothing changed this is a single primary key lookup of the habit version, however many habits the user has.
+@router.get("/changes", response_model=HabitChanges)
+async def read_habit_changes(
+    since: int = Query(0, ge=0),
+    read_db: ReadSession = Depends(get_shard_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    db = await read_db.for_user(current_user.id)
+    changes = await run_read(db, crud.get_habit_changes, current_user.id, since)
+    return Response(_habit_changes_adapter.dump_json(changes), media_type="application/json")
+
+
+# Pushes the user's habit changes as Server-Sent Events, for as long as the client keeps the connection open:
+# `upsert` with the habit after a create, update or check-in, `delete` with the id of a deleted habit, and `resync`
+# when the client should catch up through GET /v1/habits/changes instead (after an import, or if it fell behind).
+# Events can overlap with what a sync returns: clients apply an upsert only if its `version` is newer than theirs.
+# The stream holds no database connection: authentication is all the database work it does.
+@router.get(
+    "/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}, "description": "A stream of habit change events"}},
+)
+async def stream_habit_changes(
+    read_db: ReadSession = Depends(get_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    await release_read_session(read_db)
+    if change_feed.hub.connection_count() >= settings.MAX_STREAM_CONNECTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open streams, please retry shortly",
+            headers={"Retry-After": str(settings.OVERLOAD_RETRY_AFTER_SECONDS)},
+        )
+
+    # Subscribing inside the generator means a client that goes away before the stream starts leaves nothing behind.
+    async def events():
+        subscription = change_feed.hub.subscribe(current_user.id)
+        try:
+            yield b": connected\n\n"
+            while True:
+                frames = await subscription.next_frames(settings.STREAM_KEEPALIVE_SECONDS)
+                if frames is None:
+                    return
+                yield frames
+        finally:
+            change_feed.hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Creates habits from an uploaded CSV (with a header row) or NDJSON file, e.g. an earlier export.
+# The body is parsed as it arrives and every IMPORT_CHUNK_SIZE rows are validated together. Nothing touches the
+# database until the whole upload has been read: meanwhile the request's connections are back in their pools, so
+# a slow upload holds neither a connection nor the lock on the user's writes. If any row is invalid, nothing is
+# imported. The chunks are then inserted with one bulk INSERT each, all in one transaction.
+@router.post(
+    "/import",
+    response_model=HabitImportResult,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "text/csv": {"schema": {"type": "string"}},
+        "application/x-ndjson": {"schema": {"type": "string"}},
+    }}},
+)
+async def import_habits(
+    request: Request,
+    db: Session = Depends(get_shard_session),
+    read_db: ReadSession = Depends(get_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parse = habit_transfer.IMPORT_PARSERS.get(content_type)
+    if parse is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload the file as text/csv or application/x-ndjson",
+        )
+
+    # Authentication may have left a transaction open on the primary (or a replica).
+    await release_read_session(read_db)
+    await release_read_session(ReadSession(db))
+    spool, rows = await habit_transfer.spool_import(parse(request.stream()))
+    with spool:
+        imported = await run_db(db, crud.import_habits, current_user.id, habit_transfer.spooled_chunks(spool)) if rows else 0
+    if imported:
+        await note_write(current_user.id)
+        await change_feed.publish_resync(current_user.id)
+    return {"imported": imported}
+
+
+# Completion rates, streaks and per-category totals for the current day, week and month.
+# These come from precomputed rollups (see app/database/rollups.py), so this is a single indexed lookup.
+# This route must be declared before "/{habit_id}", otherwise "stats" would be parsed as a habit id.
+@router.get("/stats", response_model=HabitStatsSchema)
+async def read_habit_stats(
+    read_db: ReadSession = Depends(get_shard_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    db = await read_db.for_user(current_user.id)
+    rows = await run_read(db, rollups.get_stats, current_user.id)
+    return rollups.build_stats(rows, utcnow())
 
 
 @router.get("/{habit_id}", response_model=HabitSchema)
-def read_habit(
-    habit_id: int, 
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)):
-
-    # The query now filters by both the habit's ID and the user's ID.
-    db_habit = db.query(HabitModel).filter(
-        HabitModel.id == habit_id,
-        HabitModel.user_id == current_user.id
-    ).first()
-
-    # Raising a 404 is a good practice to avoid leaking information.
-    # We don't say "Habit found but you're not the owner."
-    if db_habit is None:
-        raise HTTPException(status_code=404, detail="Habit not found")
-    return db_habit
+async def read_habit(
+    habit_id: int,
+    request: Request,
+    read_db: ReadSession = Depends(get_shard_read_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)):
+
+    # The response is cached under the user's habit version like the list above, and the cached headers carry
+    # the habit's own ETag. So a warm cache answers both If-None-Match and plain reads without reading the habit.
+    db = await read_db.for_user(current_user.id)
+    version = await run_read(db, crud.get_habit_version, current_user.id)
+    cache_key = response_cache_key(current_user.id, version, f"habit:{habit_id}")
+    cached = await response_cache.get(cache_key)
+    if cached is None:
+        # The query filters by both the habit's ID and the user's ID.
+        db_habit = await run_read(db, crud.get_habit_row, current_user.id, habit_id)
+
+        # Raising a 404 is a good practice to avoid leaking information.
+        # We don't say "Habit found but you're not the owner."
+        if db_habit is None:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        body = _habit_row_adapter.dump_json(db_habit)
+        cached = CachedResponse(body, {"ETag": habit_etag(db_habit["id"], db_habit["version"])})
+        await response_cache.set(cache_key, cached, settings.RESPONSE_CACHE_TTL_SECONDS)
+
+    if etag_matches(request.headers.get("If-None-Match"), cached.headers["ETag"]):
+        return not_modified(cached.headers["ETag"])
+    return cached_json_response(cached)
 
 
 @router.put("/{habit_id}", response_model=HabitSchema)
-def update_habit(
-    habit_id: int, 
-    habit: HabitUpdate, 
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)
+async def update_habit(
+    habit_id: int,
+    habit: HabitUpdate,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_shard_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
 
-    db_habit = db.query(HabitModel).filter(
-        HabitModel.id == habit_id,
-        HabitModel.user_id == current_user.id
-    ).first()
+    # With If-Match set to the ETag the client read, the update only applies if nobody changed the habit since (412 otherwise).
+    expected_versions = expected_habit_versions(request.headers.get("If-Match"), habit_id)
+    try:
+        db_habit = await run_db(db, crud.update_habit, current_user.id, habit_id, habit, expected_versions)
+    except crud.HabitVersionConflict:
+        raise precondition_failed()
     if db_habit is None:
         raise HTTPException(status_code=404, detail="Habit not found")
-    
-    for key, value in habit.model_dump(exclude_unset=True).items():
-        setattr(db_habit, key, value)
-
-    db.commit()
-    db.refresh(db_habit)
+    await note_write(current_user.id)
+    await change_feed.publish_habit(current_user.id, db_habit)
+    response.headers["ETag"] = habit_etag(db_habit.id, db_habit.version)
     return db_habit
 
 
 @router.delete("/{habit_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_habit(
-    habit_id: int, 
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)
+async def delete_habit(
+    habit_id: int,
+    request: Request,
+    db: Session = Depends(get_shard_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
-    db_habit = db.query(HabitModel).filter(
-        HabitModel.id == habit_id,
-        HabitModel.user_id == current_user.id
-    ).first()
-    if db_habit is None:
+    expected_versions = expected_habit_versions(request.headers.get("If-Match"), habit_id)
+    try:
+        deleted = await run_db(db, crud.delete_habit, current_user.id, habit_id, expected_versions)
+    except crud.HabitVersionConflict:
+        raise precondition_failed()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Habit not found")
+    await note_write(current_user.id)
+    await change_feed.publish_deleted(current_user.id, habit_id)
+    return
 
-    db.delete(db_habit)
-    db.commit()
-    return
\ No newline at end of file
+
+# Logs a check-in for a habit. The server works out the new streak from the habit's frequency,
+# so clients no longer have to read the habit, compute the streak and write it back.
+@router.post("/{habit_id}/log", response_model=HabitSchema, status_code=status.HTTP_201_CREATED)
+async def log_habit(
+    habit_id: int,
+    db: Session = Depends(get_shard_session),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    db_habit = await run_db(db, crud.log_habit, current_user.id, habit_id)
+    if db_habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    await note_write(current_user.id)
+    await change_feed.publish_habit(current_user.id, db_habit)
+    return db_habit
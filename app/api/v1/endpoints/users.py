@@ -1,44 +1,110 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from app.database import crud
-from app.database.database import get_db
-from app.core.security import verify_password, get_password_hash
-from app.core.auth import create_access_token
+from app.database import crud, sharding
+from app.database.database import get_session, run_db
+from app.core.security import hash_password_async, hash_refresh_token, new_refresh_token, verify_password_async
+from app.core.instrumentation import InstrumentedRoute
+from app.core.auth import create_access_token, decode_access_token, get_current_user, oauth2_scheme
+from app.core.cache import principal_cache
+from app.core.config import settings
+from app.core.streaks import utcnow
+from app.schemas.auth import AuthenticatedUser, RefreshRequest, Token
 from app.schemas.user import UserCreate, User as UserSchema
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
+import uuid
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
+# These handlers are async so that waiting on bcrypt does not hold a thread from the shared threadpool.
+# The hashing itself runs on the dedicated hashing pool, and the database calls go through `run_db`.
+# A new user's habits go to the shard the hash ring picks for them (see app/database/sharding.py).
 @router.post("/", response_model=UserSchema, status_code=status.HTTP_201_CREATED)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: UserCreate, db: Session = Depends(get_session)):
+    db_user = await run_db(db, crud.get_user_by_email, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    hashed_password = get_password_hash(user.password)
-    db_user = crud.create_user(db, email=user.email, password_hash=hashed_password)
+    hashed_password = await hash_password_async(user.password)
+    db_user = await run_db(db, crud.create_user, email=user.email, password_hash=hashed_password)
+    await sharding.place_user(db, db_user.id)
 
     return db_user
 
 
-@router.post("/token")
-def login_for_access_token(
+# An access token for the user, and the refresh token to get the next one with.
+# The access token's `sid` claim names the refresh token family (the session) it belongs to, so logging out can end both.
+def _token_response(user_id: int, email: str, family_id: str, refresh_token: str) -> Token:
+    access_token = create_access_token(data={"sub": email, "uid": user_id, "sid": family_id})
+    return Token(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    )
+
+
+def _refresh_token_expiry() -> datetime:
+    return utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+@router.post("/token", response_model=Token)
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+    user = await run_db(db, crud.get_user_by_email, email=form_data.username)
+    password_ok, new_hash = False, None
+    if user:
+        password_ok, new_hash = await verify_password_async(form_data.password, user.password_hash)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+    # The stored hash was made with outdated settings (e.g. a lower bcrypt cost), so we replace it while we have the password.
+    if new_hash:
+        await run_db(db, crud.rehash_user_password, user, new_hash)
+    family_id = uuid.uuid4().hex
+    refresh_token, refresh_token_hash = new_refresh_token()
+    await run_db(db, crud.create_refresh_token, user.id, refresh_token_hash, family_id, _refresh_token_expiry())
+    return _token_response(user.id, user.email, family_id, refresh_token)
+
+
+# Exchanges a refresh token for a new access token and a new refresh token, without the password (and without bcrypt).
+# Each refresh token works once; reusing one revokes every token of its session. See crud.rotate_refresh_token.
+@router.post("/token/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db: Session = Depends(get_session)):
+    refresh_token, refresh_token_hash = new_refresh_token()
+    rotated = await run_db(
+        db, crud.rotate_refresh_token, hash_refresh_token(body.refresh_token), refresh_token_hash, _refresh_token_expiry()
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user_id, email, family_id = rotated
+    return _token_response(user_id, email, family_id, refresh_token)
+
+
+# Revokes the token the request was made with, so it stops working before it expires, and the refresh tokens of its session.
+# Tokens issued before tokens had an id (`jti`) can't be revoked and simply run out.
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    token: str = Depends(oauth2_scheme),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: Session = Depends(get_session)
+):
+    claims = decode_access_token(token)
+    if current_user.jti is not None:
+        expires_at = datetime.fromtimestamp(claims["exp"], timezone.utc).replace(tzinfo=None)
+        await run_db(db, crud.revoke_token, current_user.jti, current_user.id, expires_at)
+    if claims.get("sid") is not None:
+        await run_db(db, crud.revoke_refresh_token_family, claims["sid"])
+    principal_cache.pop(token)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
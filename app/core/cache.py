@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+from app.core.config import settings
+
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache where every entry also carries its own expiry time.
+    Lookups, inserts and evictions are O(1); the least recently used entry is dropped once maxsize is reached.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Removes every entry whose value matches the predicate. This is O(n), so it is meant for rare events
+    # such as a user being deleted, not for the request path.
+    def pop_where(self, predicate: Callable[[Any], bool]):
+        with self._lock:
+            for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Verified tokens mapped to the authenticated principal they belong to, so get_current_user can skip
+# both the JWT decode and the user lookup for tokens it has already seen.
+principal_cache = TTLCache(maxsize=settings.AUTH_CACHE_MAX_ENTRIES)
+
+
+# Drops every cached token of a user. Call this when the user is deleted or their password changes.
+def invalidate_user(user_id: int):
+    principal_cache.pop_where(lambda principal: principal.id == user_id)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: Dict[str, str]
+
+
+class MemoryResponseCache:
+    """
+    Keeps serialized responses in an in-process LRU. Each worker process has its own.
+    Its methods are async like RedisResponseCache's, though nothing here waits.
+    """
+
+    def __init__(self, maxsize: int):
+        self._entries = TTLCache(maxsize)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, response: CachedResponse, ttl: float):
+        self._entries.set(key, response, ttl)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisResponseCache:
+    """
+    Keeps serialized responses in Redis, so every worker process shares them. Needs the `redis` package.
+    Uses the asyncio client, so a cached read doesn't stall the event loop while it waits on Redis.
+    """
+
+    prefix = "wellness:responses:"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    # Stored as a 4-byte header length, the headers as JSON, then the body as-is.
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        value = await self._redis.get(self.prefix + key)
+        if value is None:
+            return None
+        headers_length = int.from_bytes(value[:4], "big")
+        return CachedResponse(value[4 + headers_length:], json.loads(value[4:4 + headers_length]))
+
+    async def set(self, key: str, response: CachedResponse, ttl: float):
+        headers = json.dumps(response.headers).encode()
+        await self._redis.set(self.prefix + key, len(headers).to_bytes(4, "big") + headers + response.body, ex=max(1, int(ttl)))
+
+    async def clear(self):
+        async for key in self._redis.scan_iter(self.prefix + "*"):
+            await self._redis.delete(key)
+
+
+class NullResponseCache:
+    """Used when response caching is turned off."""
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return None
+
+    async def set(self, key: str, response: CachedResponse, ttl: float):
+        pass
+
+    async def clear(self):
+        pass
+
+
+def create_response_cache():
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("RESPONSE_CACHE_BACKEND=redis requires REDIS_URL")
+        return RedisResponseCache(settings.REDIS_URL)
+    if settings.RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES)
+    return NullResponseCache()
+
+
+# Serialized habit responses, keyed by user and habit version (see app/core/etags.py).
+# Entries never need invalidating: a change bumps the version, so the old entries are simply no longer asked for.
+response_cache = create_response_cache()
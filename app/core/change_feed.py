@@ -0,0 +1,212 @@
+"""
+Pushes habit changes to every stream the user has open (GET /v1/habits/stream), as Server-Sent Events.
+
+The habit endpoints publish each change once it is committed. The broker hands it to the ChangeHub of every worker:
+- "memory" delivers straight to this process's hub, which is enough with a single worker
+- "redis" publishes on a Redis channel that every worker's hub listens on, so a change made on one worker
+  reaches the streams held by the others (needs REDIS_URL and the redis package)
+
+The hub keeps, per user, one bounded queue per open stream. An event is encoded once, however many streams receive it.
+A stream that falls STREAM_QUEUE_SIZE events behind (a slow or stalled client) doesn't hold up the publisher or grow
+without limit: its backlog is dropped and replaced by a single `resync` event, after which the client catches up with
+GET /v1/habits/changes. An idle stream costs its queue and a keep-alive comment every STREAM_KEEPALIVE_SECONDS.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+from app.core.config import settings
+from app.schemas.habit import Habit as HabitSchema
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_FRAME = b": keepalive\n\n"
+
+
+# One Server-Sent Event. `data` is JSON without newlines, so it fits on a single data line.
+def sse_frame(event: str, data: bytes) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+
+RESYNC_FRAME = sse_frame("resync", b"{}")
+
+
+class Subscription:
+    """The queue of encoded events waiting to be sent on one stream."""
+
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+
+    # Never blocks: when the queue is full, the backlog is replaced by a `resync` event.
+    def push(self, frames: Optional[bytes]):
+        try:
+            self._queue.put_nowait(frames)
+        except asyncio.QueueFull:
+            self._drain()
+            self._queue.put_nowait(RESYNC_FRAME)
+
+    def _drain(self):
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    # Ends the stream, even if its queue is full.
+    def close(self):
+        self._drain()
+        self._queue.put_nowait(None)
+
+    # The next events to send, KEEPALIVE_FRAME if nothing happened for `timeout` seconds, or None once closed.
+    # The keep-alive is a plain timer that queues KEEPALIVE_FRAME, which is much cheaper than asyncio.wait_for's
+    # task per wait when a change fans out to thousands of streams.
+    async def next_frames(self, timeout: float) -> Optional[bytes]:
+        if not self._queue.empty():
+            return self._queue.get_nowait()
+        timer = asyncio.get_running_loop().call_later(timeout, self._keepalive)
+        try:
+            return await self._queue.get()
+        finally:
+            timer.cancel()
+
+    def _keepalive(self):
+        if self._queue.empty():
+            self._queue.put_nowait(KEEPALIVE_FRAME)
+
+
+class ChangeHub:
+    """The open streams of this process, by user. Only used from the event loop, so no lock is needed."""
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, settings.STREAM_QUEUE_SIZE)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def deliver(self, user_id: int, frames: bytes):
+        for subscription in self._subscriptions.get(user_id, ()):
+            subscription.push(frames)
+
+    # Tells every stream to resync, e.g. after the broker lost its connection and may have missed events.
+    def resync_all(self):
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.push(RESYNC_FRAME)
+
+    def connection_count(self, user_id: Optional[int] = None) -> int:
+        if user_id is not None:
+            return len(self._subscriptions.get(user_id, ()))
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    # Ends every open stream, so a shutting down worker doesn't wait on them.
+    def close(self):
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in subscriptions:
+                subscription.close()
+
+
+class MemoryChangeBroker:
+    """Delivers changes to this process's hub only."""
+
+    def __init__(self, hub: ChangeHub):
+        self.hub = hub
+
+    async def publish(self, user_id: int, frames: bytes):
+        self.hub.deliver(user_id, frames)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class RedisChangeBroker:
+    """
+    Publishes changes on one Redis channel that every worker subscribes to, and delivers what it receives to its hub.
+    Each message is the user id and the encoded events; workers without a stream for that user simply drop it.
+    """
+
+    channel = "wellness:habit-changes"
+
+    def __init__(self, url: str, hub: ChangeHub):
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.hub = hub
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, user_id: int, frames: bytes):
+        await self._redis.publish(self.channel, str(user_id).encode() + b"\n" + frames)
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._redis.aclose()
+
+    # Keeps listening across lost connections. Events published while disconnected are gone, so every stream resyncs.
+    async def _listen(self):
+        while True:
+            try:
+                async with self._redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        user_id, frames = message["data"].split(b"\n", 1)
+                        self.hub.deliver(int(user_id), frames)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the habit change channel, reconnecting")
+                self.hub.resync_all()
+                await asyncio.sleep(1)
+
+
+def create_change_broker(hub: ChangeHub):
+    if settings.CHANGE_BROKER_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("CHANGE_BROKER_BACKEND=redis requires REDIS_URL")
+        return RedisChangeBroker(settings.REDIS_URL, hub)
+    return MemoryChangeBroker(hub)
+
+
+hub = ChangeHub()
+change_broker = create_change_broker(hub)
+
+
+# The change is already committed when this runs, so a broker failure is logged rather than failing the request.
+async def _publish(user_id: int, frames: bytes):
+    try:
+        await change_broker.publish(user_id, frames)
+    except Exception:
+        logger.exception("Could not publish a habit change for user %s", user_id)
+
+
+# Publishes habits that were created, updated or checked in, and the ids of habits that were deleted, as one message.
+async def publish_changes(user_id: int, habits=(), deleted_ids=()):
+    frames = [sse_frame("upsert", habit.model_dump_json().encode()) for habit in habits]
+    frames += [sse_frame("delete", b'{"id":%d}' % habit_id) for habit_id in deleted_ids]
+    if frames:
+        await _publish(user_id, b"".join(frames))
+
+
+async def publish_habit(user_id: int, habit: HabitSchema):
+    await publish_changes(user_id, habits=[habit])
+
+
+async def publish_deleted(user_id: int, habit_id: int):
+    await publish_changes(user_id, deleted_ids=[habit_id])
+
+
+# For changes too large to push one by one, like an import: the user's streams catch up through GET /v1/habits/changes.
+async def publish_resync(user_id: int):
+    await _publish(user_id, RESYNC_FRAME)
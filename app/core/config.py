@@ -1,10 +1,124 @@
+import os
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # "sync" runs queries on a regular Session in the threadpool; "async" uses an AsyncSession on the event loop.
+    DB_MODE: Literal["sync", "async"] = "sync"
+    # Only needed when the async driver URL can't be derived from DATABASE_URL.
+    ASYNC_DATABASE_URL: Optional[str] = None
+
+    # Connection pool settings. pre-ping and recycling protect against connections the server (or a proxy) has already closed.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Postgres only: queries running longer than this are cancelled by the server.
+    DB_STATEMENT_TIMEOUT_MS: Optional[int] = None
+    # Set when connecting through PgBouncer in transaction mode: PgBouncer does the pooling, so we don't pool
+    # on our side and we turn off server-side prepared statements, which don't survive connection switching.
+    DB_PGBOUNCER_MODE: bool = False
+    # Comma-separated URLs of read replicas. Read endpoints rotate between them, falling back to the primary if one fails
+    # (and skipping it for REPLICA_RETRY_SECONDS). After a write, the user reads from the primary for REPLICA_STICKY_SECONDS.
+    DATABASE_REPLICA_URLS: str = ""
+    REPLICA_RETRY_SECONDS: float = 30
+    REPLICA_STICKY_SECONDS: float = 5
+    # Horizontal sharding of the habit data by user (see app/database/sharding.py): comma-separated <id>=<URL> pairs,
+    # with shard ids from 1 to 1023. DATABASE_URL is shard 0 and keeps the users, tokens and the shard directory.
+    # New users are placed on a consistent hash ring with SHARD_VIRTUAL_NODES points per shard. Each worker caches
+    # where a user is for SHARD_DIRECTORY_CACHE_SECONDS. Moving a user (app/database/rebalance.py) copies
+    # SHARD_MOVE_BATCH_SIZE rows per transaction and waits SHARD_MOVE_GRACE_SECONDS after each directory change,
+    # which must be longer than the cache and the slowest write; the user's writes get 503 meanwhile.
+    DATABASE_SHARD_URLS: str = ""
+    SHARD_VIRTUAL_NODES: int = 128
+    SHARD_DIRECTORY_CACHE_SECONDS: float = 10
+    SHARD_MOVE_BATCH_SIZE: int = 1000
+    SHARD_MOVE_GRACE_SECONDS: float = 40
+    SHARD_MOVE_RETRY_AFTER_SECONDS: int = 5
     SECRET_KEY: str
+    # "HS256" signs tokens with SECRET_KEY. "RS256" or "ES256" sign with the PEM private keys in JWT_KEY_DIR
+    # (named <kid>.pem), using JWT_ACTIVE_KID or else the last one by name. See app/core/jwt_keys.py.
     ALGORITHM: str = "HS256"
+    JWT_KEY_DIR: Optional[str] = None
+    JWT_ACTIVE_KID: Optional[str] = None
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Refresh tokens let clients get a new access token without sending the password again (and costing a bcrypt
+    # check). Each one is good for a single use within REFRESH_TOKEN_EXPIRE_DAYS, and is replaced by a new one.
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+
+    # Revoked tokens are kept in a table and, in each process, in a Bloom filter sized for REVOCATION_BLOOM_CAPACITY
+    # entries at REVOCATION_BLOOM_ERROR_RATE false positives. New revocations are picked up every REVOCATION_SYNC_SECONDS.
+    # The filter is rebuilt without the expired ones every REVOCATION_REBUILD_SECONDS, or as soon as it is full.
+    REVOCATION_BLOOM_CAPACITY: int = 100_000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    REVOCATION_SYNC_SECONDS: float = 5
+    REVOCATION_REBUILD_SECONDS: float = 3600
+
+    # Verified-token cache used by get_current_user. Entries never outlive the token's own `exp`.
+    # Deleting a user or changing their password clears their entries in the process that made the change only:
+    # other workers keep accepting the user's existing tokens for up to AUTH_CACHE_TTL_SECONDS. Revoke the tokens
+    # (see REVOCATION_* below) when that has to take effect everywhere at once.
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    AUTH_CACHE_TTL_SECONDS: int = 300
+
+    # Password hashing. Raising BCRYPT_ROUNDS upgrades existing hashes the next time each user logs in.
+    BCRYPT_ROUNDS: int = 12
+    HASHING_POOL_WORKERS: int = os.cpu_count() or 1
+    HASHING_QUEUE_MAX: int = 32
+    HASHING_RETRY_AFTER_SECONDS: int = 1
+
+    # Serialized habit responses are cached per user and habit version: "memory" (an LRU in each process),
+    # "redis" (shared, needs REDIS_URL and the redis package) or "none".
+    RESPONSE_CACHE_BACKEND: Literal["memory", "redis", "none"] = "memory"
+    RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    RESPONSE_CACHE_TTL_SECONDS: int = 300
+    REDIS_URL: Optional[str] = None
+
+    # Rate limiting (see app/core/rate_limit.py). Each user, or each IP for anonymous requests, gets a token bucket of
+    # RATE_LIMIT_BURST requests refilled at RATE_LIMIT_PER_SECOND. Logins and sign-ups are limited per IP, and logins
+    # per email too. "memory" buckets are per process (at most RATE_LIMIT_MAX_KEYS of them); "redis" shares them.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "redis"] = "memory"
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    RATE_LIMIT_PER_SECOND: float = 10
+    RATE_LIMIT_BURST: int = 50
+    RATE_LIMIT_AUTH_IP_PER_MINUTE: float = 30
+    RATE_LIMIT_AUTH_IP_BURST: int = 30
+    RATE_LIMIT_LOGIN_PER_MINUTE: float = 5
+    RATE_LIMIT_LOGIN_BURST: int = 10
+    # Each worker handles at most this many requests at once and answers 503 beyond that. 0 turns the limit off.
+    MAX_CONCURRENT_REQUESTS: int = 200
+    OVERLOAD_RETRY_AFTER_SECONDS: int = 1
+
+    # Habit change streams (GET /v1/habits/stream, see app/core/change_feed.py). Each stream buffers up to
+    # STREAM_QUEUE_SIZE events before it is told to resync, and gets a keep-alive every STREAM_KEEPALIVE_SECONDS.
+    # Streams don't count towards MAX_CONCURRENT_REQUESTS; each worker holds at most MAX_STREAM_CONNECTIONS of them.
+    # "memory" only reaches streams on the worker that made the change; "redis" reaches every worker (needs REDIS_URL).
+    CHANGE_BROKER_BACKEND: Literal["memory", "redis"] = "memory"
+    STREAM_QUEUE_SIZE: int = 100
+    STREAM_KEEPALIVE_SECONDS: float = 15
+    MAX_STREAM_CONNECTIONS: int = 10_000
+
+    # Streaks of habits that missed a period are reset by app/database/streak_expiry.py, which every worker runs
+    # about every STREAK_EXPIRY_INTERVAL_SECONDS (0 turns it off, e.g. to run the CLI from cron instead). An advisory
+    # lock lets only one of them work at a time. Habits are handled STREAK_EXPIRY_CHUNK_SIZE at a time, one transaction each.
+    STREAK_EXPIRY_INTERVAL_SECONDS: float = 3600
+    STREAK_EXPIRY_CHUNK_SIZE: int = 5000
+
+    # Request instrumentation. Requests slower than SLOW_REQUEST_MS are logged, and so are statements that run
+    # at least N_PLUS_ONE_THRESHOLD times in one request.
+    SLOW_REQUEST_MS: float = 500
+    N_PLUS_ONE_THRESHOLD: int = 10
+    # Sampling profiler: a PROFILE_SAMPLE_RATE fraction of requests is profiled with cProfile and the stats are
+    # written to PROFILE_DIR. With PROFILE_HEADER_ENABLED, sending PROFILE_HEADER profiles that request too.
+    # A profile covers the whole event loop while it runs, so it includes any concurrent requests as well.
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_HEADER_ENABLED: bool = False
+    PROFILE_HEADER: str = "X-Debug-Profile"
+    PROFILE_DIR: str = "profiles"
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,73 @@
+from typing import List, Optional
+
+from fastapi import HTTPException, Response, status
+
+from app.core.cache import CachedResponse
+
+# Habit lists are versioned per user: every habit change increases the user's habit version
+# (see crud.bump_habit_version). A list only depends on the user, that version and the request itself,
+# so the version doubles as the list's strong ETag and as the key of serialized responses in the response cache.
+# A single habit's ETag is its own `version` column, which is also what If-Match is checked against.
+
+
+def habit_list_etag(user_id: int, version: int) -> str:
+    return f'"{user_id}-{version}"'
+
+
+def habit_etag(habit_id: int, version: int) -> str:
+    return f'"{habit_id}.{version}"'
+
+
+# Cache key of a serialized response. `resource` identifies what was asked for, e.g. the page of a list.
+def response_cache_key(user_id: int, version: int, resource: str) -> str:
+    return f"habits:{user_id}:{version}:{resource}"
+
+
+def _etag_list(header: str) -> List[str]:
+    return [candidate.strip() for candidate in header.split(",")]
+
+
+# Whether an If-None-Match header matches the current ETag. The header may list several ETags, or be "*".
+# If-None-Match uses weak comparison, so a W/ prefix is ignored.
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.removeprefix("W/") == etag for candidate in _etag_list(if_none_match))
+
+
+# The habit versions an If-Match header allows a write to apply to, or None for an unconditional write
+# (no header, or "*"). An If-Match that names no version of this habit can never succeed, so it fails right away.
+def expected_habit_versions(if_match: Optional[str], habit_id: int) -> Optional[List[int]]:
+    if not if_match or if_match.strip() == "*":
+        return None
+    prefix = f'"{habit_id}.'
+    versions = [
+        int(candidate[len(prefix):-1]) for candidate in _etag_list(if_match)
+        if candidate.startswith(prefix) and candidate.endswith('"') and candidate[len(prefix):-1].isdigit()
+    ]
+    if not versions:
+        raise precondition_failed()
+    return versions
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="Habit has been modified since it was read",
+    )
+
+
+# Clients may keep the response but have to revalidate it; shared caches must not keep it at all.
+def _validator_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=_validator_headers(etag))
+
+
+# The cached headers include the ETag of the response.
+def cached_json_response(cached: CachedResponse) -> Response:
+    return Response(content=cached.body, media_type="application/json", headers={**cached.headers, **_validator_headers(cached.headers["ETag"])})
@@ -0,0 +1,195 @@
+"""
+Reading and writing habit export files (CSV and NDJSON), one batch of rows at a time.
+
+Exports encode the batches of a server-side cursor. Imports parse the request body as it arrives and
+validate it in chunks, so neither side holds more than a batch in memory, however large the file is.
+Validated imports are spooled (to a temporary file past IMPORT_SPOOL_MEMORY_BYTES) until the upload is complete,
+and only then inserted, so the database never waits on the client.
+"""
+import codecs
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Iterator, List, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from app.schemas.habit import HabitImport, HabitRow
+
+# The columns of an export, in order. Imports read the columns they know and ignore the rest
+# (ids, owners and versions are assigned anew).
+EXPORT_COLUMNS = list(HabitRow.__annotations__)
+
+# How many rows are validated and inserted at a time.
+IMPORT_CHUNK_SIZE = 1000
+
+# The most rows one import may have, and how much of a validated import is kept in memory before it goes to disk.
+MAX_IMPORT_ROWS = 100_000
+IMPORT_SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+# A single line (or CSV record) may not grow beyond this, so a file without newlines can't exhaust memory.
+MAX_IMPORT_LINE_BYTES = 64 * 1024
+
+_row_adapter = TypeAdapter(HabitRow)
+_import_adapter = TypeAdapter(List[HabitImport])
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_header() -> bytes:
+    return (",".join(EXPORT_COLUMNS) + "\r\n").encode()
+
+
+def csv_batch(rows: List[dict]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([_csv_value(row[column]) for column in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def ndjson_batch(rows: List[dict]) -> bytes:
+    return b"".join(_row_adapter.dump_json(row) + b"\n" for row in rows)
+
+
+def _line_too_long(line_number: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Line {line_number} is longer than {MAX_IMPORT_LINE_BYTES} bytes",
+    )
+
+
+# Splits a stream of byte chunks into lines of text, without their line endings, yielding the complete lines
+# of each chunk as a list (one async step per chunk rather than per line). A UTF-8 BOM is dropped.
+async def text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[str]]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    line_count = 0
+    async for chunk in chunks:
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The file is not valid UTF-8")
+        *lines, pending = pending.split("\n")
+        line_count += len(lines)
+        if len(pending) > MAX_IMPORT_LINE_BYTES:
+            raise _line_too_long(line_count + 1)
+        if lines:
+            yield [line.rstrip("\r") for line in lines]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending.rstrip("\r")]
+
+
+# The records of a CSV file as dicts keyed by its header row, in lists. A quoted field may span several lines:
+# a record is complete once its quotes are balanced. Empty fields are left out, so the schema defaults apply.
+async def csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[dict]]:
+    columns = None
+    record = ""
+    async for lines in text_lines(chunks):
+        complete = []
+        for line in lines:
+            record = f"{record}\n{line}" if record else line
+            if '"' in record and record.count('"') % 2:
+                if len(record) > MAX_IMPORT_LINE_BYTES:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="A quoted field is too long")
+                continue
+            if record.strip():
+                complete.append(record)
+            record = ""
+
+        records = []
+        for values in csv.reader(complete):
+            if columns is None:
+                columns = [column.strip() for column in values]
+                continue
+            records.append({column: value for column, value in zip(columns, values) if value != ""})
+        if records:
+            yield records
+    if record:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The file ends inside a quoted field")
+
+
+# The records of an NDJSON file, one JSON object per non-empty line, in lists.
+async def ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[dict]]:
+    record_count = 0
+    async for lines in text_lines(chunks):
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            record_count += 1
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Record {record_count} is not valid JSON")
+        if records:
+            yield records
+
+
+# Parsers for the content types POST /v1/habits/import accepts.
+IMPORT_PARSERS = {
+    "text/csv": csv_records,
+    "application/x-ndjson": ndjson_records,
+}
+
+
+# Validates a chunk of records in one go. Errors are reported like any other 422, with the record's
+# (1-based) position in the file in place of the list index.
+def _validate_chunk(records: List[dict], first_record: int) -> List[HabitImport]:
+    try:
+        return _import_adapter.validate_python(records)
+    except ValidationError as exc:
+        errors = []
+        for error in exc.errors(include_url=False):
+            index, *field = error["loc"]
+            errors.append({**error, "loc": ("body", first_record + index, *field)})
+        raise RequestValidationError(errors)
+
+
+# Regroups the parsed records into validated chunks of IMPORT_CHUNK_SIZE.
+async def validated_chunks(record_lists: AsyncIterator[List[dict]]) -> AsyncIterator[List[HabitImport]]:
+    chunk = []
+    first_record = 1
+    async for records in record_lists:
+        chunk.extend(records)
+        while len(chunk) >= IMPORT_CHUNK_SIZE:
+            yield _validate_chunk(chunk[:IMPORT_CHUNK_SIZE], first_record)
+            first_record += IMPORT_CHUNK_SIZE
+            del chunk[:IMPORT_CHUNK_SIZE]
+    if chunk:
+        yield _validate_chunk(chunk, first_record)
+
+
+# Reads and validates the whole upload, keeping the validated chunks in a temporary file, one JSON array per line.
+# Returns the file, rewound, and the number of rows in it. Uploads of more than MAX_IMPORT_ROWS rows get a 413.
+async def spool_import(record_lists: AsyncIterator[List[dict]]) -> Tuple[BinaryIO, int]:
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY_BYTES)
+    rows = 0
+    try:
+        async for chunk in validated_chunks(record_lists):
+            rows += len(chunk)
+            if rows > MAX_IMPORT_ROWS:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"An import can have at most {MAX_IMPORT_ROWS} rows",
+                )
+            spool.write(_import_adapter.dump_json(chunk) + b"\n")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, rows
+
+
+# The chunks of a file written by spool_import.
+def spooled_chunks(spool: BinaryIO) -> Iterator[List[HabitImport]]:
+    for line in spool:
+        yield _import_adapter.validate_json(line)
@@ -0,0 +1,223 @@
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.instrumentation")
+
+
+class RequestMetrics:
+    """Where the time of one request went. Durations are in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = Counter()
+        self.db_statements = Counter()
+        self.db_count = 0
+        self.endpoint_finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] += seconds
+
+    # Bulk statements (executemany) are counted and timed, but never reported as N+1 queries:
+    # running one per chunk is how bulk writes are meant to be done.
+    def add_query(self, statement: str, seconds: float, executemany: bool = False):
+        with self._lock:
+            self.timings["db"] += seconds
+            self.db_count += 1
+            if not executemany:
+                self.db_statements[statement] += 1
+
+
+# The metrics of the request being handled. Threadpool calls and AsyncSession greenlets run in a copy
+# of the request's context, so they see (and add to) the same RequestMetrics object.
+_current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def current_metrics() -> Optional[RequestMetrics]:
+    return _current_metrics.get()
+
+
+# Adds the time spent inside the block to the current request under `name` (e.g. "auth" or "hash").
+@contextmanager
+def timed(name: str):
+    metrics = _current_metrics.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.add(name, time.perf_counter() - started)
+
+
+# Every engine, including the async engines' sync cores, reports its statements to the current request.
+# The start time lives on the statement's execution context, which is dropped with the statement even if it fails
+# (and after_cursor_execute never runs), rather than on the pooled connection.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._instrumentation_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = context._instrumentation_started
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_query(statement, time.perf_counter() - started, executemany)
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    An APIRoute that notes when the endpoint function returns. Everything between that moment and
+    the start of the response is FastAPI validating and serializing the return value.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+# Wraps an endpoint so that it records when it returns. functools.wraps keeps the signature FastAPI reads the parameters from.
+def _timed_endpoint(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def call(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_finished()
+    else:
+        @functools.wraps(endpoint)
+        def call(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_finished()
+    return call
+
+
+def _mark_endpoint_finished():
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.endpoint_finished = time.perf_counter()
+
+
+# Turns the metrics into a Server-Timing header value, e.g. `auth;dur=0.4, db;dur=3.1;desc="2 queries", ...`.
+def server_timing_header(metrics: RequestMetrics, now: float) -> str:
+    parts = []
+    for name in ("auth", "hash"):
+        if name in metrics.timings:
+            parts.append(f"{name};dur={1000 * metrics.timings[name]:.2f}")
+    parts.append(f'db;dur={1000 * metrics.timings["db"]:.2f};desc="{metrics.db_count} queries"')
+    if metrics.endpoint_finished is not None:
+        parts.append(f"serialize;dur={1000 * (now - metrics.endpoint_finished):.2f}")
+    parts.append(f"total;dur={1000 * (now - metrics.started):.2f}")
+    return ", ".join(parts)
+
+
+# Statements run this many times in one request are most likely a query inside a loop (an N+1 pattern).
+def find_repeated_statements(metrics: RequestMetrics):
+    return [
+        (statement, count) for statement, count in metrics.db_statements.items()
+        if count >= settings.N_PLUS_ONE_THRESHOLD
+    ]
+
+
+_profile_lock = threading.Lock()
+
+
+class InstrumentationMiddleware:
+    """
+    Pure ASGI middleware that measures every HTTP request:
+    - adds a Server-Timing header with auth, hash (bcrypt), db, serialize and total time
+    - logs requests slower than SLOW_REQUEST_MS, and statements repeated often enough to look like N+1 queries
+    - profiles a PROFILE_SAMPLE_RATE fraction of requests (or those with the debug header) with cProfile.
+      cProfile sees everything the worker's thread runs while it is on, so the profile of a request also holds
+      whatever other requests the event loop interleaved with it. Profile under low concurrency to read it cleanly.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profile_header = settings.PROFILE_HEADER.lower().encode()
+
+    def _should_profile(self, scope) -> bool:
+        if settings.PROFILE_HEADER_ENABLED and any(name == self.profile_header for name, _ in scope["headers"]):
+            return True
+        return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        status_code = None
+        event_stream = False
+
+        # cProfile can only follow one request at a time, so concurrent candidates are simply not profiled.
+        profiler = None
+        if self._should_profile(scope) and _profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        profile_path = None
+        if profiler is not None:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            safe_path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+            profile_path = os.path.join(settings.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{safe_path}-{os.getpid()}.prof")
+
+        async def send_with_timing(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                event_stream = any(name == b"content-type" and value.startswith(b"text/event-stream") for name, value in headers)
+                headers.append((b"server-timing", server_timing_header(metrics, time.perf_counter()).encode()))
+                if profile_path is not None:
+                    headers.append((b"x-profile-file", os.path.basename(profile_path).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+                _profile_lock.release()
+                logger.info("Profiled %s %s into %s", scope["method"], scope["path"], profile_path)
+            _current_metrics.reset(token)
+            self._log_request(scope, status_code, metrics, event_stream)
+
+    # Event streams last as long as the client listens, so they are never reported as slow.
+    def _log_request(self, scope, status_code, metrics: RequestMetrics, event_stream: bool = False):
+        total_ms = 1000 * (time.perf_counter() - metrics.started)
+        if total_ms >= settings.SLOW_REQUEST_MS and not event_stream:
+            logger.warning(
+                "Slow request: %s %s -> %s in %.1fms (db %.1fms in %d queries, auth %.1fms, hash %.1fms)",
+                scope["method"], scope["path"], status_code, total_ms,
+                1000 * metrics.timings["db"], metrics.db_count,
+                1000 * metrics.timings["auth"], 1000 * metrics.timings["hash"],
+            )
+        for statement, count in find_repeated_statements(metrics):
+            logger.warning(
+                "Possible N+1 query: %s %s ran the same statement %d times: %s",
+                scope["method"], scope["path"], count, " ".join(statement.split())[:200],
+            )
@@ -0,0 +1,70 @@
+"""
+The keys access tokens are signed and verified with.
+
+With ALGORITHM=HS256 (the default) tokens are signed with SECRET_KEY, and only this API can verify them.
+With RS256 or ES256, every PEM private key in JWT_KEY_DIR is loaded, its file name being the key id (`kid`):
+- new tokens are signed with JWT_ACTIVE_KID (by default the last file in name order) and carry its `kid` in the header
+- tokens signed with any other key in the directory are still accepted, so keys can be rotated without logging anyone out:
+  add the new key, make it active, and delete the old file once the last tokens it signed have expired
+- the public keys are published at /.well-known/jwks.json, so other services can verify tokens without the private keys
+
+Keys are parsed once at import time; signing and verifying reuse the parsed key objects.
+"""
+import os
+from glob import glob
+from typing import Dict, List, NamedTuple, Optional
+
+from jose import jwk
+from jose.backends.base import Key
+
+from app.core.config import settings
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+
+class SigningKey(NamedTuple):
+    kid: Optional[str]
+    algorithm: str
+    private: Key  # signs new tokens
+    public: Key  # verifies them (the same key for HMAC)
+    public_jwk: Optional[dict]  # what /.well-known/jwks.json publishes; None for HMAC keys
+
+
+class KeyRing:
+    """Every key tokens may be signed with, by `kid`, and the one that signs new tokens."""
+
+    def __init__(self, keys: List[SigningKey], active_kid: Optional[str]):
+        self.keys: Dict[Optional[str], SigningKey] = {key.kid: key for key in keys}
+        if active_kid not in self.keys:
+            raise ValueError(f"JWT_ACTIVE_KID {active_kid!r} is not one of the loaded keys: {sorted(map(str, self.keys))}")
+        self.active = self.keys[active_kid]
+
+    def verification_key(self, kid: Optional[str]) -> Optional[SigningKey]:
+        return self.keys.get(kid)
+
+    # The public keys as a JWK Set (RFC 7517).
+    def jwks(self) -> dict:
+        return {"keys": [key.public_jwk for key in self.keys.values() if key.public_jwk is not None]}
+
+
+def _load_pem_key(path: str, algorithm: str) -> SigningKey:
+    kid = os.path.basename(path)[:-len(".pem")]
+    with open(path) as pem:
+        private = jwk.construct(pem.read(), algorithm)
+    public = private.public_key()
+    return SigningKey(kid, algorithm, private, public, {**public.to_dict(), "kid": kid, "use": "sig", "alg": algorithm})
+
+
+def load_key_ring(algorithm: str, secret_key: str, key_dir: Optional[str] = None, active_kid: Optional[str] = None) -> KeyRing:
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        key = jwk.construct(secret_key, algorithm)
+        return KeyRing([SigningKey(None, algorithm, key, key, None)], None)
+
+    paths = sorted(glob(os.path.join(key_dir or "", "*.pem")))
+    if not paths:
+        raise ValueError(f"ALGORITHM={algorithm} needs PEM private keys in JWT_KEY_DIR")
+    keys = [_load_pem_key(path, algorithm) for path in paths]
+    return KeyRing(keys, active_kid or keys[-1].kid)
+
+
+key_ring = load_key_ring(settings.ALGORITHM, settings.SECRET_KEY, settings.JWT_KEY_DIR, settings.JWT_ACTIVE_KID)
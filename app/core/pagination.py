@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+# Page sizes for the list endpoints. Clients can ask for fewer rows with `limit`, never more than MAX_PAGE_SIZE.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# How many rows the server-side cursor fetches per round trip when streaming.
+STREAM_BATCH_SIZE = 500
+
+
+# Encodes the position of the last row of a page into an opaque cursor string.
+# Pages in id order only need the last id. Other orders also need the last row's sort value, and record the
+# sort they belong to, so a cursor can't be replayed against another order.
+# Clients should treat cursors as opaque so we can change what goes inside them later.
+def encode_cursor(last_id: int, sort: str = "id", sort_value: Any = None) -> str:
+    if sort == "id":
+        payload = str(last_id)
+    else:
+        if isinstance(sort_value, datetime):
+            sort_value = {"t": sort_value.isoformat()}
+        payload = json.dumps([sort, sort_value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+# Decodes a cursor produced by encode_cursor for the same sort into (sort value, last id).
+# For the id order both are the last id. For other orders the sort value must be a `value_type` (or None if
+# `nullable`), since it is compared against the sort column: anything else is rejected like a malformed cursor.
+def decode_cursor(
+    cursor: Optional[str], sort: str = "id", value_type: type = int, nullable: bool = False,
+) -> Optional[Tuple[Any, int]]:
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = base64.urlsafe_b64decode(padded.encode()).decode()
+        if sort == "id":
+            last_id = int(payload)
+            return last_id, last_id
+        cursor_sort, sort_value, last_id = json.loads(payload)
+        if cursor_sort != sort or type(last_id) is not int:
+            raise ValueError(cursor)
+        if value_type is datetime and isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value["t"])
+        if sort_value is None and not nullable or sort_value is not None and type(sort_value) is not value_type:
+            raise ValueError(cursor)
+        return sort_value, last_id
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+# The `Link: <...>; rel="next"` and `X-Next-Cursor` headers, when there is another page.
+def next_page_headers(request: Request, next_cursor: Optional[str], limit: int) -> Dict[str, str]:
+    if next_cursor is None:
+        return {}
+    next_url = request.url.include_query_params(after=next_cursor, limit=limit)
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
@@ -0,0 +1,260 @@
+"""
+Rate limiting and admission control, as a pure ASGI middleware that runs before routing.
+
+Every request takes a token from a token bucket:
+- authenticated requests are keyed by user id (from the principal cache, or the token's verified claims)
+- anonymous requests are keyed by client IP
+- logins and sign-ups have their own, stricter buckets per IP, and logins one per email as well, since each attempt costs a bcrypt hash
+
+An empty bucket answers 429 with Retry-After. Separately, each worker admits at most MAX_CONCURRENT_REQUESTS requests
+at a time and answers 503 beyond that, so a burst is shed straight away instead of queueing up for the threadpool.
+Habit change streams stay open for as long as the client listens, so they take a token but don't count as in flight.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from app.core.auth import peek_user_id
+from app.core.config import settings
+
+# Login bodies are tiny; anything bigger than this is not parsed for the email.
+MAX_LOGIN_BODY_BYTES = 16 * 1024
+
+LOGIN_PATH = "/v1/users/token"
+SIGNUP_PATH = "/v1/users/"
+STREAM_PATH = "/v1/habits/stream"
+
+# Refills and takes a token atomically, so every worker shares the same buckets.
+# Returns 0 when a token was taken, otherwise the seconds until the next one is available.
+REDIS_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(1000 * burst / rate))
+return tostring(wait)
+"""
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens added per second
+    burst: int  # bucket size
+
+
+class MemoryTokenBuckets:
+    """
+    Token buckets in an in-process LRU: taking a token is O(1), and memory is bounded by maxsize.
+    A bucket evicted for being least recently used simply starts out full again next time.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns 0 when a token was taken, otherwise the seconds until the next one is available.
+    # Async like RedisTokenBuckets.take, though nothing here waits.
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = float(limit.burst)
+            else:
+                tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+                self._buckets.move_to_end(key)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    # Async like RedisTokenBuckets.clear, so callers can clear either backend the same way.
+    async def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisTokenBuckets:
+    """
+    Token buckets in Redis, shared by every worker process. Needs the `redis` package.
+    Uses the asyncio client, so waiting on Redis doesn't hold up the worker's other requests.
+    """
+
+    prefix = "wellness:ratelimit:"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(REDIS_TAKE_SCRIPT)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        return float(await self._take(keys=[self.prefix + key], args=[limit.rate, limit.burst, time.time()]))
+
+    async def clear(self):
+        async for key in self._redis.scan_iter(self.prefix + "*"):
+            await self._redis.delete(key)
+
+
+def create_token_buckets():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("RATE_LIMIT_BACKEND=redis requires REDIS_URL")
+        return RedisTokenBuckets(settings.REDIS_URL)
+    return MemoryTokenBuckets(settings.RATE_LIMIT_MAX_KEYS)
+
+
+token_buckets = create_token_buckets()
+
+
+# The limits are read on every request, so they can be changed at runtime (and in tests).
+def request_limit() -> Limit:
+    return Limit(settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+
+
+def auth_ip_limit() -> Limit:
+    return Limit(settings.RATE_LIMIT_AUTH_IP_PER_MINUTE / 60, settings.RATE_LIMIT_AUTH_IP_BURST)
+
+
+def login_email_limit() -> Limit:
+    return Limit(settings.RATE_LIMIT_LOGIN_PER_MINUTE / 60, settings.RATE_LIMIT_LOGIN_BURST)
+
+
+def _client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token
+            return None
+    return None
+
+
+def _is_form(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.startswith(b"application/x-www-form-urlencoded")
+    return False
+
+
+# Reads the (small) login body to find the email, and returns it along with a `receive` that replays the body to the
+# endpoint. Reading stops once the body is bigger than MAX_LOGIN_BODY_BYTES: what was read is replayed, and the endpoint
+# receives the rest of the body as it arrives, so an oversized body is never held in memory here.
+async def _peek_login_email(scope, receive):
+    body = b""
+    more_body = True
+    while more_body and len(body) <= MAX_LOGIN_BODY_BYTES:
+        message = await receive()
+        if message["type"] != "http.request":
+            return None, receive
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": more_body}
+        return await receive()
+
+    email = None
+    if not more_body and len(body) <= MAX_LOGIN_BODY_BYTES and _is_form(scope):
+        usernames = parse_qs(body.decode("utf-8", "replace")).get("username")
+        if usernames:
+            email = usernames[0].strip().lower()
+    return email, replay
+
+
+def _error_response(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimitMiddleware:
+    """Sheds requests beyond MAX_CONCURRENT_REQUESTS with a 503, then applies the token buckets."""
+
+    def __init__(self, app):
+        self.app = app
+        # Requests currently being handled by this worker. Only touched from the event loop, so no lock is needed.
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] == STREAM_PATH:
+            await self._admit(scope, receive, send)
+            return
+
+        if settings.MAX_CONCURRENT_REQUESTS and self.in_flight >= settings.MAX_CONCURRENT_REQUESTS:
+            response = _error_response(503, "Server is busy, please retry shortly", settings.OVERLOAD_RETRY_AFTER_SECONDS)
+            await response(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self._admit(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _admit(self, scope, receive, send):
+        if settings.RATE_LIMIT_ENABLED:
+            wait, receive = await self._take_tokens(scope, receive)
+            if wait > 0:
+                response = _error_response(429, "Too many requests", wait)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    # Returns the seconds to wait (0 if the request may go ahead), and the `receive` to hand to the app.
+    async def _take_tokens(self, scope, receive):
+        ip = _client_ip(scope)
+        method, path = scope["method"], scope["path"]
+
+        if method == "POST" and path in (LOGIN_PATH, SIGNUP_PATH):
+            wait = await token_buckets.take(f"auth-ip:{ip}", auth_ip_limit())
+            if wait > 0 or path != LOGIN_PATH:
+                return wait, receive
+            email, receive = await _peek_login_email(scope, receive)
+            if email is not None:
+                wait = await token_buckets.take(f"login:{email}", login_email_limit())
+            return wait, receive
+
+        token = _bearer_token(scope)
+        user_id = peek_user_id(token) if token is not None else None
+        key = f"user:{user_id}" if user_id is not None else f"ip:{ip}"
+        return await token_buckets.take(key, request_limit()), receive
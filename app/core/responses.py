@@ -0,0 +1,14 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSONResponse rendered by pydantic-core straight to bytes instead of json.dumps.
+    It also handles datetimes and pydantic models, so endpoints can return them without jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
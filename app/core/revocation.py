@@ -0,0 +1,133 @@
+"""
+Revoked access tokens (by their `jti` claim).
+
+Revocations are stored in the revoked_tokens table. Each process also keeps a Bloom filter of the revoked ids,
+so checking a token is an O(1) lookup in memory: a token the filter has never seen is not revoked, and only
+the rare "maybe" (a revoked token, or a false positive) is confirmed against the table.
+Revocations made by other processes are loaded into the filter every REVOCATION_SYNC_SECONDS, and the filter is
+rebuilt from the unexpired revocations every REVOCATION_REBUILD_SECONDS, or sooner once it is full.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from app.core.config import settings
+
+# Each sync re-reads this much of the already synced history, so a revocation committed a little
+# after the time it records (or by a server whose clock is slightly off) is not missed.
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings. Adding and testing are O(1); it never misses an item it was given,
+    and reports items it wasn't given about `error_rate` of the time once `capacity` items were added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    # Double hashing: the k bit positions are derived from the two halves of one digest.
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+
+
+class RevokedTokens:
+    """This process's view of the revoked token ids, and when it was last brought up to date."""
+
+    def __init__(self):
+        self._capacity = settings.REVOCATION_BLOOM_CAPACITY
+        self._bloom = BloomFilter(self._capacity, settings.REVOCATION_BLOOM_ERROR_RATE)
+        self._count = 0
+        self._lock = threading.Lock()
+        self.synced_at: Optional[datetime] = None
+        self._next_sync = 0.0
+        self._next_rebuild = time.monotonic() + settings.REVOCATION_REBUILD_SECONDS
+        self._syncing = False
+        # Ids added while a rebuild is loading, which the rebuilt filter must not lose.
+        self._added_during_sync: List[str] = []
+
+    def _insert(self, jti: str):
+        if jti not in self._bloom:
+            self._bloom.add(jti)
+            self._count += 1
+
+    def add(self, jti: str):
+        with self._lock:
+            self._insert(jti)
+            if self._syncing:
+                self._added_during_sync.append(jti)
+
+    # False means the token is certainly not revoked. True has to be confirmed in the table.
+    def might_be_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._bloom
+
+    # Whether it's time to load new revocations. Claims the sync, so concurrent requests don't all run it;
+    # the claimer must end it with synced() or, if loading failed, sync_failed().
+    def claim_sync(self) -> bool:
+        with self._lock:
+            if self._syncing or time.monotonic() < self._next_sync:
+                return False
+            self._syncing = True
+            self._added_during_sync = []
+            return True
+
+    # The time to load revocations from: everything (None) the first time, then a little before the last sync.
+    # Every REVOCATION_REBUILD_SECONDS, or once the filter holds as many ids as it was sized for, everything is
+    # loaded again and the filter is rebuilt, which drops the ids of tokens that have expired since.
+    def sync_from(self) -> Optional[datetime]:
+        if self.synced_at is None or self._count >= self._capacity or time.monotonic() >= self._next_rebuild:
+            return None
+        return self.synced_at - SYNC_OVERLAP
+
+    # Takes in the revocations loaded from `since` (as returned by sync_from) and schedules the next sync.
+    def synced(self, jtis: Iterable[str], started_at: datetime, since: Optional[datetime]):
+        jtis = list(jtis)
+        with self._lock:
+            if since is None:
+                # Sized for at least twice what is revoked now, so that the next rebuild isn't due right away.
+                self._capacity = max(settings.REVOCATION_BLOOM_CAPACITY, 2 * len(jtis))
+                self._bloom = BloomFilter(self._capacity, settings.REVOCATION_BLOOM_ERROR_RATE)
+                self._count = 0
+                self._next_rebuild = time.monotonic() + settings.REVOCATION_REBUILD_SECONDS
+                jtis += self._added_during_sync
+            for jti in jtis:
+                self._insert(jti)
+            self.synced_at = started_at
+            self._next_sync = time.monotonic() + settings.REVOCATION_SYNC_SECONDS
+            self._syncing = False
+
+    # Gives up a claimed sync, so that the next request tries again.
+    def sync_failed(self):
+        with self._lock:
+            self._syncing = False
+
+    def clear(self):
+        with self._lock:
+            self._capacity = settings.REVOCATION_BLOOM_CAPACITY
+            self._bloom = BloomFilter(self._capacity, settings.REVOCATION_BLOOM_ERROR_RATE)
+            self._count = 0
+            self.synced_at = None
+            self._next_sync = 0.0
+            self._next_rebuild = time.monotonic() + settings.REVOCATION_REBUILD_SECONDS
+            self._syncing = False
+
+
+revoked_tokens = RevokedTokens()
@@ -1,7 +1,35 @@
+import asyncio
+import hashlib
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-# This CryptContext object tells Passlib what hashing algorithm to use and manages the hashing and verification process. 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.config import settings
+from app.core.instrumentation import timed
+
+# This CryptContext object tells Passlib what hashing algorithm to use and manages the hashing and verification process.
+# Setting min_rounds to the configured cost makes needs_update() report hashes made with a lower cost, so they get upgraded on login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL while it works, so a dedicated thread pool runs hashes in parallel
+# without tying up the threadpool that every other endpoint shares.
+_hashing_pool = ThreadPoolExecutor(max_workers=settings.HASHING_POOL_WORKERS, thread_name_prefix="bcrypt")
+
+# Limits how many hashes can be running or waiting at once. Past that we refuse new work instead of queueing it.
+_hashing_slots = threading.BoundedSemaphore(settings.HASHING_POOL_WORKERS + settings.HASHING_QUEUE_MAX)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool already has as much work queued as it is allowed to hold."""
+
 
 # Hashes a password using bcrypt.
 def get_password_hash(password: str) -> str:
@@ -9,4 +37,36 @@ def get_password_hash(password: str) -> str:
 
 # Verifies a plain-text password against a stored hashed password.
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+# Runs a function on the hashing pool and waits for it without blocking the event loop.
+async def _run_in_hashing_pool(func, *args):
+    if not _hashing_slots.acquire(blocking=False):
+        raise HashingPoolSaturated()
+    future = _hashing_pool.submit(func, *args)
+    # The slot is released when the hash is actually done, even if the request waiting on it goes away.
+    future.add_done_callback(lambda _: _hashing_slots.release())
+    with timed("hash"):
+        return await asyncio.wrap_future(future)
+
+
+# Hashes a password on the hashing pool.
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hashing_pool(pwd_context.hash, password)
+
+# Verifies a password on the hashing pool.
+# Returns whether it matched and, if the stored hash uses outdated settings, a new hash to store in its place.
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_in_hashing_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+# Refresh tokens are 256 random bits, so unlike passwords they can't be guessed or brute-forced from a leaked hash.
+# A single SHA-256 is enough to store them, and checking one needs no bcrypt work at all.
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# A new refresh token and the hash to store for it.
+def new_refresh_token() -> Tuple[str, str]:
+    token = secrets.token_urlsafe(32)
+    return token, hash_refresh_token(token)
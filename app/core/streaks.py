@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta, timezone
+
+# How often a habit has to be logged to keep its streak going. Habits without a known frequency count as daily.
+FREQUENCIES = ("daily", "weekly", "monthly")
+DEFAULT_FREQUENCY = "daily"
+
+
+# Timestamps are stored as naive UTC, like the existing `last_logged` column.
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Returns the start of the period (day, ISO week or calendar month) that `moment` falls in.
+def period_start(frequency: str, moment: datetime) -> datetime:
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if frequency == "weekly":
+        return day - timedelta(days=day.weekday())
+    if frequency == "monthly":
+        return day.replace(day=1)
+    return day
+
+
+# Returns the start of the period just before the one `moment` falls in.
+def previous_period_start(frequency: str, moment: datetime) -> datetime:
+    start = period_start(frequency, moment)
+    return period_start(frequency, start - timedelta(microseconds=1))
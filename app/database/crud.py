@@ -1,13 +1,557 @@
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select, update
 from sqlalchemy.orm import Session
-from app.models import User as UserModel
+from app.models import (
+    User as UserModel, Habit as HabitModel, HabitLog as HabitLogModel, HabitVersion as HabitVersionModel,
+    HabitTombstone as HabitTombstoneModel, RevokedToken as RevokedTokenModel, RefreshToken as RefreshTokenModel,
+    UserShard as UserShardModel,
+)
 from app.schemas import user as UserSchema
+from app.schemas.habit import (
+    HabitBatch, HabitBatchItemResult, HabitCreate, HabitFilters, HabitImport, HabitUpdate, Habit as HabitSchema,
+)
+from app.core.cache import invalidate_user
+from app.core.revocation import revoked_tokens
+from app.core.streaks import DEFAULT_FREQUENCY, FREQUENCIES, period_start, previous_period_start, utcnow
+from app.database import rollups
+from app.database.database import dialect_insert
+
+# Every function here takes a sync Session as its first argument.
+# Endpoints call them through `run_db`, which also makes them usable with an AsyncSession in async mode.
+# Writes return schemas built before the commit, straight from INSERT/UPDATE ... RETURNING, so no refresh
+# SELECT is needed afterwards (sync sessions expire everything on commit).
+
+
+class HabitVersionConflict(Exception):
+    """Raised when a conditional write finds the habit at a different version than the client expected."""
 
 def get_user_by_email(db: Session, email: str):
     return db.query(UserModel).filter(UserModel.email == email).first()
 
+# Looks up just the id and email of a user, for authorizing a request without loading the whole User.
+def get_user_identity(db: Session, email: str, user_id: Optional[int] = None):
+    query = select(UserModel.id, UserModel.email)
+    if user_id is not None:
+        query = query.where(UserModel.id == user_id)
+    else:
+        query = query.where(UserModel.email == email)
+    return db.execute(query).first()
+
 def create_user(db: Session, email: str, password_hash: str):
-    db_user = UserModel(email=email, password_hash=password_hash)
-    db.add(db_user)
+    db_user = db.scalars(
+        insert(UserModel).values(email=email, password_hash=password_hash).returning(UserModel)
+    ).one()
+    user = UserSchema.User.model_validate(db_user)
+    db.commit()
+    return user
+
+# Changing the password must also drop any cached tokens of the user.
+def update_user_password(db: Session, user: UserModel, password_hash: str):
+    user.password_hash = password_hash
+    db.commit()
+    invalidate_user(user.id)
+    return user
+
+# Replaces the hash of the same password with one made with the current settings (see login_for_access_token).
+# The password didn't change, so the user's cached tokens stay valid.
+def rehash_user_password(db: Session, user: UserModel, password_hash: str):
+    user.password_hash = password_hash
+    db.commit()
+    return user
+
+def delete_user(db: Session, user: UserModel):
+    db.delete(user)
+    db.commit()
+    invalidate_user(user.id)
+
+# Revokes an access token by its `jti`. The row is only needed until the token would have expired anyway.
+# This process's filter learns of it right away; the others on their next sync.
+def revoke_token(db: Session, jti: str, user_id: int, expires_at: datetime):
+    statement = dialect_insert(db, RevokedTokenModel).values(jti=jti, user_id=user_id, expires_at=expires_at, revoked_at=utcnow())
+    db.execute(statement.on_conflict_do_nothing(index_elements=[RevokedTokenModel.jti]))
+    db.commit()
+    revoked_tokens.add(jti)
+
+def is_token_revoked(db: Session, jti: str) -> bool:
+    return db.scalar(select(RevokedTokenModel.jti).where(RevokedTokenModel.jti == jti)) is not None
+
+# The unexpired revocations made since `since` (all of them if it is None), for syncing the revocation filter.
+def get_revoked_token_ids(db: Session, since: Optional[datetime]) -> List[str]:
+    query = select(RevokedTokenModel.jti).where(RevokedTokenModel.expires_at > utcnow())
+    if since is not None:
+        query = query.where(RevokedTokenModel.revoked_at >= since)
+    return list(db.scalars(query))
+
+
+# Starts a new refresh token family (a login) for the user.
+def create_refresh_token(db: Session, user_id: int, token_hash: str, family_id: str, expires_at: datetime):
+    db.execute(insert(RefreshTokenModel).values(
+        token_hash=token_hash, family_id=family_id, user_id=user_id, expires_at=expires_at,
+    ))
+    db.commit()
+
+# Revokes every refresh token of a family, so none of them can be used again.
+def revoke_refresh_token_family(db: Session, family_id: str):
+    db.execute(
+        update(RefreshTokenModel)
+        .where(RefreshTokenModel.family_id == family_id, RefreshTokenModel.revoked_at.is_(None))
+        .values(revoked_at=utcnow())
+    )
+    db.commit()
+
+# Exchanges a refresh token for the next one of its family. Returns the user's id and email and the family id,
+# or None if the token is unknown, expired or revoked.
+# A token can only be exchanged once. Using it a second time means someone else holds a copy of it (or of its
+# successor), and we can't tell which of the two is the legitimate client, so the whole family is revoked.
+# Marking the token used is conditional, so of two concurrent exchanges only one succeeds.
+def rotate_refresh_token(db: Session, token_hash: str, new_token_hash: str, expires_at: datetime):
+    now = utcnow()
+    token = db.execute(
+        select(
+            RefreshTokenModel.id, RefreshTokenModel.family_id, RefreshTokenModel.user_id,
+            RefreshTokenModel.expires_at, RefreshTokenModel.used_at, RefreshTokenModel.revoked_at,
+        ).where(RefreshTokenModel.token_hash == token_hash)
+    ).first()
+    if token is None or token.revoked_at is not None or token.expires_at <= now:
+        return None
+
+    claimed = token.used_at is None and db.execute(
+        update(RefreshTokenModel)
+        .where(RefreshTokenModel.id == token.id, RefreshTokenModel.used_at.is_(None))
+        .values(used_at=now)
+    ).rowcount == 1
+    if not claimed:
+        db.rollback()
+        revoke_refresh_token_family(db, token.family_id)
+        return None
+
+    db.execute(insert(RefreshTokenModel).values(
+        token_hash=new_token_hash, family_id=token.family_id, user_id=token.user_id, expires_at=expires_at,
+    ))
+    user = db.execute(select(UserModel.id, UserModel.email).where(UserModel.id == token.user_id)).one()
+    db.commit()
+    return user.id, user.email, token.family_id
+
+
+# The user's row in the shard directory (shard_id, moving), or None for users on shard 0. See app/database/sharding.py.
+def get_user_shard(db: Session, user_id: int):
+    return db.execute(
+        select(UserShardModel.shard_id, UserShardModel.moving).where(UserShardModel.user_id == user_id)
+    ).first()
+
+def set_user_shard(db: Session, user_id: int, shard_id: int, moving: bool = False):
+    statement = dialect_insert(db, UserShardModel).values(user_id=user_id, shard_id=shard_id, moving=moving)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[UserShardModel.user_id], set_={"shard_id": shard_id, "moving": moving},
+    ))
+    db.commit()
+
+# Creates the user's row on a shard other than the primary. It is only there for the habit tables' foreign keys:
+# the user's email and password stay on the primary, so the row gets a placeholder email and a password that never matches.
+def create_shard_user(db: Session, user_id: int):
+    statement = dialect_insert(db, UserModel).values(id=user_id, email=f"{user_id}@shard.invalid", password_hash="!")
+    db.execute(statement.on_conflict_do_nothing(index_elements=[UserModel.id]))
+    db.commit()
+
+# The next `limit` users after `after_id`, with the shard each of them is on, for rebalancing.
+def get_user_shards(db: Session, after_id: int, limit: int) -> List[Tuple[int, int]]:
+    rows = db.execute(
+        select(UserModel.id, func.coalesce(UserShardModel.shard_id, 0))
+        .outerjoin(UserShardModel, UserShardModel.user_id == UserModel.id)
+        .where(UserModel.id > after_id)
+        .order_by(UserModel.id)
+        .limit(limit)
+    )
+    return [(user_id, shard_id) for user_id, shard_id in rows]
+
+# The user's habit version, which every habit change increases. Users who never changed a habit are at 0.
+def get_habit_version(db: Session, user_id: int) -> int:
+    version = db.scalar(select(HabitVersionModel.version).where(HabitVersionModel.user_id == user_id))
+    return version or 0
+
+# Increases the user's habit version in the same transaction as the change, and returns the new version.
+# Concurrent changes serialize on the user's row, so every committed change gets its own version.
+# Writers call this before changing any habit and stamp the new version on the rows they change (Habit.revision):
+# holding the row lock from the start means a user's changes commit in revision order.
+def bump_habit_version(db: Session, user_id: int) -> int:
+    statement = dialect_insert(db, HabitVersionModel).values(user_id=user_id, version=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[HabitVersionModel.user_id],
+        set_={"version": HabitVersionModel.version + 1},
+    )
+    return db.scalar(statement.returning(HabitVersionModel.version))
+
+
+# The columns of a habit as the API returns it. The read endpoints select just these as plain rows,
+# so no ORM objects are built and the rows can be serialized without validating them again (see HabitRow).
+HABIT_COLUMNS = [getattr(HabitModel, name) for name in HabitSchema.model_fields]
+
+# Turns a result into a list of dicts. zip() over the result's keys is much cheaper than RowMapping.
+def _as_dicts(result) -> List[dict]:
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+# What each sort order of HabitFilters sorts on, and whether it can be NULL. Ties are broken by id, in the same direction.
+# Each one has an index that starts with (user_id, <sort key>), see app/models/habit.py.
+HABIT_SORT_KEYS = {
+    "id": (HabitModel.id, False),
+    "name": (func.lower(HabitModel.name), False),
+    "streak": (HabitModel.streak, True),
+    "last_logged": (HabitModel.last_logged, True),
+}
+
+# The Python type of each sort key's values, which is what a page cursor may carry for that order.
+HABIT_SORT_VALUE_TYPES = {"id": int, "name": str, "streak": int, "last_logged": datetime}
+
+def _habit_filter_conditions(filters: HabitFilters) -> list:
+    conditions = []
+    if filters.category is not None:
+        conditions.append(HabitModel.category == filters.category)
+    if filters.frequency is not None:
+        conditions.append(HabitModel.frequency == filters.frequency)
+    if filters.streak_gte is not None:
+        conditions.append(HabitModel.streak >= filters.streak_gte)
+    if filters.logged_after is not None:
+        conditions.append(HabitModel.last_logged >= filters.logged_after)
+    if filters.logged_before is not None:
+        conditions.append(HabitModel.last_logged < filters.logged_before)
+    if filters.q is not None:
+        # autoescape keeps "%" and "_" in the search text from acting as wildcards.
+        conditions.append(func.lower(HabitModel.name).startswith(filters.q.lower(), autoescape=True))
+    return conditions
+
+# The rows that come after `after`, a (sort value, id) pair, in the given order.
+# NULLs sort as the largest value, like Postgres does by default: last when ascending, first when descending.
+def _after_condition(key, nullable: bool, descending: bool, after):
+    value, last_id = after
+    if key is HabitModel.id:
+        return HabitModel.id < last_id if descending else HabitModel.id > last_id
+    if descending:
+        if value is None:
+            return or_(key.is_not(None), HabitModel.id < last_id)
+        return or_(key < value, and_(key == value, HabitModel.id < last_id))
+    if value is None:
+        return and_(key.is_(None), HabitModel.id > last_id)
+    condition = or_(key > value, and_(key == value, HabitModel.id > last_id))
+    return or_(condition, key.is_(None)) if nullable else condition
+
+# Builds the query for a user's habits, with the optional filters and sort order, for keyset pagination:
+# `after` is the (sort value, id) of the last row of the previous page.
+# For orders other than id, the sort value is selected too, as `sort_key`, so the next cursor can be built from the last row.
+def habits_query(user_id: int, after=None, filters: Optional[HabitFilters] = None):
+    filters = filters or HabitFilters()
+    descending = filters.sort.startswith("-")
+    key, nullable = HABIT_SORT_KEYS[filters.sort.lstrip("-")]
+
+    columns = list(HABIT_COLUMNS)
+    if key is not HabitModel.id:
+        columns.append(key.label("sort_key"))
+    query = select(*columns).where(HabitModel.user_id == user_id, *_habit_filter_conditions(filters))
+    if after is not None:
+        query = query.where(_after_condition(key, nullable, descending, after))
+
+    if key is HabitModel.id:
+        return query.order_by(HabitModel.id.desc() if descending else HabitModel.id)
+    if descending:
+        return query.order_by(key.desc().nulls_first() if nullable else key.desc(), HabitModel.id.desc())
+    return query.order_by(key.nulls_last() if nullable else key, HabitModel.id)
+
+def get_habits_page(db: Session, user_id: int, after, limit: int, filters: Optional[HabitFilters] = None) -> List[dict]:
+    return _as_dicts(db.execute(habits_query(user_id, after, filters).limit(limit)))
+
+# What changed in the user's habits since revision `since`: the habits created or updated since then (ordered by revision),
+# the ids of those deleted since then, and the revision the client is now up to date with (its next `since`).
+# Both lookups are range scans of a (user_id, revision) index, so a sync reads only what changed.
+# Changes committed while this runs have revisions past the watermark and are left for the next sync.
+# `since` 0, or one ahead of the server (e.g. after a restore), returns every habit with `full` set: the client
+# should replace its copy rather than merge into it.
+def get_habit_changes(db: Session, user_id: int, since: int) -> dict:
+    watermark = get_habit_version(db, user_id)
+    if since == watermark:
+        return {"watermark": watermark, "full": False, "habits": [], "deleted": []}
+
+    full = since == 0 or since > watermark
+    conditions = [HabitModel.user_id == user_id, HabitModel.revision <= watermark]
+    if not full:
+        conditions.append(HabitModel.revision > since)
+    habits = _as_dicts(db.execute(
+        select(*HABIT_COLUMNS).where(*conditions).order_by(HabitModel.revision, HabitModel.id)
+    ))
+
+    deleted = []
+    if not full:
+        changed_ids = {habit["id"] for habit in habits}
+        deleted = [
+            habit_id for habit_id in db.scalars(
+                select(HabitTombstoneModel.habit_id)
+                .where(
+                    HabitTombstoneModel.user_id == user_id,
+                    HabitTombstoneModel.revision > since,
+                    HabitTombstoneModel.revision <= watermark,
+                )
+                .order_by(HabitTombstoneModel.revision, HabitTombstoneModel.habit_id)
+            )
+            # A reused id (SQLite) that was deleted and then created again is an upsert, not a deletion.
+            if habit_id not in changed_ids
+        ]
+    return {"watermark": watermark, "full": full, "habits": habits, "deleted": deleted}
+
+# Both the habit's id and the user's id are used, so users can never reach each other's habits.
+def get_habit(db: Session, user_id: int, habit_id: int):
+    return db.query(HabitModel).filter(
+        HabitModel.id == habit_id,
+        HabitModel.user_id == user_id
+    ).first()
+
+# Like get_habit, but returns the habit as a plain dict of HABIT_COLUMNS.
+def get_habit_row(db: Session, user_id: int, habit_id: int) -> Optional[dict]:
+    rows = _as_dicts(db.execute(select(*HABIT_COLUMNS).where(HabitModel.id == habit_id, HabitModel.user_id == user_id)))
+    return rows[0] if rows else None
+
+def create_habit(db: Session, user_id: int, habit: HabitCreate):
+    revision = bump_habit_version(db, user_id)
+    db_habit = db.scalars(
+        insert(HabitModel).values(**habit.model_dump(), user_id=user_id, revision=revision).returning(HabitModel)
+    ).one()
+    rollups.add_habits(db, user_id, [habit.category])
+    result = HabitSchema.model_validate(db_habit)
+    db.commit()
+    return result
+
+# Limits a write to the user's habit, and to the given versions of it when the client sent If-Match.
+def _owned_habit(user_id: int, habit_id: int, expected_versions: Optional[List[int]]):
+    conditions = [HabitModel.id == habit_id, HabitModel.user_id == user_id]
+    if expected_versions is not None:
+        conditions.append(HabitModel.version.in_(expected_versions))
+    return conditions
+
+# A conditional write that matched no row either hit a missing habit or one changed by someone else.
+# Only the failure path pays for this extra lookup.
+def _raise_if_version_conflict(db: Session, user_id: int, habit_id: int, expected_versions: Optional[List[int]]):
+    if expected_versions is not None and db.scalar(select(HabitModel.id).where(*_owned_habit(user_id, habit_id, None))):
+        raise HabitVersionConflict()
+
+# Updates the habit in one UPDATE ... RETURNING, which also increases its version.
+# Returns None if the user has no habit with this id, and raises HabitVersionConflict if
+# `expected_versions` is given and the habit is at another version.
+def update_habit(db: Session, user_id: int, habit_id: int, habit: HabitUpdate, expected_versions: Optional[List[int]] = None):
+    changes = habit.model_dump(exclude_unset=True)
+    revision = bump_habit_version(db, user_id)
+    db_habit = db.scalars(
+        update(HabitModel)
+        .where(*_owned_habit(user_id, habit_id, expected_versions))
+        .values(**changes, version=HabitModel.version + 1, revision=revision)
+        .returning(HabitModel)
+    ).first()
+    if db_habit is None:
+        db.rollback()
+        _raise_if_version_conflict(db, user_id, habit_id, expected_versions)
+        return None
+
+    # Only a new category changes the counts; a new streak only changes the streak stats.
+    if "category" in changes:
+        rollups.refresh_habit_totals(db, user_id)
+    elif "streak" in changes:
+        rollups.refresh_streaks(db, user_id)
+    result = HabitSchema.model_validate(db_habit)
+    db.commit()
+    return result
+
+# Records deleted habits as tombstones, for clients syncing changes.
+# An id SQLite gave out again may already have a tombstone from before; it is moved to the new revision.
+def _add_tombstones(db: Session, user_id: int, habit_ids, revision: int):
+    if not habit_ids:
+        return
+    statement = dialect_insert(db, HabitTombstoneModel)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[HabitTombstoneModel.user_id, HabitTombstoneModel.habit_id],
+            set_={"revision": statement.excluded.revision, "deleted_at": statement.excluded.deleted_at},
+        ),
+        [{"user_id": user_id, "habit_id": habit_id, "revision": revision, "deleted_at": utcnow()} for habit_id in habit_ids],
+    )
+
+# Deletes the habit in one DELETE ... RETURNING and leaves a tombstone. Returns False if the user has no habit with this id,
+# and raises HabitVersionConflict like update_habit.
+def delete_habit(db: Session, user_id: int, habit_id: int, expected_versions: Optional[List[int]] = None) -> bool:
+    revision = bump_habit_version(db, user_id)
+    deleted_id = db.scalar(
+        delete(HabitModel).where(*_owned_habit(user_id, habit_id, expected_versions)).returning(HabitModel.id)
+    )
+    if deleted_id is None:
+        db.rollback()
+        _raise_if_version_conflict(db, user_id, habit_id, expected_versions)
+        return False
+
+    _add_tombstones(db, user_id, [deleted_id], revision)
+    rollups.refresh_habit_totals(db, user_id)
+    db.commit()
+    return True
+
+
+# Applies a batch of creates, updates and deletes in a single transaction with a handful of statements:
+# one multi-row INSERT ... RETURNING, one SELECT + one executemany UPDATE + one SELECT for the updates,
+# and one DELETE ... RETURNING. Returns one result per item.
+def apply_habit_batch(db: Session, user_id: int, batch: HabitBatch):
+    results = []
+    revision = bump_habit_version(db, user_id)
+
+    if batch.create:
+        created = db.scalars(
+            insert(HabitModel).returning(HabitModel, sort_by_parameter_order=True),
+            [dict(habit.model_dump(), user_id=user_id, revision=revision) for habit in batch.create],
+        ).all()
+        for index, db_habit in enumerate(created):
+            results.append(HabitBatchItemResult(
+                op="create", index=index, status=201, id=db_habit.id, habit=HabitSchema.model_validate(db_habit)
+            ))
+
+    if batch.update:
+        # Only the user's own habits may be updated. Ids that belong to someone else are reported as not found.
+        requested_ids = {habit.id for habit in batch.update}
+        owned_ids = set(db.scalars(
+            select(HabitModel.id).where(HabitModel.user_id == user_id, HabitModel.id.in_(requested_ids))
+        ))
+        changes = [habit.model_dump(exclude_unset=True) | {"id": habit.id} for habit in batch.update if habit.id in owned_ids]
+        if changes:
+            db.execute(update(HabitModel).values(version=HabitModel.version + 1, revision=revision), changes)
+        updated = {
+            db_habit.id: HabitSchema.model_validate(db_habit)
+            for db_habit in db.scalars(
+                select(HabitModel).where(HabitModel.id.in_(owned_ids)).execution_options(populate_existing=True)
+            )
+        }
+        for index, habit in enumerate(batch.update):
+            if habit.id in updated:
+                results.append(HabitBatchItemResult(op="update", index=index, status=200, id=habit.id, habit=updated[habit.id]))
+            else:
+                results.append(HabitBatchItemResult(op="update", index=index, status=404, id=habit.id, detail="Habit not found"))
+
+    if batch.delete:
+        deleted_ids = set(db.scalars(
+            delete(HabitModel)
+            .where(HabitModel.user_id == user_id, HabitModel.id.in_(batch.delete))
+            .returning(HabitModel.id)
+        ))
+        _add_tombstones(db, user_id, sorted(deleted_ids), revision)
+        for index, habit_id in enumerate(batch.delete):
+            if habit_id in deleted_ids:
+                results.append(HabitBatchItemResult(op="delete", index=index, status=204, id=habit_id))
+            else:
+                results.append(HabitBatchItemResult(op="delete", index=index, status=404, id=habit_id, detail="Habit not found"))
+
+    # Updates and deletes can move habits between categories, so those need a recount; creates only add to the counts.
+    if batch.update or batch.delete:
+        rollups.refresh_habit_totals(db, user_id)
+    else:
+        rollups.add_habits(db, user_id, [habit.category for habit in batch.create])
+    db.commit()
+    return results
+
+
+# Imports habits, a chunk of rows at a time, as one change of the user's habits in one transaction.
+# Each chunk is a single executemany INSERT, without RETURNING, and the rollups are recounted once at the end.
+# The chunks are read from an upload that is already complete (see habit_transfer.spool_import), so the user's
+# habit version stays locked only for as long as the inserts take. Returns how many habits were imported.
+def import_habits(db: Session, user_id: int, chunks: Iterable[List[HabitImport]]) -> int:
+    revision = bump_habit_version(db, user_id)
+    imported = 0
+    for habits in chunks:
+        db.execute(insert(HabitModel), [dict(habit.model_dump(), user_id=user_id, revision=revision) for habit in habits])
+        imported += len(habits)
+    rollups.refresh_habit_totals(db, user_id)
+    db.commit()
+    return imported
+
+
+# Picks a per-frequency value in SQL, so one statement can handle habits with any frequency.
+def _by_frequency(values: dict):
+    frequency = func.lower(HabitModel.frequency)
+    return case(
+        *[(frequency == name, value) for name, value in values.items() if name != DEFAULT_FREQUENCY],
+        else_=values[DEFAULT_FREQUENCY],
+    )
+
+# Records a check-in and updates the streak in one atomic UPDATE ... RETURNING:
+# - already logged in the current period (day, week or month, depending on `frequency`): the streak stays as it is
+# - last logged in the previous period: the streak goes up by one
+# - otherwise (never logged, or a period was missed): the streak restarts at 1
+# Concurrent check-ins can't lose updates because the new streak is computed by the database from the stored row.
+# The stats rollups are updated in the same transaction. Returns None if the user has no habit with this id.
+def log_habit(db: Session, user_id: int, habit_id: int):
+    now = utcnow()
+    revision = bump_habit_version(db, user_id)
+    current_start = _by_frequency({name: period_start(name, now) for name in FREQUENCIES})
+    previous_start = _by_frequency({name: previous_period_start(name, now) for name in FREQUENCIES})
+    new_streak = case(
+        (HabitModel.last_logged >= current_start, HabitModel.streak),
+        (HabitModel.last_logged >= previous_start, func.coalesce(HabitModel.streak, 0) + 1),
+        else_=1,
+    )
+
+    # The rollups look at the habit's previous last_logged, so they are counted before the habit is updated.
+    rollups.record_checkin(db, user_id, habit_id, now)
+    db_habit = db.scalars(
+        update(HabitModel)
+        .where(HabitModel.id == habit_id, HabitModel.user_id == user_id)
+        .values(streak=new_streak, last_logged=now, version=HabitModel.version + 1, revision=revision)
+        .returning(HabitModel)
+    ).first()
+    if db_habit is None:
+        db.rollback()
+        return None
+
+    db.execute(insert(HabitLogModel).values(habit_id=habit_id, user_id=user_id, logged_at=now))
+    rollups.refresh_streaks(db, user_id)
+    habit = HabitSchema.model_validate(db_habit)
+    db.commit()
+    return habit
+
+
+# Habits whose streak can't go on: they were last logged before the previous period of their frequency, so their next
+# check-in restarts the streak at 1 (see log_habit). Habits that were never logged keep the streak they were given.
+def _streak_overdue(now: datetime):
+    previous_start = _by_frequency({name: previous_period_start(name, now) for name in FREQUENCIES})
+    return and_(HabitModel.streak > 0, HabitModel.last_logged < previous_start)
+
+# The id of the habit `offset` habits after the first one with id >= start_id, or None if there aren't that many.
+# Used to walk the table in chunks of a number of habits: ids can be far apart (see sharding.stride_habit_ids),
+# so ranges of a fixed number of ids could hold very few habits. This reads only the primary key index.
+def get_habit_id_after(db: Session, start_id: int, offset: int) -> Optional[int]:
+    return db.scalar(select(HabitModel.id).where(HabitModel.id >= start_id).order_by(HabitModel.id).limit(1).offset(offset))
+
+# Resets the overdue streaks among the habits with first_id <= id < end_id (no upper bound if end_id is None)
+# to 0, in one short transaction.
+# Like any other habit change, this gives each affected user a new habit version (stamped on the habits as their
+# revision, so clients sync them) and updates their streak stats. Returns how many habits and which users it changed.
+def expire_streaks(db: Session, first_id: int, end_id: Optional[int], now: datetime) -> Tuple[int, List[int]]:
+    overdue = [HabitModel.id >= first_id, _streak_overdue(now)]
+    if end_id is not None:
+        overdue.append(HabitModel.id < end_id)
+    user_ids = list(db.scalars(select(HabitModel.user_id).where(*overdue).distinct()))
+    if not user_ids:
+        db.rollback()
+        return 0, []
+
+    # The versions are bumped first, like bump_habit_version, so this waits for (and then holds off) the users' own writes.
+    statement = dialect_insert(db, HabitVersionModel)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[HabitVersionModel.user_id],
+            set_={"version": HabitVersionModel.version + 1},
+        ),
+        [{"user_id": user_id, "version": 1} for user_id in user_ids],
+    )
+    # Only the users whose version was bumped: a habit that became overdue in the meantime is left for the next run.
+    user_version = select(HabitVersionModel.version).where(HabitVersionModel.user_id == HabitModel.user_id).scalar_subquery()
+    expired = db.execute(
+        update(HabitModel)
+        .where(*overdue, HabitModel.user_id.in_(user_ids))
+        .values(streak=0, version=HabitModel.version + 1, revision=user_version)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    rollups.refresh_streaks_of(db, user_ids)
     db.commit()
-    db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return expired, user_ids
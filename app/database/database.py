@@ -1,10 +1,48 @@
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from app.core.config import settings
+from app.database.pool_metrics import TimedAsyncQueuePool, TimedQueuePool, instrument_engine
+
+
+# Builds the create_engine()/create_async_engine() keyword arguments for a URL from the pool settings.
+def get_engine_options(url: str, is_async: bool = False) -> dict:
+    backend = make_url(url).get_backend_name()
+    # SQLite (used for tests and local runs) keeps SQLAlchemy's defaults; the pool settings are meant for Postgres.
+    if backend == "sqlite":
+        return {}
+
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS is not None:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+
+    if settings.DB_PGBOUNCER_MODE:
+        options["poolclass"] = NullPool
+        # psycopg 3 prepares statements that run often; prepare_threshold=None turns that off.
+        connect_args["prepare_threshold"] = None
+    else:
+        options.update(
+            poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
 
 # The create_engine function is the starting point for any SQLAlchemy application.
 # It creates a connection pool and manages the low-level communication with the database.
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(settings.DATABASE_URL, **get_engine_options(settings.DATABASE_URL))
+instrument_engine("primary", engine)
 
 # The sessionmaker creates a SessionLocal class. Each instance of SessionLocal is a database session.
 # The session is your "staging area" for all the changes you want to make to the database.
@@ -23,4 +61,72 @@ def get_db():
         yield db
     finally: 
         # The code in the 'finally' block runs after the request is complete, ensuring the database session is always closed, even if an error occurs.
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Turns a sync driver URL into its async equivalent: psycopg 3 has a native async mode, and aiosqlite is used for SQLite (e.g. in tests).
+def get_async_database_url(url: str) -> str:
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+psycopg://" + url.split("://", 1)[1]
+    return url
+
+
+# In async mode, queries run on an AsyncSession so a single worker isn't capped by the size of the threadpool.
+# expire_on_commit=False keeps loaded attributes readable after a commit, because lazy loads can't happen outside the session's greenlet.
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_MODE == "async":
+    async_database_url = settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+    async_engine = create_async_engine(async_database_url, **get_engine_options(async_database_url, is_async=True))
+    instrument_engine("primary_async", async_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# The async version of get_db.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# The session dependency the endpoints use. DB_MODE decides which kind of session it hands out.
+get_session = get_async_db if settings.DB_MODE == "async" else get_db
+
+
+# Runs a function that takes a sync Session as its first argument without blocking the event loop.
+# With an AsyncSession the function runs through run_sync, otherwise it runs in the threadpool.
+# This lets every query in crud.py be written once and work in both modes.
+async def run_db(db, func, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args, **kwargs)
+    return await run_in_threadpool(func, db, *args, **kwargs)
+
+
+# Closes every pooled connection. The app calls this on shutdown, after in-flight requests have finished.
+async def dispose_engines():
+    engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+# Streams the rows of a select() in batches of dicts from a server-side cursor, in either mode.
+# Only one batch of rows is held in memory at a time.
+async def stream_rows(db, statement, batch_size: int):
+    statement = statement.execution_options(yield_per=batch_size)
+    if isinstance(db, AsyncSession):
+        result = await db.stream(statement)
+        keys = list(result.keys())
+        async for batch in result.partitions():
+            yield [dict(zip(keys, row)) for row in batch]
+    else:
+        result = await run_in_threadpool(db.execute, statement)
+        keys = list(result.keys())
+        async for batch in iterate_in_threadpool(result.partitions()):
+            yield [dict(zip(keys, row)) for row in batch]
+
+
+# Returns the dialect's own insert() construct for a table or model. Unlike the generic insert(),
+# it supports ON CONFLICT, which we use for upserts on both Postgres and SQLite.
+def dialect_insert(db, table):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
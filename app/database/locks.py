@@ -0,0 +1,33 @@
+"""
+Locks that keep a job from running in more than one process at a time (e.g. once per gunicorn worker).
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+
+_local_locks: Dict[int, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+
+# Tries to take the lock `lock_id` without waiting, and yields whether it got it. The lock is held until the block ends.
+# On Postgres this is a transaction-level advisory lock on a connection of its own, which is released however the
+# block ends (even if the process dies) and, unlike a session-level lock, also works behind PgBouncer in transaction mode.
+# SQLite has no advisory locks, so there the lock only keeps this process from running the job twice.
+@contextmanager
+def try_advisory_lock(engine: Engine, lock_id: int) -> Iterator[bool]:
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection, connection.begin():
+            yield connection.scalar(select(func.pg_try_advisory_xact_lock(lock_id)))
+        return
+
+    with _local_locks_guard:
+        lock = _local_locks.setdefault(lock_id, threading.Lock())
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
@@ -0,0 +1,101 @@
+"""
+Upgrades the database, and every shard in DATABASE_SHARD_URLS, to the latest Alembic revision, but only when it is behind:
+
+    python -m app.database.migrate
+
+Reading the current revision is a single query, so booting against an up-to-date database skips
+Alembic's migration environment entirely. On Postgres an advisory lock makes instances that boot
+at the same time wait for each other instead of running the same migrations twice.
+"""
+import os
+import time
+from typing import Dict
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import NullPool
+
+from app.core.config import settings
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "alembic.ini")
+
+# An arbitrary, fixed key for pg_advisory_lock, shared by every instance of the app.
+MIGRATION_LOCK_ID = 72_311_905
+
+
+def _current_heads(connection) -> set:
+    return set(MigrationContext.configure(connection).get_current_heads())
+
+
+# Returns True if migrations were run, False if the database was already at head.
+def migrate_if_behind(database_url: str = None) -> bool:
+    database_url = database_url or settings.DATABASE_URL
+    config = Config(ALEMBIC_INI)
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+
+    engine = create_engine(database_url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            if _current_heads(connection) == heads:
+                return False
+
+            if connection.dialect.name == "postgresql":
+                connection.execute(select(func.pg_advisory_lock(MIGRATION_LOCK_ID)))
+                connection.commit()
+            try:
+                # Another instance may have finished the migrations while we waited for the lock.
+                if _current_heads(connection) == heads:
+                    return False
+                connection.rollback()
+                config.attributes["database_url"] = database_url
+                command.upgrade(config, "head")
+                return True
+            finally:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK_ID)))
+                    connection.commit()
+    finally:
+        engine.dispose()
+
+
+# Migrates the primary (shard 0) and every shard, one after the other, and sets up each one's habit ids
+# (see app/database/sharding.py). Returns {shard id: whether migrations were run}.
+def migrate_shards(shard_urls: Dict[int, str] = None, primary_url: str = None) -> Dict[int, bool]:
+    from app.database.sharding import parse_shard_urls, stride_habit_ids
+
+    if shard_urls is None:
+        shard_urls = parse_shard_urls(settings.DATABASE_SHARD_URLS)
+    urls = {0: primary_url or settings.DATABASE_URL, **shard_urls}
+    migrated = {}
+    for shard_id, url in urls.items():
+        migrated[shard_id] = migrate_if_behind(url)
+        if len(urls) > 1:
+            engine = create_engine(url, poolclass=NullPool)
+            try:
+                with engine.connect() as connection:
+                    stride_habit_ids(connection, shard_id)
+            finally:
+                engine.dispose()
+    return migrated
+
+
+def main():
+    if not settings.DATABASE_SHARD_URLS:
+        started = time.perf_counter()
+        if migrate_if_behind():
+            print(f"Database migrated to head in {time.perf_counter() - started:.2f}s")
+        else:
+            print("Database is already at head, skipping migrations")
+        return
+
+    started = time.perf_counter()
+    for shard_id, migrated in migrate_shards().items():
+        print(f"Shard {shard_id}: {'migrated to head' if migrated else 'already at head, skipped'}")
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolMetrics:
+    """
+    Counters for one connection pool, fed by SQLAlchemy pool events.
+    Checkout wait time is measured by the Timed*QueuePool classes below, because there is no "before checkout" event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engine = None
+        self.connections_in_use = 0
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = {
+                "connections_in_use": self.connections_in_use,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "invalidations": self.invalidations,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_avg_ms": round(1000 * self.checkout_wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(1000 * self.checkout_wait_max, 3),
+            }
+        # Queue pools also know their configured size and how far past it they have grown.
+        pool = self.engine.pool if self.engine is not None else None
+        if isinstance(pool, QueuePool):
+            data["pool_size"] = pool.size()
+            data["overflow"] = max(pool.overflow(), 0)
+            data["idle"] = pool.checkedin()
+        return data
+
+
+# One entry per instrumented engine, e.g. "primary".
+pool_metrics: Dict[str, PoolMetrics] = {}
+
+
+class _TimedQueuePoolMixin:
+    # Set by instrument_engine once the pool exists.
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+        return new_pool
+
+
+# QueuePool variants that also time how long each checkout waited for a connection.
+class TimedQueuePool(_TimedQueuePoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedQueuePoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Attaches pool event listeners to an engine (sync or async) and registers its metrics under `name`.
+def instrument_engine(name: str, engine) -> PoolMetrics:
+    sync_engine = getattr(engine, "sync_engine", engine)
+    metrics = PoolMetrics()
+    metrics.engine = sync_engine
+    if isinstance(sync_engine.pool, _TimedQueuePoolMixin):
+        sync_engine.pool.metrics = metrics
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with metrics._lock:
+            metrics.checkouts += 1
+            metrics.connections_in_use += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connections_in_use = max(metrics.connections_in_use - 1, 0)
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with metrics._lock:
+            metrics.invalidations += 1
+
+    pool_metrics[name] = metrics
+    return metrics
+
+
+# A JSON-friendly view of every instrumented pool, for the /metrics endpoint.
+def get_pool_metrics() -> dict:
+    return {name: metrics.snapshot() for name, metrics in pool_metrics.items()}
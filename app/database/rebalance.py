@@ -0,0 +1,227 @@
+"""
+Moves users' habits between shards while the app keeps serving them (see app/database/sharding.py):
+
+    python -m app.database.rebalance move USER_ID SHARD_ID
+    python -m app.database.rebalance rebalance [--dry-run] [--group-size N]
+
+`rebalance` moves every user who isn't on the shard the hash ring places them on, e.g. after a shard was added.
+Users are moved in groups, through these steps. After each directory change the move waits SHARD_MOVE_GRACE_SECONDS,
+so that every worker's cached directory entry has expired and writes already under way have finished:
+1. the users are marked as moving: their reads carry on, their writes get a 503 with Retry-After
+2. their rows are copied to the new shard, SHARD_MOVE_BATCH_SIZE rows per transaction
+3. the directory points to the new shard, still moving. Workers that haven't noticed yet read the old copy, which is the same
+4. the move is over: writes go to the new shard, and the old copy is deleted, again in batches
+If the copy fails, the users stay where they were; whatever was copied is cleaned up by the next attempt.
+Other users, on any shard, are never affected.
+"""
+import argparse
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.database import crud, sharding
+from app.models import HabitLog, HabitStats, HabitTombstone, HabitVersion, Habit, User
+
+logger = logging.getLogger(__name__)
+
+USERS_PER_PAGE = 1000
+
+
+class UserTable(NamedTuple):
+    table: object
+    key: str  # the column rows are copied and deleted in order of, together with user_id
+    keep_key: bool
+
+
+# The tables that hold a user's habits, in foreign key order. Habits keep their ids, which clients know them by
+# (and which SHARD_ID_STRIDE keeps unique across shards). Nothing refers to log ids, so logs get new ones.
+USER_TABLES = [
+    UserTable(HabitVersion.__table__, "user_id", True),
+    UserTable(Habit.__table__, "id", True),
+    UserTable(HabitLog.__table__, "id", False),
+    UserTable(HabitStats.__table__, "category", True),
+    UserTable(HabitTombstone.__table__, "habit_id", True),
+]
+
+
+class Move(NamedTuple):
+    user_id: int
+    source: int
+    target: int
+
+
+class MoveResult(NamedTuple):
+    users: int
+    rows: int
+    seconds: float
+    writes_blocked_seconds: float
+
+
+def _copy_rows(source: Session, target: Session, user_table: UserTable, user_id: int, batch_size: int) -> int:
+    table, key = user_table.table, user_table.table.c[user_table.key]
+    copied, last = 0, None
+    while True:
+        query = select(table).where(table.c.user_id == user_id).order_by(key).limit(batch_size)
+        if last is not None:
+            query = query.where(key > last)
+        rows = source.execute(query).mappings().all()
+        source.rollback()
+        if not rows:
+            return copied
+        if user_table.keep_key:
+            values = [dict(row) for row in rows]
+        else:
+            values = [{column: value for column, value in row.items() if column != user_table.key} for row in rows]
+        target.execute(insert(table), values)
+        target.commit()
+        copied += len(rows)
+        last = rows[-1][user_table.key]
+
+
+# Deletes the user's habit rows from one shard, `batch_size` rows per transaction, and their placeholder user row
+# if asked to (never on the primary, where the real user row is).
+def _delete_rows(db: Session, user_id: int, batch_size: int, placeholder: bool):
+    for user_table in reversed(USER_TABLES):
+        table, key = user_table.table, user_table.table.c[user_table.key]
+        while True:
+            batch = select(key).where(table.c.user_id == user_id).limit(batch_size)
+            deleted = db.execute(delete(table).where(table.c.user_id == user_id, key.in_(batch))).rowcount
+            db.commit()
+            if deleted < batch_size:
+                break
+    if placeholder:
+        db.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+        db.commit()
+
+
+def _copy_user(move: Move, batch_size: int) -> int:
+    source, target = sharding.shard_set.get(move.source), sharding.shard_set.get(move.target)
+    with source.SessionLocal() as source_db, target.SessionLocal() as target_db:
+        _delete_rows(target_db, move.user_id, batch_size, placeholder=False)
+        if move.target != 0:
+            crud.create_shard_user(target_db, move.user_id)
+        return sum(_copy_rows(source_db, target_db, user_table, move.user_id, batch_size) for user_table in USER_TABLES)
+
+
+# Moves a group of users to other shards, all through the same steps, so the grace periods are waited once per group.
+def move_users(moves: List[Move], grace_seconds: Optional[float] = None, batch_size: Optional[int] = None) -> MoveResult:
+    grace_seconds = settings.SHARD_MOVE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+    moves = [move for move in moves if move.source != move.target]
+    if not moves:
+        return MoveResult(0, 0, 0.0, 0.0)
+
+    started = time.perf_counter()
+    with sharding.shard_set.get(0).SessionLocal() as directory:
+        for move in moves:
+            crud.set_user_shard(directory, move.user_id, move.source, moving=True)
+        time.sleep(grace_seconds)
+
+        try:
+            rows = sum(_copy_user(move, batch_size) for move in moves)
+        except Exception:
+            directory.rollback()
+            for move in moves:
+                crud.set_user_shard(directory, move.user_id, move.source)
+            raise
+
+        for move in moves:
+            crud.set_user_shard(directory, move.user_id, move.target, moving=True)
+        time.sleep(grace_seconds)
+        for move in moves:
+            crud.set_user_shard(directory, move.user_id, move.target)
+            sharding.shard_directory.pop(move.user_id)
+    writes_blocked = time.perf_counter() - started
+
+    for move in moves:
+        with sharding.shard_set.get(move.source).SessionLocal() as source_db:
+            _delete_rows(source_db, move.user_id, batch_size, placeholder=move.source != 0)
+
+    result = MoveResult(len(moves), rows, time.perf_counter() - started, writes_blocked)
+    logger.info(
+        "Moved %d users (%d rows) in %.2fs; their writes waited %.2fs",
+        result.users, result.rows, result.seconds, result.writes_blocked_seconds,
+    )
+    return result
+
+
+# Moves one user to `target`. A move that was interrupted after its copy is finished by running it again.
+def move_user(user_id: int, target: int, grace_seconds: Optional[float] = None, batch_size: Optional[int] = None) -> MoveResult:
+    sharding.shard_set.get(target)
+    with sharding.shard_set.get(0).SessionLocal() as directory:
+        if crud.get_user_identity(directory, None, user_id) is None:
+            raise ValueError(f"There is no user {user_id}")
+        row = crud.get_user_shard(directory, user_id)
+        if row is not None and row.moving and row.shard_id == target:
+            crud.set_user_shard(directory, user_id, target)
+    source = row.shard_id if row is not None else 0
+    return move_users([Move(user_id, source, target)], grace_seconds, batch_size)
+
+
+# The moves that put every user on the shard the hash ring places them on.
+def plan_rebalance() -> List[Move]:
+    moves, after_id = [], 0
+    with sharding.shard_set.get(0).SessionLocal() as directory:
+        while True:
+            users = crud.get_user_shards(directory, after_id, USERS_PER_PAGE)
+            if not users:
+                return moves
+            for user_id, shard_id in users:
+                target = sharding.shard_set.place(user_id)
+                if target != shard_id:
+                    moves.append(Move(user_id, shard_id, target))
+            after_id = users[-1][0]
+
+
+def rebalance(group_size: int = 100, grace_seconds: Optional[float] = None, batch_size: Optional[int] = None) -> MoveResult:
+    moves = plan_rebalance()
+    users, rows, seconds, blocked = 0, 0, 0.0, 0.0
+    for start in range(0, len(moves), group_size):
+        result = move_users(moves[start:start + group_size], grace_seconds, batch_size)
+        users, rows, seconds, blocked = users + result.users, rows + result.rows, seconds + result.seconds, max(blocked, result.writes_blocked_seconds)
+    return MoveResult(users, rows, seconds, blocked)
+
+
+def _summarize(moves: List[Move]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for move in moves:
+        route = f"{move.source} -> {move.target}"
+        counts[route] = counts.get(route, 0) + 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users' habits between shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move_parser = commands.add_parser("move", help="move one user to a shard")
+    move_parser.add_argument("user_id", type=int)
+    move_parser.add_argument("shard_id", type=int)
+    rebalance_parser = commands.add_parser("rebalance", help="move every user the hash ring places on another shard")
+    rebalance_parser.add_argument("--dry-run", action="store_true", help="only report the moves")
+    rebalance_parser.add_argument("--group-size", type=int, default=100, help="users moved together")
+    for command in (move_parser, rebalance_parser):
+        command.add_argument("--batch-size", type=int, default=settings.SHARD_MOVE_BATCH_SIZE, help="rows per transaction")
+    args = parser.parse_args()
+
+    if args.command == "move":
+        result = move_user(args.user_id, args.shard_id, batch_size=args.batch_size)
+    elif args.dry_run:
+        moves = plan_rebalance()
+        for route, count in sorted(_summarize(moves).items()):
+            print(f"Shard {route}: {count} users")
+        print(f"{len(moves)} users to move")
+        return
+    else:
+        result = rebalance(args.group_size, batch_size=args.batch_size)
+    print(
+        f"Moved {result.users} users ({result.rows} rows) in {result.seconds:.2f}s; "
+        f"their writes waited at most {result.writes_blocked_seconds:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Read replicas (DATABASE_REPLICA_URLS).
+
+Read endpoints take a ReadSession (from the `get_read_session` dependency) and run their queries with `run_read`:
+- each request gets the next replica in round-robin order
+- a replica that fails to connect is skipped for REPLICA_RETRY_SECONDS, and the query is retried on the primary
+- a user who just changed something reads from the primary for REPLICA_STICKY_SECONDS, so replication lag
+  never hides their own writes (the write endpoints call note_write)
+
+Without replicas, a ReadSession simply wraps the primary session.
+"""
+import itertools
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from fastapi import Depends
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database.database import get_async_database_url, get_engine_options, get_session, run_db, stream_rows
+from app.database.pool_metrics import instrument_engine, pool_metrics
+
+logger = logging.getLogger(__name__)
+
+RECENT_WRITERS_MAX_ENTRIES = 100_000
+
+
+class Replica:
+    """One replica: its engines (the async one is only created when needed) and when it may be tried again after a failure."""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.engine = create_engine(url, **get_engine_options(url))
+        instrument_engine(name, self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def open_session(self, is_async: bool):
+        if not is_async:
+            return self.SessionLocal()
+        with self._lock:
+            if self.AsyncSessionLocal is None:
+                async_url = get_async_database_url(self.url)
+                self.async_engine = create_async_engine(async_url, **get_engine_options(async_url, is_async=True))
+                instrument_engine(f"{self.name}_async", self.async_engine)
+                self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        return self.AsyncSessionLocal()
+
+    def is_available(self) -> bool:
+        return self.down_until <= time.monotonic()
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+
+class ReplicaRouter:
+    """Hands out the replicas round-robin, skipping the ones that recently failed."""
+
+    def __init__(self, replicas: List[Replica]):
+        self.replicas = replicas
+        self._counter = itertools.count()
+
+    def choose(self) -> Optional[Replica]:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._counter) % len(self.replicas)]
+            if replica.is_available():
+                return replica
+        return None
+
+
+replica_router = ReplicaRouter([])
+
+
+# (Re)creates the replicas from a list of URLs. Called at import time with DATABASE_REPLICA_URLS.
+def configure_replicas(urls: List[str]):
+    global replica_router
+    for replica in replica_router.replicas:
+        replica.engine.dispose()
+        pool_metrics.pop(replica.name, None)
+    replica_router = ReplicaRouter([Replica(f"replica_{index}", url) for index, url in enumerate(urls)])
+
+
+configure_replicas([url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()])
+
+
+class RecentWriters:
+    """
+    Users who changed something in the last REPLICA_STICKY_SECONDS. Kept in Redis when REDIS_URL is set,
+    so that it holds across worker processes; otherwise in an in-process cache.
+    """
+
+    prefix = "wellness:recent-writer:"
+
+    def __init__(self):
+        self._memory = TTLCache(RECENT_WRITERS_MAX_ENTRIES)
+        self._redis = None
+        if settings.REDIS_URL:
+            import redis.asyncio as redis
+
+            self._redis = redis.Redis.from_url(settings.REDIS_URL)
+
+    async def add(self, user_id: int):
+        if self._redis is not None:
+            await self._redis.set(f"{self.prefix}{user_id}", 1, px=int(1000 * settings.REPLICA_STICKY_SECONDS))
+        else:
+            self._memory.set(user_id, True, settings.REPLICA_STICKY_SECONDS)
+
+    async def contains(self, user_id: int) -> bool:
+        if self._redis is not None:
+            return bool(await self._redis.exists(f"{self.prefix}{user_id}"))
+        return self._memory.get(user_id) is not None
+
+    def clear(self):
+        self._memory.clear()
+
+
+recent_writers = RecentWriters()
+
+
+# Marks the user as having just written. Only needed when there are replicas to be stale.
+# The write endpoints call this once their change is committed, before they respond.
+async def note_write(user_id: int):
+    if replica_router.replicas:
+        await recent_writers.add(user_id)
+
+
+class ReadSession:
+    """The sessions a read may use: the primary always, and a replica when one was chosen for this request."""
+
+    def __init__(self, primary, replica=None, target: Optional[Replica] = None):
+        self.primary = primary
+        self.replica = replica
+        self.target = target
+
+    # The sessions to read a user's data with: the primary alone if the user wrote recently.
+    async def for_user(self, user_id: int) -> "ReadSession":
+        if self.replica is not None and await recent_writers.contains(user_id):
+            return ReadSession(self.primary)
+        return self
+
+
+# Depends on get_session, so the primary is the same session (and the same override in tests) that the rest of the request uses.
+async def get_read_session(db: Session = Depends(get_session)):
+    replica = replica_router.choose()
+    if replica is None:
+        yield ReadSession(db)
+        return
+
+    is_async = isinstance(db, AsyncSession)
+    replica_db = replica.open_session(is_async)
+    try:
+        yield ReadSession(db, replica_db, replica)
+    finally:
+        if is_async:
+            await replica_db.close()
+        else:
+            await run_in_threadpool(replica_db.close)
+
+
+
+# Returns the request's connections to their pools before the request ends. Long-lived responses (event streams)
+# call this once they are done with the database, instead of holding a connection until the client goes away.
+# The sessions stay usable and are closed again, harmlessly, when the request ends.
+async def release_read_session(read: ReadSession):
+    for db in (read.primary, read.replica):
+        if isinstance(db, AsyncSession):
+            await db.close()
+        elif db is not None:
+            await run_in_threadpool(db.close)
+
+# Errors that mean the replica itself is unreachable, rather than a problem with the query.
+def _is_connection_error(exc: DBAPIError) -> bool:
+    return exc.connection_invalidated or isinstance(exc, (OperationalError, InterfaceError))
+
+
+def _replica_failed(read: ReadSession, exc: DBAPIError):
+    read.target.mark_down()
+    logger.warning("Replica %s failed, reading from the primary for %ss: %s", read.target.name, settings.REPLICA_RETRY_SECONDS, exc)
+
+
+# Like run_db, but on the replica if there is one, falling back to the primary if it can't be reached.
+async def run_read(read: ReadSession, func, *args, **kwargs):
+    if read.replica is not None and read.target.is_available():
+        try:
+            return await run_db(read.replica, func, *args, **kwargs)
+        except DBAPIError as exc:
+            if not _is_connection_error(exc):
+                raise
+            _replica_failed(read, exc)
+    return await run_db(read.primary, func, *args, **kwargs)
+
+
+# Like stream_rows, with the same fallback. Once rows have been sent, a failure can't be retried elsewhere.
+async def stream_read_rows(read: ReadSession, statement, batch_size: int):
+    if read.replica is not None and read.target.is_available():
+        started = False
+        try:
+            async for rows in stream_rows(read.replica, statement, batch_size):
+                started = True
+                yield rows
+            return
+        except DBAPIError as exc:
+            if started or not _is_connection_error(exc):
+                raise
+            _replica_failed(read, exc)
+    async for rows in stream_rows(read.primary, statement, batch_size):
+        yield rows
@@ -0,0 +1,301 @@
+"""
+Incremental per-user statistics (the `habit_stats` table).
+
+Check-ins and habit changes update the rollup rows in the same transaction as the change itself,
+so reading the stats never has to scan habits or logs. `backfill` rebuilds the table from scratch:
+
+    python -m app.database.rollups backfill [--user-id ID ...]
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.core.streaks import period_start, previous_period_start, utcnow
+from app.database.database import dialect_insert
+from app.models import Habit as HabitModel, HabitLog as HabitLogModel, HabitStats as HabitStatsModel, User as UserModel
+
+# The stats windows, and the habit frequency whose periods they follow.
+WINDOWS = {"day": "daily", "week": "weekly", "month": "monthly"}
+
+# The category value of the row that covers all of a user's habits.
+ALL_CATEGORIES = ""
+
+BACKFILL_BATCH_SIZE = 1000
+BACKFILL_USERS_PER_PAGE = 1000
+
+
+def _category(value: Optional[str]) -> str:
+    return value or ALL_CATEGORIES
+
+
+# Creates the user's rows for these categories if they are missing, e.g. for users whose habits are older than the
+# rollups and who were never backfilled, so that the updates that follow have rows to count in. A new row starts
+# with the user's habit count; rows that exist are left alone.
+def _ensure_rows(db: Session, user_id: int, categories: Iterable[str]):
+    def habit_count(category: str):
+        query = select(func.count()).where(HabitModel.user_id == user_id)
+        if category != ALL_CATEGORIES:
+            query = query.where(HabitModel.category == category)
+        return query.scalar_subquery()
+
+    statement = dialect_insert(db, HabitStatsModel).values(
+        [{"user_id": user_id, "category": category, "habit_count": habit_count(category)} for category in set(categories)]
+    )
+    db.execute(statement.on_conflict_do_nothing(index_elements=[HabitStatsModel.user_id, HabitStatsModel.category]))
+
+
+# Sets current_streak to the best streak among the user's habits (per category) and raises longest_streak if needed.
+# This reads the user's habits through the user_id index, never the check-in history.
+def refresh_streaks(db: Session, user_id: int):
+    _ensure_rows(db, user_id, [ALL_CATEGORIES])
+    _refresh_streaks(db, HabitStatsModel.user_id == user_id)
+
+# refresh_streaks for several users in one statement, e.g. after streaks expired (see app/database/streak_expiry.py).
+def refresh_streaks_of(db: Session, user_ids: List[int]):
+    _refresh_streaks(db, HabitStatsModel.user_id.in_(user_ids))
+
+def _refresh_streaks(db: Session, user_condition):
+    best_streak = (
+        select(func.coalesce(func.max(HabitModel.streak), 0))
+        .where(
+            HabitModel.user_id == HabitStatsModel.user_id,
+            or_(HabitStatsModel.category == ALL_CATEGORIES, func.coalesce(HabitModel.category, ALL_CATEGORIES) == HabitStatsModel.category),
+        )
+        .scalar_subquery()
+    )
+    db.execute(
+        update(HabitStatsModel)
+        .where(user_condition)
+        .values(
+            current_streak=best_streak,
+            longest_streak=case((HabitStatsModel.longest_streak > best_streak, HabitStatsModel.longest_streak), else_=best_streak),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Counts newly created habits. Rows for new categories are created on the fly.
+def add_habits(db: Session, user_id: int, categories: Iterable[Optional[str]]):
+    counts: Dict[str, int] = defaultdict(int)
+    for category in categories:
+        counts[ALL_CATEGORIES] += 1
+        if category:
+            counts[category] += 1
+    if not counts:
+        return
+
+    statement = dialect_insert(db, HabitStatsModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=[HabitStatsModel.user_id, HabitStatsModel.category],
+        set_={"habit_count": HabitStatsModel.habit_count + statement.excluded.habit_count},
+    )
+    db.execute(statement, [{"user_id": user_id, "category": category, "habit_count": count} for category, count in counts.items()])
+
+
+# Recounts the user's habits per category and refreshes the streaks. Used after updates and deletes,
+# where the old category or streak of the changed habits isn't known. Cost grows with the number of habits, not with history.
+def refresh_habit_totals(db: Session, user_id: int):
+    counts = {ALL_CATEGORIES: 0}
+    for category, count in db.execute(
+        select(func.coalesce(HabitModel.category, ALL_CATEGORIES), func.count())
+        .where(HabitModel.user_id == user_id)
+        .group_by(func.coalesce(HabitModel.category, ALL_CATEGORIES))
+    ):
+        counts[ALL_CATEGORIES] += count
+        if category:
+            counts[category] = count
+
+    db.execute(
+        update(HabitStatsModel)
+        .where(HabitStatsModel.user_id == user_id, HabitStatsModel.category.not_in(counts))
+        .values(habit_count=0)
+        .execution_options(synchronize_session=False)
+    )
+    statement = dialect_insert(db, HabitStatsModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=[HabitStatsModel.user_id, HabitStatsModel.category],
+        set_={"habit_count": statement.excluded.habit_count},
+    )
+    db.execute(statement, [{"user_id": user_id, "category": category, "habit_count": count} for category, count in counts.items()])
+    refresh_streaks(db, user_id)
+
+
+# Counts a check-in in the all-habits row and the habit's category row.
+# This has to run *before* the habit's last_logged is updated: a habit counts as completed in a window
+# the first time it is logged there, which we tell from its previous last_logged.
+def record_checkin(db: Session, user_id: int, habit_id: int, now: datetime):
+    habit_filter = (HabitModel.id == habit_id, HabitModel.user_id == user_id)
+    habit = db.execute(select(func.coalesce(HabitModel.category, ALL_CATEGORIES), HabitModel.last_logged).where(*habit_filter)).first()
+    if habit is None:
+        return
+    category, previous_last_logged = habit
+    _ensure_rows(db, user_id, [ALL_CATEGORIES, category])
+
+    values = {HabitStatsModel.total_checkins: HabitStatsModel.total_checkins + 1}
+    for window, frequency in WINDOWS.items():
+        start = period_start(frequency, now)
+        window_start = getattr(HabitStatsModel, f"{window}_start")
+        checkins = getattr(HabitStatsModel, f"{window}_checkins")
+        completed = getattr(HabitStatsModel, f"{window}_completed")
+        same_window = window_start == start
+        first_in_window = 1 if previous_last_logged is None or previous_last_logged < start else 0
+        values[checkins] = case((same_window, checkins + 1), else_=1)
+        values[completed] = case((same_window, completed + first_in_window), else_=first_in_window)
+        values[window_start] = start
+
+    db.execute(
+        update(HabitStatsModel)
+        .where(HabitStatsModel.user_id == user_id, or_(HabitStatsModel.category == ALL_CATEGORIES, HabitStatsModel.category == category))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# The stats rows of a user: the all-habits row first, then one per category.
+def get_stats(db: Session, user_id: int) -> List[HabitStatsModel]:
+    return db.scalars(
+        select(HabitStatsModel).where(HabitStatsModel.user_id == user_id).order_by(HabitStatsModel.category)
+    ).all()
+
+
+# Turns habit_stats rows into the response of the stats endpoint.
+# A window whose stored period isn't the current one had no check-ins yet in this period, so it reads as zero.
+def build_stats(rows: List[HabitStatsModel], now: datetime) -> dict:
+    def describe(row: Optional[HabitStatsModel]) -> dict:
+        data = {
+            "habit_count": row.habit_count if row else 0,
+            "total_checkins": row.total_checkins if row else 0,
+            "current_streak": row.current_streak if row else 0,
+            "longest_streak": row.longest_streak if row else 0,
+        }
+        for window, frequency in WINDOWS.items():
+            start = period_start(frequency, now)
+            stats = {"start": start, "checkins": 0, "completed": 0, "completion_rate": 0.0}
+            if row is not None and getattr(row, f"{window}_start") == start:
+                stats["checkins"] = getattr(row, f"{window}_checkins")
+                stats["completed"] = getattr(row, f"{window}_completed")
+                if row.habit_count:
+                    stats["completion_rate"] = round(min(stats["completed"] / row.habit_count, 1.0), 4)
+            data[frequency] = stats
+        return data
+
+    overall = next((row for row in rows if row.category == ALL_CATEGORIES), None)
+    stats = describe(overall)
+    stats["categories"] = [
+        dict(describe(row), category=row.category) for row in rows if row.category != ALL_CATEGORIES and row.habit_count
+    ]
+    return stats
+
+
+# Rebuilds habit_stats from the habits and habit_logs tables, for all users or only the given ones.
+# Users are rebuilt BACKFILL_USERS_PER_PAGE at a time, in order of id, one transaction per page, so memory grows with
+# the number of (user, category) pairs in a page, not with the number of users or the size of the history.
+def backfill(db: Session, user_ids: Optional[List[int]] = None) -> int:
+    now = utcnow()
+    count = 0
+    if user_ids:
+        user_ids = sorted(set(user_ids))
+        for offset in range(0, len(user_ids), BACKFILL_USERS_PER_PAGE):
+            count += _backfill_users(db, user_ids[offset:offset + BACKFILL_USERS_PER_PAGE], now)
+        return count
+
+    after_id = 0
+    while True:
+        page = db.scalars(select(UserModel.id).where(UserModel.id > after_id).order_by(UserModel.id).limit(BACKFILL_USERS_PER_PAGE)).all()
+        if not page:
+            return count
+        count += _backfill_users(db, page, now)
+        after_id = page[-1]
+
+
+# Rebuilds the habit_stats rows of one page of users and commits them.
+# Logs are read in batches from a server-side cursor and replayed per habit to find the longest streaks.
+def _backfill_users(db: Session, user_ids: List[int], now: datetime) -> int:
+    window_starts = {window: period_start(frequency, now) for window, frequency in WINDOWS.items()}
+    rows: Dict[tuple, dict] = {}
+
+    def row_for(user_id: int, category: str) -> dict:
+        key = (user_id, category)
+        if key not in rows:
+            rows[key] = {
+                "user_id": user_id, "category": category, "habit_count": 0, "total_checkins": 0,
+                "current_streak": 0, "longest_streak": 0,
+                **{f"{window}_start": start for window, start in window_starts.items()},
+                **{f"{window}_{column}": 0 for window in WINDOWS for column in ("checkins", "completed")},
+            }
+        return rows[key]
+
+    habits = select(HabitModel.user_id, HabitModel.category, HabitModel.streak).where(HabitModel.user_id.in_(user_ids))
+    for user_id, category, streak in db.execute(habits.execution_options(yield_per=BACKFILL_BATCH_SIZE)):
+        for key in {ALL_CATEGORIES, _category(category)}:
+            row = row_for(user_id, key)
+            row["habit_count"] += 1
+            row["current_streak"] = max(row["current_streak"], streak or 0)
+
+    logs = (
+        select(HabitLogModel.habit_id, HabitLogModel.logged_at, HabitModel.user_id, HabitModel.category, HabitModel.frequency)
+        .join(HabitModel, HabitModel.id == HabitLogModel.habit_id)
+        .where(HabitModel.user_id.in_(user_ids))
+        .order_by(HabitLogModel.habit_id, HabitLogModel.logged_at)
+    )
+    current_habit, previous_logged, streak, completed_windows = None, None, 0, set()
+    for habit_id, logged_at, user_id, category, frequency in db.execute(logs.execution_options(yield_per=BACKFILL_BATCH_SIZE)):
+        frequency = (frequency or "daily").lower()
+        if habit_id != current_habit:
+            current_habit, previous_logged, streak, completed_windows = habit_id, None, 0, set()
+
+        # Same rules as the check-in endpoint: same period keeps the streak, the next period extends it, a gap resets it.
+        if previous_logged is not None and previous_logged >= period_start(frequency, logged_at):
+            pass
+        elif previous_logged is not None and previous_logged >= previous_period_start(frequency, logged_at):
+            streak += 1
+        else:
+            streak = 1
+        previous_logged = logged_at
+
+        for key in {ALL_CATEGORIES, _category(category)}:
+            row = row_for(user_id, key)
+            row["total_checkins"] += 1
+            row["longest_streak"] = max(row["longest_streak"], streak)
+            for window, start in window_starts.items():
+                if logged_at >= start:
+                    row[f"{window}_checkins"] += 1
+                    if window not in completed_windows:
+                        row[f"{window}_completed"] += 1
+        for window, start in window_starts.items():
+            if logged_at >= start:
+                completed_windows.add(window)
+
+    for row in rows.values():
+        row["longest_streak"] = max(row["longest_streak"], row["current_streak"])
+
+    db.execute(delete(HabitStatsModel).where(HabitStatsModel.user_id.in_(user_ids)))
+    values = list(rows.values())
+    for offset in range(0, len(values), BACKFILL_BATCH_SIZE):
+        db.execute(insert(HabitStatsModel), values[offset:offset + BACKFILL_BATCH_SIZE])
+    db.commit()
+    return len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the habit_stats rollup table.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="rebuild habit_stats from habits and habit_logs")
+    backfill_parser.add_argument("--user-id", type=int, action="append", dest="user_ids", help="only rebuild these users")
+    args = parser.parse_args()
+
+    from app.database.database import SessionLocal
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        count = backfill(db, args.user_ids)
+    print(f"Rebuilt {count} habit_stats rows in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
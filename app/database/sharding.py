@@ -0,0 +1,262 @@
+"""
+Horizontal sharding of the habit data by user (DATABASE_SHARD_URLS).
+
+Every habit table (habits, habit_logs, habit_stats, habit_versions, habit_tombstones) is keyed by user, and every
+habit query is scoped to one user, so each user's habits live together on one shard:
+- shard 0 is the primary (DATABASE_URL), which also keeps the users, their tokens and the shard directory
+- the directory (the user_shards table) says which shard each user is on; users without a row are on shard 0,
+  which is where everyone was before sharding was turned on
+- new users are placed with a consistent hash ring over all shards. Adding a shard changes the placement of only
+  about 1/N of the users, and `python -m app.database.rebalance` moves just those (see app/database/rebalance.py)
+- the habit endpoints get their sessions from `get_shard_session` and `get_shard_read_session`, which are bound to
+  the user's shard. Each worker caches where users are for SHARD_DIRECTORY_CACHE_SECONDS.
+
+Every shard has the whole schema (`python -m app.database.migrate` upgrades them all), and a placeholder row in `users`
+for each of its users, which keeps the habit tables' foreign keys working. On Postgres, every shard hands out habit
+ids of its own (id % SHARD_ID_STRIDE == shard id), so habits keep their ids when their user moves.
+Without DATABASE_SHARD_URLS there is just shard 0 and the directory is never read.
+"""
+import bisect
+import hashlib
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, NamedTuple
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from app.core.auth import get_current_user
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database import crud
+from app.database.database import SessionLocal, get_async_database_url, get_engine_options, get_session, run_db
+from app.database.pool_metrics import instrument_engine, pool_metrics
+from app.database.replicas import ReadSession, get_read_session, release_read_session
+from app.schemas.auth import AuthenticatedUser
+
+# Shard ids go from 1 to SHARD_ID_STRIDE - 1, and each shard's habit ids are its id modulo SHARD_ID_STRIDE.
+SHARD_ID_STRIDE = 1024
+
+SHARD_DIRECTORY_MAX_ENTRIES = 100_000
+
+
+# Parses DATABASE_SHARD_URLS ("1=postgresql://...,2=postgresql://...") into {shard id: URL}.
+def parse_shard_urls(value: str) -> Dict[int, str]:
+    urls = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        shard_id, separator, url = entry.partition("=")
+        if not separator or not shard_id.strip().isdigit() or not url.strip():
+            raise ValueError(f"DATABASE_SHARD_URLS entries look like <shard id>=<URL>, got {entry.strip()!r}")
+        shard_id = int(shard_id)
+        if not 0 < shard_id < SHARD_ID_STRIDE:
+            raise ValueError(f"Shard ids go from 1 to {SHARD_ID_STRIDE - 1}, got {shard_id}")
+        urls[shard_id] = url.strip()
+    return urls
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    A consistent hash ring of shard ids. Each shard owns `virtual_nodes` points on the ring, and a user belongs to the
+    shard of the first point after the hash of their id. Adding a shard only takes over the users just before its
+    points, so about 1/N of them move, all to the new shard.
+    """
+
+    def __init__(self, shard_ids: Iterable[int], virtual_nodes: int):
+        points = sorted((_hash(f"shard-{shard_id}-{index}"), shard_id) for shard_id in shard_ids for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._shard_ids = [shard_id for _, shard_id in points]
+
+    def shard_for(self, user_id: int) -> int:
+        index = bisect.bisect(self._hashes, _hash(f"user-{user_id}")) % len(self._hashes)
+        return self._shard_ids[index]
+
+
+class Shard:
+    """One shard: its engines (the async one is only created when needed) and a session factory for jobs and tools."""
+
+    def __init__(self, shard_id: int, url: str = None, session_factory=None):
+        self.shard_id = shard_id
+        self.url = url
+        self.engine = None
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        self._lock = threading.Lock()
+        if session_factory is None:
+            self.engine = create_engine(url, **get_engine_options(url))
+            instrument_engine(self.name, self.engine)
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.SessionLocal = session_factory
+
+    @property
+    def name(self) -> str:
+        return f"shard_{self.shard_id}"
+
+    def open_session(self, is_async: bool):
+        if not is_async:
+            return self.SessionLocal()
+        with self._lock:
+            if self.AsyncSessionLocal is None:
+                async_url = get_async_database_url(self.url)
+                self.async_engine = create_async_engine(async_url, **get_engine_options(async_url, is_async=True))
+                instrument_engine(f"{self.name}_async", self.async_engine)
+                self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        return self.AsyncSessionLocal()
+
+    # Closes the pooled connections and stops reporting the pools, when the shards are reconfigured.
+    def discard(self):
+        if self.engine is not None:
+            self.engine.dispose()
+            pool_metrics.pop(self.name, None)
+            pool_metrics.pop(f"{self.name}_async", None)
+
+
+class ShardSet:
+    """Every shard by id, 0 (the primary) included, and the ring new users are placed with."""
+
+    def __init__(self, shards: Dict[int, Shard]):
+        self.shards = shards
+        self.ring = HashRing(shards, settings.SHARD_VIRTUAL_NODES)
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.shards) > 1
+
+    def place(self, user_id: int) -> int:
+        return self.ring.shard_for(user_id)
+
+    def get(self, shard_id: int) -> Shard:
+        shard = self.shards.get(shard_id)
+        if shard is None:
+            raise RuntimeError(f"There is no shard {shard_id} in DATABASE_SHARD_URLS")
+        return shard
+
+
+class ShardLocation(NamedTuple):
+    shard_id: int
+    moving: bool
+
+
+# Where users are, by id. A move waits SHARD_MOVE_GRACE_SECONDS for every worker's entry to expire.
+shard_directory = TTLCache(SHARD_DIRECTORY_MAX_ENTRIES)
+
+shard_set = ShardSet({})
+
+
+# (Re)creates the shards from {shard id: URL}. Called at import time with DATABASE_SHARD_URLS.
+# Shard 0 uses the app's own sessions unless `primary_session_factory` is given.
+def configure_shards(urls: Dict[int, str], primary_session_factory=None):
+    global shard_set
+    for shard in shard_set.shards.values():
+        shard.discard()
+    shards = {0: Shard(0, settings.DATABASE_URL, session_factory=primary_session_factory or SessionLocal)}
+    shards.update((shard_id, Shard(shard_id, url)) for shard_id, url in urls.items())
+    shard_set = ShardSet(shards)
+    shard_directory.clear()
+
+
+configure_shards(parse_shard_urls(settings.DATABASE_SHARD_URLS))
+
+
+# Where the user's habits are, from the cache or the directory on the primary.
+async def locate_user(db, user_id: int) -> ShardLocation:
+    if not shard_set.enabled:
+        return ShardLocation(0, False)
+    location = shard_directory.get(user_id)
+    if location is None:
+        row = await run_db(db, crud.get_user_shard, user_id)
+        location = ShardLocation(row.shard_id, row.moving) if row is not None else ShardLocation(0, False)
+        shard_directory.set(user_id, location, settings.SHARD_DIRECTORY_CACHE_SECONDS)
+    return location
+
+
+# A session on one of the shards other than the primary, of the same kind (sync or async) as `db`.
+@asynccontextmanager
+async def open_shard_session(shard_id: int, db):
+    is_async = isinstance(db, AsyncSession)
+    shard_db = shard_set.get(shard_id).open_session(is_async)
+    try:
+        yield shard_db
+    finally:
+        if is_async:
+            await shard_db.close()
+        else:
+            await run_in_threadpool(shard_db.close)
+
+
+# Records where a new user's habits go, and creates the user's row on that shard. Without shards there is nothing to do.
+async def place_user(db, user_id: int):
+    if not shard_set.enabled:
+        return
+    shard_id = shard_set.place(user_id)
+    if shard_id != 0:
+        async with open_shard_session(shard_id, db) as shard_db:
+            await run_db(shard_db, crud.create_shard_user, user_id)
+    await run_db(db, crud.set_user_shard, user_id, shard_id)
+
+
+# The session dependency of the habit endpoints that write: a session on the user's shard.
+# While the user is being moved to another shard, writes are refused with a 503 so that none are lost.
+# On another shard, the primary's connection goes back to its pool as soon as the shard is known.
+async def get_shard_session(db: Session = Depends(get_session), current_user: AuthenticatedUser = Depends(get_current_user)):
+    location = await locate_user(db, current_user.id)
+    if location.moving:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Your habits are being moved, please retry shortly",
+            headers={"Retry-After": str(settings.SHARD_MOVE_RETRY_AFTER_SECONDS)},
+        )
+    if location.shard_id == 0:
+        yield db
+        return
+    await release_read_session(ReadSession(db))
+    async with open_shard_session(location.shard_id, db) as shard_db:
+        yield shard_db
+
+
+# The same for the habit endpoints that only read, which keep working during a move. Users on shard 0 read
+# through the primary's replicas as before; the other shards are read from directly.
+async def get_shard_read_session(read_db: ReadSession = Depends(get_read_session), current_user: AuthenticatedUser = Depends(get_current_user)):
+    location = await locate_user(read_db.primary, current_user.id)
+    if location.shard_id == 0:
+        yield read_db
+        return
+    await release_read_session(read_db)
+    async with open_shard_session(location.shard_id, read_db.primary) as shard_db:
+        yield ReadSession(shard_db)
+
+
+# Closes every shard's pooled connections. The app calls this on shutdown, next to dispose_engines.
+async def dispose_shards():
+    for shard in shard_set.shards.values():
+        if shard.engine is not None:
+            shard.engine.dispose()
+        if shard.async_engine is not None:
+            await shard.async_engine.dispose()
+
+
+# Postgres only: makes the shard hand out habit ids with id % SHARD_ID_STRIDE == shard_id, above any id it already has,
+# so that no two shards ever give out the same id and a user's habits can move without being renumbered.
+# Returns False if the sequence was already set up. SQLite has no sequences, so there ids can clash when a user moves.
+def stride_habit_ids(connection, shard_id: int) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    sequence = connection.scalar(text("SELECT pg_get_serial_sequence('habits', 'id')"))
+    increment = connection.scalar(
+        text("SELECT seqincrement FROM pg_sequence WHERE seqrelid = CAST(:sequence AS regclass)"), {"sequence": sequence}
+    )
+    if increment == SHARD_ID_STRIDE:
+        return False
+    highest = connection.scalar(text("SELECT COALESCE(MAX(id), 0) FROM habits"))
+    start = (highest // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE + shard_id
+    connection.execute(text(f"ALTER SEQUENCE {sequence} INCREMENT BY {SHARD_ID_STRIDE} RESTART WITH {start}"))
+    connection.commit()
+    return True
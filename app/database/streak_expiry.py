@@ -0,0 +1,118 @@
+"""
+Resets the streaks of habits whose owners missed a period of their `frequency`. Check-ins only restart a streak
+at the next check-in, so without this a habit nobody logs any more would keep its old streak forever.
+
+The habits table is walked in chunks of STREAK_EXPIRY_CHUNK_SIZE habits, in id order, and each chunk is expired with set-based
+UPDATEs in a transaction of its own, so no lock is held for longer than one chunk. An advisory lock makes sure only
+one process runs the job at a time. Every shard is handled on its own, with its own lock (see app/database/sharding.py).
+Every worker runs it about every STREAK_EXPIRY_INTERVAL_SECONDS (see app/main.py); it can also be run on its own,
+once or in a loop:
+
+    python -m app.database.streak_expiry [--every SECONDS] [--chunk-size N]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core import change_feed
+from app.core.config import settings
+from app.core.streaks import utcnow
+from app.database import crud, sharding
+from app.database.locks import try_advisory_lock
+
+logger = logging.getLogger(__name__)
+
+# An arbitrary, fixed advisory lock key, like MIGRATION_LOCK_ID in app/database/migrate.py.
+STREAK_EXPIRY_LOCK_ID = 72_311_906
+
+
+class StreakExpiryResult(NamedTuple):
+    ran: bool  # False if another process was already running the job
+    chunks: int
+    expired: int  # habits whose streak was reset
+    user_ids: List[int]  # users who had a streak reset
+    seconds: float
+    slowest_chunk_seconds: float
+
+
+# Expires every overdue streak as of `now`. `session_factory` makes the sessions to work with (SessionLocal by default).
+def expire_overdue_streaks(session_factory=None, chunk_size: Optional[int] = None, now: Optional[datetime] = None) -> StreakExpiryResult:
+    if session_factory is None:
+        from app.database.database import SessionLocal as session_factory
+    chunk_size = chunk_size or settings.STREAK_EXPIRY_CHUNK_SIZE
+    now = now or utcnow()
+
+    started = time.perf_counter()
+    with session_factory() as db, try_advisory_lock(db.get_bind(), STREAK_EXPIRY_LOCK_ID) as acquired:
+        if not acquired:
+            logger.info("Streak expiry is already running elsewhere, skipping")
+            return StreakExpiryResult(False, 0, 0, [], 0.0, 0.0)
+
+        chunk_start = crud.get_habit_id_after(db, 0, 0)
+        chunks, expired, user_ids, slowest = 0, 0, set(), 0.0
+        while chunk_start is not None:
+            chunk_end = crud.get_habit_id_after(db, chunk_start, chunk_size)
+            db.rollback()
+            chunk_started = time.perf_counter()
+            chunk_expired, chunk_users = crud.expire_streaks(db, chunk_start, chunk_end, now)
+            chunk_seconds = time.perf_counter() - chunk_started
+            chunks += 1
+            expired += chunk_expired
+            user_ids.update(chunk_users)
+            slowest = max(slowest, chunk_seconds)
+            logger.debug("Streak expiry: ids %d-%s, %d expired in %.3fs", chunk_start, chunk_end or "end", chunk_expired, chunk_seconds)
+            chunk_start = chunk_end
+
+    result = StreakExpiryResult(True, chunks, expired, sorted(user_ids), time.perf_counter() - started, slowest)
+    logger.info(
+        "Expired %d streaks of %d users in %d chunks in %.2fs (slowest chunk %.3fs)",
+        result.expired, len(result.user_ids), result.chunks, result.seconds, result.slowest_chunk_seconds,
+    )
+    return result
+
+
+# Runs the job every `interval` seconds, for the app's lifetime. The first run comes after a random part of the
+# interval, so workers (and restarts) spread out instead of all reaching for the lock at once.
+# The affected users' open streams are told to resync; clients that sync later get the changes anyway.
+async def run_periodically(interval: float):
+    await asyncio.sleep(random.uniform(0, interval))
+    while True:
+        for shard in list(sharding.shard_set.shards.values()):
+            try:
+                result = await run_in_threadpool(expire_overdue_streaks, shard.SessionLocal)
+                for user_id in result.user_ids:
+                    await change_feed.publish_resync(user_id)
+            except Exception:
+                logger.exception("Streak expiry failed on shard %d", shard.shard_id)
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reset the streaks of habits that missed a period.")
+    parser.add_argument("--every", type=float, help="keep running, every this many seconds")
+    parser.add_argument("--chunk-size", type=int, default=settings.STREAK_EXPIRY_CHUNK_SIZE, help="habits per transaction")
+    args = parser.parse_args()
+
+    while True:
+        for shard in sharding.shard_set.shards.values():
+            result = expire_overdue_streaks(shard.SessionLocal, chunk_size=args.chunk_size)
+            if result.ran:
+                print(
+                    f"Shard {shard.shard_id}: expired {result.expired} streaks of {len(result.user_ids)} users in "
+                    f"{result.chunks} chunks in {result.seconds:.2f}s (slowest chunk {result.slowest_chunk_seconds:.3f}s)"
+                )
+            else:
+                print(f"Shard {shard.shard_id}: another process is already expiring streaks, skipped")
+        if args.every is None:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,79 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response, status
+from fastapi.datastructures import Default
+from fastapi.responses import JSONResponse
 from app.api.v1.endpoints import habits, users
+from app.core import change_feed, jwt_keys
+from app.core.config import settings
+from app.core.instrumentation import InstrumentationMiddleware
+from app.core.rate_limit import RateLimitMiddleware
+from app.core.responses import FastJSONResponse
+from app.core.security import HashingPoolSaturated
+from app.database import sharding, streak_expiry
+from app.database.database import dispose_engines
+from app.database.pool_metrics import get_pool_metrics
+
+# On shutdown (e.g. SIGTERM during a deploy) the server first drains in-flight requests, then this closes the pools.
+# Open habit change streams are ended when the shutdown starts (see app/server.py); their clients reconnect elsewhere.
+# Every worker also schedules the streak expiry job; its advisory lock lets only one of them run it at a time.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await change_feed.change_broker.start()
+    streak_expiry_task = None
+    if settings.STREAK_EXPIRY_INTERVAL_SECONDS > 0:
+        streak_expiry_task = asyncio.create_task(streak_expiry.run_periodically(settings.STREAK_EXPIRY_INTERVAL_SECONDS))
+    yield
+    if streak_expiry_task is not None:
+        streak_expiry_task.cancel()
+    await change_feed.change_broker.stop()
+    await dispose_engines()
+    await sharding.dispose_shards()
 
 app = FastAPI(
     title="Personal Wellness tracker API",
     description="A backend API for tracking personal wellness data.",
-    version="1.0.0"
+    version="1.0.0",
+    # Wrapped in Default() so that routes with a response_model keep FastAPI's own fast path, which
+    # serializes through the model's TypeAdapter straight to bytes. Everything else renders with pydantic-core.
+    default_response_class=Default(FastJSONResponse),
+    lifespan=lifespan,
 )
 
+# Per-user/IP token buckets and the per-worker concurrency limit. See app/core/rate_limit.py.
+app.add_middleware(RateLimitMiddleware)
+
+# Server-Timing header, slow request / N+1 query logging and the sampling profiler. See app/core/instrumentation.py.
+# Added last so it wraps the rate limiter, and rejected requests are measured too.
+app.add_middleware(InstrumentationMiddleware)
 
 app.include_router(habits.router, prefix ="/v1/habits", tags=["habits"])
 app.include_router(users.router, prefix="/v1/users", tags=["users"])
 
+# When too many logins/sign-ups are already waiting on bcrypt, we shed load instead of letting requests pile up.
+@app.exception_handler(HashingPoolSaturated)
+def hashing_pool_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(settings.HASHING_RETRY_AFTER_SECONDS)},
+    )
+
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the Personal Wellness Tracker API"}
\ No newline at end of file
+    return {"message": "Welcome to the Personal Wellness Tracker API"}
+
+
+# The public keys tokens are signed with, as a JWK Set, so other services can verify tokens offline.
+# Empty when tokens are signed with the shared SECRET_KEY (HS256).
+@app.get("/.well-known/jwks.json", tags=["auth"])
+def read_jwks(response: Response):
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return jwt_keys.key_ring.jwks()
+
+
+# Connection pool health: connections in use, overflow, checkout wait times and timeouts, per engine.
+@app.get("/metrics", tags=["monitoring"])
+def read_metrics():
+    return {"database_pools": get_pool_metrics()}
@@ -1,6 +1,14 @@
 from .user import User
 from .habit import Habit
+from .habit_log import HabitLog
+from .habit_stats import HabitStats
+from .habit_version import HabitVersion
+from .habit_tombstone import HabitTombstone
+from .revoked_token import RevokedToken
+from .refresh_token import RefreshToken
+from .user_shard import UserShard
 
 # We also need to define the reverse relationship on the User model. We must do this after both models are defined.
 from sqlalchemy.orm import relationship
-User.habits = relationship("Habit", back_populates="owner")
\ No newline at end of file
+# The database deletes a user's habits (ON DELETE CASCADE), so the ORM doesn't need to load them first.
+User.habits = relationship("Habit", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database.database import Base
@@ -6,12 +6,37 @@ from app.database.database import Base
 class Habit(Base):
     __tablename__ = "habits"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     name = Column(String, nullable=False)
     category = Column(String)
     frequency = Column(String)
     streak = Column(Integer, default=0)
     last_logged = Column(DateTime)
+    # Goes up with every change to the habit. Clients send it back in If-Match to make sure they don't overwrite a newer change.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # The user's habit version (see HabitVersion) at the habit's last change. It only goes up, so
+    # GET /v1/habits/changes can find what changed since a client's last sync with an index range scan.
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
-    owner = relationship("User", back_populates="habits")
\ No newline at end of file
+    owner = relationship("User", back_populates="habits")
+
+    # Every habit query is scoped to one user, and lists are paged by id, so (user_id, id) serves all of them.
+    # The list filters and sort orders each have an index on (user_id, <column>, id): it narrows the rows down
+    # and returns them in keyset order. The frequency filter has only three values, so (user_id, id) serves it.
+    # The name search is a prefix match on lower(name). On Postgres, (user_id, lower(name) text_pattern_ops) serves it:
+    # LIKE 'q%' can only use a btree under a non-C collation with the pattern operator class, which in turn
+    # can't serve ORDER BY, so the sort keeps its own index. SQLite searches with (user_id, lower(name), id).
+    # (user_id, revision) serves the delta sync.
+    __table_args__ = (
+        Index("ix_habits_user_id_id", "user_id", "id"),
+        Index("ix_habits_user_id_revision", "user_id", "revision"),
+        Index("ix_habits_user_id_category_id", "user_id", "category", "id"),
+        Index("ix_habits_user_id_streak_id", "user_id", "streak", "id"),
+        Index("ix_habits_user_id_last_logged_id", "user_id", "last_logged", "id"),
+        Index("ix_habits_user_id_lower_name_id", "user_id", func.lower(name), "id"),
+        Index(
+            "ix_habits_user_id_lower_name_pattern", "user_id", func.lower(name).label("lower_name"),
+            postgresql_ops={"lower_name": "text_pattern_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index
+from app.database.database import Base
+
+# One row per check-in. The current streak lives on the habit itself, so reading it never scans this table.
+class HabitLog(Base):
+    __tablename__ = "habit_logs"
+
+    id = Column(Integer, primary_key=True)
+    habit_id = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    logged_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_habit_logs_habit_id_logged_at", "habit_id", "logged_at"),
+    )
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from app.database.database import Base
+
+# Precomputed per-user statistics, kept up to date by every check-in and habit change (see app/database/rollups.py).
+# There is one row per (user, category), plus one row with category "" that covers all of the user's habits,
+# so the stats endpoint reads a handful of rows by primary key no matter how long the history is.
+# Each window (day, week, month) remembers which period it counts, and starts over when a check-in lands in a new one.
+class HabitStats(Base):
+    __tablename__ = "habit_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    category = Column(String, primary_key=True, default="")
+    habit_count = Column(Integer, nullable=False, default=0)
+    total_checkins = Column(Integer, nullable=False, default=0)
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_streak = Column(Integer, nullable=False, default=0)
+
+    day_start = Column(DateTime)
+    day_checkins = Column(Integer, nullable=False, default=0)
+    day_completed = Column(Integer, nullable=False, default=0)
+    week_start = Column(DateTime)
+    week_checkins = Column(Integer, nullable=False, default=0)
+    week_completed = Column(Integer, nullable=False, default=0)
+    month_start = Column(DateTime)
+    month_checkins = Column(Integer, nullable=False, default=0)
+    month_completed = Column(Integer, nullable=False, default=0)
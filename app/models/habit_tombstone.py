@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index
+from app.database.database import Base
+
+# A record of a deleted habit, so clients syncing changes (GET /v1/habits/changes) learn of the deletion.
+# `revision` is the user's habit version the deletion was made at, like Habit.revision for the habits still there.
+# The key includes the user because SQLite may hand a deleted habit's id to a new habit of another user.
+class HabitTombstone(Base):
+    __tablename__ = "habit_tombstones"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    habit_id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_habit_tombstones_user_id_revision", "user_id", "revision"),
+    )
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, ForeignKey
+from app.database.database import Base
+
+# A counter per user that goes up with every change to the user's habits (create, update, delete, check-in).
+# It is what the habit endpoints use as their ETag and response cache key, so a conditional GET
+# only reads this one row by primary key instead of the habits themselves.
+class HabitVersion(Base):
+    __tablename__ = "habit_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
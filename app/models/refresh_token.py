@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from app.database.database import Base
+
+# Refresh tokens, one row per token ever issued. Only a SHA-256 hash of each token is stored: the tokens are
+# 256 random bits, so a fast hash is as safe as bcrypt here and costs microseconds instead of a bcrypt round.
+# The tokens issued by one login and all its refreshes share a `family_id`. A token can be used once (`used_at`);
+# presenting it again means it was stolen, and the whole family is revoked (`revoked_at`).
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String, nullable=False, unique=True)
+    family_id = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_refresh_tokens_family_id", "family_id"),
+        Index("ix_refresh_tokens_user_id", "user_id"),
+    )
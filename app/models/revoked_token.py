@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from app.database.database import Base
+
+# Access tokens revoked before they expired (e.g. on logout), by their `jti` claim.
+# Requests check app/core/revocation.py's in-memory filter first; this table is only read for possible matches,
+# and incrementally by `revoked_at` to keep every process's filter up to date.
+# Rows are only needed until `expires_at`, after which the token is rejected anyway and the row can be deleted.
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+    )
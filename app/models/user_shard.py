@@ -0,0 +1,12 @@
+from sqlalchemy import Boolean, Column, Integer, ForeignKey, false
+from app.database.database import Base
+
+# The shard directory: which shard holds each user's habits (see app/database/sharding.py). Only the primary's copy
+# of this table is used. Users without a row live on shard 0, the primary.
+# `moving` is set while app/database/rebalance.py moves the user to another shard; habit writes wait until it's done.
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    shard_id = Column(Integer, nullable=False)
+    moving = Column(Boolean, nullable=False, default=False, server_default=false())
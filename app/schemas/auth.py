@@ -1,5 +1,20 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+# The body of POST /v1/users/token/refresh.
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+# The authenticated caller, as resolved from a JWT by get_current_user.
+# It only carries what the endpoints need, so a request can be authorized without loading a User ORM object.
+# `jti` is the id of the token it was authenticated with (tokens issued before ids were added have none).
+class AuthenticatedUser(BaseModel):
+    id: int
+    email: str
+    jti: Optional[str] = None
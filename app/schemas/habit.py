@@ -1,6 +1,7 @@
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Literal, Optional
+from typing_extensions import TypedDict
+from datetime import datetime, timezone
 
 class HabitBase(BaseModel):
     name: str
@@ -10,6 +11,13 @@ class HabitBase(BaseModel):
 class HabitCreate(HabitBase):
     pass # This schema is identical to the base for now, but we separate it for clarity.
 
+# last_logged is stored as naive UTC, so timestamps with a timezone are converted to that.
+def as_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# An update replaces the habit's fields, so `name` has to be given, and as a string: null is a 422, not a NULL in the table.
 class HabitUpdate(HabitBase):
     streak: Optional[int] = None
     last_logged: Optional[datetime] = None
@@ -19,6 +27,86 @@ class Habit(HabitBase):
     user_id: int
     streak: Optional[int] = None
     last_logged: Optional[datetime] = None
+    version: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# The fields of Habit as a plain dict, in the same order. The read endpoints serialize database rows through
+# a TypeAdapter of this, which writes JSON bytes without building and validating a Habit per row.
+class HabitRow(TypedDict):
+    name: str
+    category: Optional[str]
+    frequency: Optional[str]
+    id: int
+    user_id: int
+    streak: Optional[int]
+    last_logged: Optional[datetime]
+    version: int
+
+# The body of GET /v1/habits/changes: the habits created or updated and the ids of those deleted since the client's
+# watermark, and the new watermark to send next time. With `full` set, `habits` is every habit the user has.
+class HabitChanges(TypedDict):
+    watermark: int
+    full: bool
+    habits: List[HabitRow]
+    deleted: List[int]
+
+# The orders GET /v1/habits/ can return habits in. A leading "-" sorts descending; `name` ignores case.
+# Habits that were never logged (or have no streak) come last in ascending order and first in descending order.
+HabitSort = Literal["id", "-id", "name", "-name", "streak", "-streak", "last_logged", "-last_logged"]
+
+# The filters and sort order of GET /v1/habits/, all optional. `q` matches the start of the name, ignoring case.
+# `logged_after` is inclusive and `logged_before` exclusive.
+class HabitFilters(BaseModel):
+    category: Optional[str] = None
+    frequency: Optional[str] = None
+    streak_gte: Optional[int] = Field(None, ge=0)
+    logged_after: Optional[datetime] = None
+    logged_before: Optional[datetime] = None
+    q: Optional[str] = Field(None, min_length=1, max_length=100)
+    sort: HabitSort = "id"
+
+    _naive_utc = field_validator("logged_after", "logged_before")(as_naive_utc)
+
+# One row of an import file (POST /v1/habits/import). Imported habits are new habits of the user, so the file's
+# ids, owners and versions are ignored; the streak and last check-in are kept, so an export can be restored.
+class HabitImport(HabitCreate):
+    streak: Optional[int] = 0
+    last_logged: Optional[datetime] = None
+
+    _naive_utc = field_validator("last_logged")(as_naive_utc)
+
+class HabitImportResult(BaseModel):
+    imported: int
+
+# The largest number of operations (creates + updates + deletes) a single batch request may carry.
+MAX_BATCH_SIZE = 500
+
+class HabitBatchUpdate(HabitUpdate):
+    id: int
+
+# A batch of changes, applied in one transaction: creates first, then updates, then deletes.
+class HabitBatch(BaseModel):
+    create: List[HabitCreate] = Field(default_factory=list, max_length=MAX_BATCH_SIZE)
+    update: List[HabitBatchUpdate] = Field(default_factory=list, max_length=MAX_BATCH_SIZE)
+    delete: List[int] = Field(default_factory=list, max_length=MAX_BATCH_SIZE)
+
+    # The per-list limits reject oversized lists early; this caps the operations of all three lists together.
+    @model_validator(mode="after")
+    def check_batch_size(self):
+        if len(self.create) + len(self.update) + len(self.delete) > MAX_BATCH_SIZE:
+            raise ValueError(f"A batch can carry at most {MAX_BATCH_SIZE} operations in total")
+        return self
+
+# The outcome of one operation in a batch. `index` is the item's position in its own list (create, update or delete).
+class HabitBatchItemResult(BaseModel):
+    op: Literal["create", "update", "delete"]
+    index: int
+    status: int
+    id: Optional[int] = None
+    habit: Optional[Habit] = None
+    detail: Optional[str] = None
+
+class HabitBatchResult(BaseModel):
+    results: List[HabitBatchItemResult]
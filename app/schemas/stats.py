@@ -0,0 +1,27 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+# Check-ins in the current day, week or month.
+# `completed` counts habits logged at least once in the window, and `completion_rate` is completed / habit_count.
+class WindowStats(BaseModel):
+    start: datetime
+    checkins: int = 0
+    completed: int = 0
+    completion_rate: float = 0.0
+
+class StatsBase(BaseModel):
+    habit_count: int = 0
+    total_checkins: int = 0
+    current_streak: int = 0
+    longest_streak: int = 0
+    daily: WindowStats
+    weekly: WindowStats
+    monthly: WindowStats
+
+class CategoryStats(StatsBase):
+    category: str
+
+# Stats across all of a user's habits, plus the same numbers per category.
+class HabitStats(StatsBase):
+    categories: List[CategoryStats] = []
@@ -0,0 +1,90 @@
+"""
+Helpers for running the API under gunicorn in production (see gunicorn.conf.py and start.sh).
+"""
+import importlib.util
+import os
+import sys
+
+from gunicorn.arbiter import Arbiter
+from uvicorn import Server
+from uvicorn_worker import UvicornWorker
+
+
+# The CPUs this process may actually run on, which in a container can be fewer than the machine has.
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Picks uvloop and httptools when they are installed (they come with uvicorn[standard]), and the pure-Python
+# asyncio loop and h11 parser otherwise, so a missing extra never keeps the server from starting.
+def event_loop_settings() -> dict:
+    return {
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+    }
+
+
+class StreamClosingServer(Server):
+    """
+    A uvicorn server that ends the open habit change streams as soon as it starts shutting down. Streams never finish
+    on their own, so otherwise every one of them would hold up the shutdown for the whole graceful timeout.
+    """
+
+    async def shutdown(self, sockets=None):
+        from app.core import change_feed
+
+        change_feed.hub.close()
+        await super().shutdown(sockets)
+
+
+class ProductionUvicornWorker(UvicornWorker):
+    """
+    The uvicorn worker with an explicit event loop and HTTP parser. On SIGTERM it stops accepting connections,
+    ends the open event streams and lets in-flight requests finish for up to GRACEFUL_TIMEOUT seconds before the
+    app's shutdown runs.
+    """
+
+    CONFIG_KWARGS = {
+        **event_loop_settings(),
+        "timeout_graceful_shutdown": int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+    }
+
+    # UvicornWorker._serve, with StreamClosingServer in place of uvicorn's Server.
+    async def _serve(self):
+        self.config.app = self.wsgi
+        server = StreamClosingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+# Runs in the gunicorn master after the app was preloaded and before the workers are forked,
+# so that every worker inherits work that would otherwise be repeated in each of them on its first request.
+def warm_up():
+    from sqlalchemy.orm import configure_mappers
+
+    from app.core.security import pwd_context
+
+    # Resolves the relationships and builds the mappers of every model.
+    configure_mappers()
+    # passlib looks for a working bcrypt backend on first use.
+    pwd_context.handler("bcrypt").get_backend()
+
+
+# Connections opened before the fork (e.g. while warming up) must never be shared between processes.
+# close=False leaves the parent's connections to the parent and just gives this process fresh, empty pools.
+def dispose_pools_after_fork():
+    from app.database import database, replicas, sharding
+
+    engines = [(database.engine, database.async_engine)]
+    engines += [(replica.engine, replica.async_engine) for replica in replicas.replica_router.replicas]
+    engines += [(shard.engine, shard.async_engine) for shard in sharding.shard_set.shards.values()]
+    for engine, async_engine in engines:
+        if engine is not None:
+            engine.dispose(close=False)
+        if async_engine is not None:
+            async_engine.sync_engine.dispose(close=False)
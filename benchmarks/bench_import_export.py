@@ -0,0 +1,92 @@
+"""
+Times POST /v1/habits/import and GET /v1/habits/export for one user with many habits.
+
+The import body is generated on the fly and sent in 64 KiB chunks, like a large upload. With --trace-memory
+the import is run again under tracemalloc at a tenth of the size and at full size, to show that its peak memory
+doesn't grow with the file (tracemalloc slows everything down, so those runs are not timed).
+
+Usage:
+    python benchmarks/bench_import_export.py --rows 100000 --format csv
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from common import setup_app
+
+CHUNK_BYTES = 64 * 1024
+PASSWORD = "benchmark-password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="habits to import")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--trace-memory", action="store_true", help="also measure the import's peak memory")
+    return parser.parse_args()
+
+
+def upload_body(rows: int, file_format: str):
+    async def chunks():
+        buffer = "name,category,frequency,streak\n" if file_format == "csv" else ""
+        for i in range(rows):
+            if file_format == "csv":
+                buffer += f"Habit {i},health,daily,{i % 30}\n"
+            else:
+                buffer += f'{{"name": "Habit {i}", "category": "health", "frequency": "daily", "streak": {i % 30}}}\n'
+            if len(buffer) >= CHUNK_BYTES:
+                yield buffer.encode()
+                buffer = ""
+        if buffer:
+            yield buffer.encode()
+    return chunks()
+
+
+async def import_habits(client, headers, rows: int, file_format: str):
+    content_type = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    response = await client.post(
+        "/v1/habits/import", content=upload_body(rows, file_format), headers={**headers, "Content-Type": content_type}
+    )
+    assert response.status_code == 201, response.text
+    assert response.json()["imported"] == rows
+
+
+async def log_in(client, email: str) -> dict:
+    await client.post("/v1/users/", json={"email": email, "password": PASSWORD})
+    response = await client.post("/v1/users/token", data={"username": email, "password": PASSWORD})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run(args):
+    import httpx
+
+    app, engine, _ = setup_app("bench_import_export")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers = await log_in(client, "bench@example.com")
+
+        started = time.perf_counter()
+        await import_habits(client, headers, args.rows, args.format)
+        import_seconds = time.perf_counter() - started
+        print(f"import {args.rows} rows ({args.format}): {import_seconds:.2f}s, {args.rows / import_seconds:,.0f} rows/s")
+
+        started = time.perf_counter()
+        response = await client.get("/v1/habits/export", params={"format": args.format}, headers=headers)
+        export_seconds = time.perf_counter() - started
+        assert response.status_code == 200
+        print(f"export {args.rows} rows ({args.format}): {export_seconds:.2f}s, {len(response.content) / 1e6:.1f} MB")
+
+        if args.trace_memory:
+            for index, rows in enumerate((args.rows // 10, args.rows)):
+                headers = await log_in(client, f"memory{index}@example.com")
+                tracemalloc.start()
+                await import_habits(client, headers, rows, args.format)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"import {rows} rows: peak {peak / 1e6:.1f} MB traced")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
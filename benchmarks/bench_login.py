@@ -0,0 +1,79 @@
+"""
+Measures login throughput (logins/sec, and logins/sec per hashing worker) against the real ASGI app.
+
+The app runs in-process on a throwaway SQLite database, so the numbers reflect bcrypt and the hashing pool
+rather than network or Postgres latency.
+
+Usage:
+    python benchmarks/bench_login.py --logins 200 --concurrency 16 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from common import setup_app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200, help="total number of logins to perform")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost (defaults to BCRYPT_ROUNDS)")
+    parser.add_argument("--workers", type=int, default=None, help="hashing pool size (defaults to HASHING_POOL_WORKERS)")
+    return parser.parse_args()
+
+
+async def run(args):
+    import httpx
+
+    from app.core.config import settings
+    from app.core.security import get_password_hash
+    from app.database import crud
+
+    app, engine, SessionLocal = setup_app("bench_login")
+
+    with SessionLocal() as db:
+        crud.create_user(db, email="bench@example.com", password_hash=get_password_hash("benchpassword"))
+
+    remaining = args.logins
+    rejected = 0
+
+    async def worker(client):
+        nonlocal remaining, rejected
+        while remaining > 0:
+            remaining -= 1
+            response = await client.post(
+                "/v1/users/token",
+                data={"username": "bench@example.com", "password": "benchpassword"},
+            )
+            if response.status_code == 503:
+                rejected += 1
+            else:
+                response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    completed = args.logins - rejected
+    per_second = completed / elapsed
+    print(f"bcrypt rounds:        {settings.BCRYPT_ROUNDS}")
+    print(f"hashing workers:      {settings.HASHING_POOL_WORKERS}")
+    print(f"concurrency:          {args.concurrency}")
+    print(f"logins completed:     {completed} ({rejected} rejected with 503)")
+    print(f"elapsed:              {elapsed:.2f}s")
+    print(f"logins/sec:           {per_second:.1f}")
+    print(f"logins/sec per core:  {per_second / settings.HASHING_POOL_WORKERS:.1f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Settings are read once at import time, so overrides have to be in the environment before the app is imported.
+    if args.rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    if args.workers is not None:
+        os.environ["HASHING_POOL_WORKERS"] = str(args.workers)
+    asyncio.run(run(args))
@@ -0,0 +1,88 @@
+"""
+Compares the two ways of turning a page of habits into JSON bytes, at 10, 1k and 10k rows:
+
+- orm:  load Habit ORM objects, validate them into List[HabitSchema] with from_attributes and dump them
+        (what FastAPI's response_model did for read_habits before)
+- rows: select the columns as plain rows and dump them through a TypeAdapter of List[HabitRow]
+        (what the read endpoints do now)
+
+Each path is timed including the query, and for serialization alone.
+
+Usage:
+    python benchmarks/bench_serialization.py --repeat 20
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import List
+
+from common import setup_app
+
+SIZES = [10, 1_000, 10_000]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement; the best run is reported")
+    return parser.parse_args()
+
+
+# The fastest of `repeat` runs, in milliseconds.
+def best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return 1000 * best
+
+
+def main():
+    args = parse_args()
+    from pydantic import TypeAdapter
+    from sqlalchemy import insert, select
+
+    from app.database import crud
+    from app.models import Habit as HabitModel, User as UserModel
+    from app.schemas.habit import HabitRow, Habit as HabitSchema
+
+    _, engine, SessionLocal = setup_app("bench_serialization")
+    orm_adapter = TypeAdapter(List[HabitSchema])
+    rows_adapter = TypeAdapter(List[HabitRow])
+
+    with SessionLocal() as db:
+        user_id = db.scalar(insert(UserModel).values(email="bench@example.com", password_hash="x").returning(UserModel.id))
+        db.execute(insert(HabitModel), [
+            {"user_id": user_id, "name": f"Habit {i}", "category": "health", "frequency": "daily", "streak": i % 30, "last_logged": datetime(2026, 1, 1)}
+            for i in range(max(SIZES))
+        ])
+        db.commit()
+
+    print(f"{'rows':>8}{'orm total':>12}{'rows total':>12}{'speedup':>9}{'orm dump':>11}{'rows dump':>11}{'speedup':>9}   (ms, best of {args.repeat})")
+    for size in SIZES:
+        with SessionLocal() as db:
+            def orm_path():
+                habits = db.scalars(select(HabitModel).where(HabitModel.user_id == user_id).order_by(HabitModel.id).limit(size)).all()
+                db.expunge_all()
+                return orm_adapter.dump_json(orm_adapter.validate_python(habits, from_attributes=True))
+
+            def rows_path():
+                return rows_adapter.dump_json(crud.get_habits_page(db, user_id, None, size))
+
+            assert orm_path() == rows_path()
+            orm_total, rows_total = best_of(args.repeat, orm_path), best_of(args.repeat, rows_path)
+
+            habits = db.scalars(select(HabitModel).where(HabitModel.user_id == user_id).order_by(HabitModel.id).limit(size)).all()
+            rows = crud.get_habits_page(db, user_id, None, size)
+            orm_dump = best_of(args.repeat, lambda: orm_adapter.dump_json(orm_adapter.validate_python(habits, from_attributes=True)))
+            rows_dump = best_of(args.repeat, lambda: rows_adapter.dump_json(rows))
+
+        print(
+            f"{size:>8}{orm_total:>12.2f}{rows_total:>12.2f}{orm_total / rows_total:>8.1f}x"
+            f"{orm_dump:>11.2f}{rows_dump:>11.2f}{orm_dump / rows_dump:>8.1f}x"
+        )
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures what open habit change streams cost a worker: CPU while they sit idle, memory per stream, and how long
+one change takes to reach every stream of a user.
+
+Each stream runs the same loop as GET /v1/habits/stream, on the ChangeHub directly, so the numbers are about
+the hub and not about the HTTP server.
+
+Usage:
+    python benchmarks/bench_streams.py --streams 5000 --idle-seconds 5
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import common  # noqa: F401  (puts the app on sys.path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=5000, help="open streams, all of one user")
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    parser.add_argument("--keepalive", type=float, default=15, help="STREAM_KEEPALIVE_SECONDS")
+    parser.add_argument("--changes", type=int, default=100, help="changes to fan out")
+    return parser.parse_args()
+
+
+async def run(args):
+    from app.core.change_feed import ChangeHub, sse_frame
+
+    hub = ChangeHub()
+    received = 0
+    all_received = asyncio.Event()
+
+    async def stream(subscription):
+        nonlocal received
+        while True:
+            frames = await subscription.next_frames(args.keepalive)
+            if frames is None:
+                return
+            received += 1
+            if received == args.streams * args.changes:
+                all_received.set()
+
+    tracemalloc.start()
+    tasks = [asyncio.create_task(stream(hub.subscribe(1))) for _ in range(args.streams)]
+    await asyncio.sleep(0.5)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.streams} streams: {memory / args.streams / 1024:.1f} KiB each")
+
+    cpu_started, started = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.idle_seconds)
+    cpu = time.process_time() - cpu_started
+    print(f"idle for {time.perf_counter() - started:.1f}s: {cpu * 1000:.1f}ms CPU ({100 * cpu / args.idle_seconds:.2f}% of a core)")
+
+    frame = sse_frame("upsert", b'{"id":1,"name":"Habit","version":2}')
+    started = time.perf_counter()
+    for _ in range(args.changes):
+        hub.deliver(1, frame)
+        await asyncio.sleep(0)
+    await all_received.wait()
+    seconds = time.perf_counter() - started
+    deliveries = args.streams * args.changes
+    print(f"fan-out: {deliveries} deliveries in {seconds:.2f}s, {deliveries / seconds:,.0f}/s")
+
+    hub.close()
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,39 @@
+"""
+Shared setup for the benchmark scripts: a throwaway SQLite database wired into the real ASGI app.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Every simulated user logs in from the same address, so the per-IP limits would throttle the benchmarks themselves.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+
+# Creates a fresh database with every table, points the app's get_db at it, and returns (app, engine, SessionLocal).
+# Pass a database_url to benchmark against a real server instead of SQLite.
+def setup_app(name: str, database_url: str = None):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database.database import Base, get_db
+    from app.main import app
+
+    if database_url is None:
+        database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), f"{name}.db")
+    connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+    engine = create_engine(database_url, connect_args=connect_args)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    return app, engine, SessionLocal
@@ -0,0 +1,224 @@
+"""
+Load test for the API: throughput and p50/p95/p99 latency of login, list, get, update and create.
+
+The real ASGI app from app/main.py runs in-process and is driven by concurrent httpx AsyncClient workers.
+The database is seeded with --users users that have --habits habits each, using bulk INSERTs.
+
+Usage:
+    python benchmarks/load_test.py                              # run and print the results
+    python benchmarks/load_test.py --save-baseline              # run and store the results as the new baseline
+    python benchmarks/load_test.py --compare --threshold 20     # run and fail if anything regressed by more than 20%
+
+Baselines are only comparable on the same machine with the same options, so regenerate
+benchmarks/baseline.json whenever either changes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from common import setup_app
+
+SCENARIOS = ["login", "list", "get", "update", "create"]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PASSWORD = "loadtestpassword"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="number of users to seed")
+    parser.add_argument("--habits", type=int, default=200, help="habits per user")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario (login uses one per user)")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent client workers")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost (defaults to BCRYPT_ROUNDS)")
+    parser.add_argument("--database-url", default=None, help="run against this database instead of a temporary SQLite file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed regression in percent before --compare fails")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for picking users and habits")
+    return parser.parse_args()
+
+
+# Inserts users and habits with a few multi-row INSERTs instead of going through the API.
+def seed(SessionLocal, users: int, habits: int):
+    from sqlalchemy import insert
+
+    from app.core.security import get_password_hash
+    from app.database import rollups
+    from app.models import Habit as HabitModel, User as UserModel
+
+    # Every user shares one hash, so seeding costs a single bcrypt run.
+    password_hash = get_password_hash(PASSWORD)
+    with SessionLocal() as db:
+        user_ids = db.scalars(
+            insert(UserModel).returning(UserModel.id, sort_by_parameter_order=True),
+            [{"email": f"user{i}@loadtest.example.com", "password_hash": password_hash} for i in range(users)],
+        ).all()
+        habit_ids = {}
+        for user_id in user_ids:
+            habit_ids[user_id] = db.scalars(
+                insert(HabitModel).returning(HabitModel.id, sort_by_parameter_order=True),
+                [
+                    {"user_id": user_id, "name": f"Habit {i}", "category": random.choice(["health", "mind", "fitness"]), "frequency": "daily", "streak": 0}
+                    for i in range(habits)
+                ],
+            ).all()
+        db.commit()
+        rollups.backfill(db)
+    return user_ids, habit_ids
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 0.95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+    }
+
+
+# Runs `count` requests built by `make_request` on `concurrency` workers and returns the scenario summary.
+async def run_scenario(client, make_request, count, concurrency, expected_status):
+    latencies, errors = [], 0
+    remaining = count
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = make_request()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != expected_status:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run(args):
+    import httpx
+
+    random.seed(args.seed)
+    app, engine, SessionLocal = setup_app("load_test", args.database_url)
+    seed_started = time.perf_counter()
+    user_ids, habit_ids = seed(SessionLocal, args.users, args.habits)
+    print(f"Seeded {args.users} users x {args.habits} habits in {time.perf_counter() - seed_started:.2f}s")
+
+    tokens = {}
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            logins = iter(enumerate(user_ids))
+
+            def login_request():
+                index, user_id = next(logins)
+                return "POST", "/v1/users/token", {"data": {"username": f"user{index}@loadtest.example.com", "password": PASSWORD}}
+
+            results["login"] = await run_scenario(client, login_request, len(user_ids), args.concurrency, 200)
+
+            # The login scenario above only measures; fetch the tokens for the other scenarios here.
+            for index, user_id in enumerate(user_ids):
+                response = await client.post("/v1/users/token", data={"username": f"user{index}@loadtest.example.com", "password": PASSWORD})
+                tokens[user_id] = response.json()["access_token"]
+
+            def as_random_user():
+                user_id = random.choice(user_ids)
+                return user_id, {"Authorization": f"Bearer {tokens[user_id]}"}
+
+            def list_request():
+                _, headers = as_random_user()
+                return "GET", "/v1/habits/", {"headers": headers}
+
+            def get_request():
+                user_id, headers = as_random_user()
+                return "GET", f"/v1/habits/{random.choice(habit_ids[user_id])}", {"headers": headers}
+
+            def update_request():
+                user_id, headers = as_random_user()
+                habit_id = random.choice(habit_ids[user_id])
+                return "PUT", f"/v1/habits/{habit_id}", {"headers": headers, "json": {"name": f"Habit {habit_id} (updated)"}}
+
+            def create_request():
+                _, headers = as_random_user()
+                return "POST", "/v1/habits/", {"headers": headers, "json": {"name": "Load test habit", "category": "health"}}
+
+            results["list"] = await run_scenario(client, list_request, args.requests, args.concurrency, 200)
+            results["get"] = await run_scenario(client, get_request, args.requests, args.concurrency, 200)
+            results["update"] = await run_scenario(client, update_request, args.requests, args.concurrency, 200)
+            results["create"] = await run_scenario(client, create_request, args.requests, args.concurrency, 201)
+
+    engine.dispose()
+    return results
+
+
+def print_results(results):
+    print(f"{'scenario':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in SCENARIOS:
+        r = results[name]
+        print(f"{name:<10}{r['requests']:>10}{r['errors']:>8}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+# Returns a description of every metric that is worse than the baseline by more than `threshold` percent.
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    factor = threshold / 100
+    for name in SCENARIOS:
+        if name not in baseline:
+            continue
+        current, previous = results[name], baseline[name]
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if current[metric] > previous[metric] * (1 + factor):
+                regressions.append(f"{name} {metric}: {previous[metric]} -> {current[metric]}")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - factor):
+            regressions.append(f"{name} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']}")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name} errors: {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    # Settings are read once at import time, so overrides have to be in the environment before the app is imported.
+    if args.rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    options = {key: getattr(args, key) for key in ("users", "habits", "requests", "concurrency", "rounds")}
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"options": options, "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("options") != options:
+            print(f"Warning: baseline was recorded with different options: {baseline.get('options')}")
+        regressions = find_regressions(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.threshold}%.")
+
+
+if __name__ == "__main__":
+    main()
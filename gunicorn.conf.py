@@ -0,0 +1,36 @@
+# Production server settings, used by start.sh: gunicorn app.main:app --config gunicorn.conf.py
+# Every value can be overridden with the environment variables below.
+import os
+
+from app.server import available_cpus, dispose_pools_after_fork, warm_up
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# One worker per CPU available to the container. The app is async and bcrypt runs on its own thread pool,
+# so more workers than CPUs would only add memory and database connections.
+workers = int(os.getenv("WEB_CONCURRENCY", available_cpus()))
+worker_class = "app.server.ProductionUvicornWorker"
+
+# Import the app once in the master, so models, schemas and routes are built before forking and shared copy-on-write.
+preload_app = True
+
+# On SIGTERM gunicorn stops accepting connections and gives workers this long to finish in-flight requests.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Optionally recycle workers after this many requests (plus jitter, so they don't all restart at once).
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    warm_up()
+    server.log.info("App warmed up, starting %s workers", workers)
+
+
+def post_fork(server, worker):
+    dispose_pools_after_fork()
@@ -3,10 +3,11 @@
 # Exit immediately if a command exits with a non-zero status.
 set -e
 
-# Run Alembic migrations to create/update database tables
-echo "Running database migrations..."
-alembic upgrade head
+# Run Alembic migrations, but only if the database is behind the latest revision
+echo "Checking database migrations..."
+python -m app.database.migrate
 
-# Start the application server
+# Start the application server: gunicorn with one uvicorn worker per CPU (see gunicorn.conf.py).
+# exec replaces this shell, so SIGTERM reaches gunicorn directly and in-flight requests are drained.
 echo "Starting the application..."
-uvicorn app.main:app --host 0.0.0.0 --port $PORT
\ No newline at end of file
+exec gunicorn app.main:app --config gunicorn.conf.py
@@ -1,10 +1,20 @@
+import asyncio
+import os
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+# The scheduled streak expiry would run against the app's own database, not the test one. Tests call the job directly.
+os.environ.setdefault("STREAK_EXPIRY_INTERVAL_SECONDS", "0")
+
 from app.main import app
-from app.database.database import Base, get_db
+from app.database.database import Base, get_db, get_async_database_url
+from app.core.cache import principal_cache, response_cache
+from app.core.rate_limit import token_buckets
+from app.core.revocation import revoked_tokens
 
 # Use an in-memory SQLite database for test isolation.
 # This ensures tests are fast and don't interfere with your dev database.
@@ -22,6 +32,14 @@ def override_get_db():
     finally:
         db.close()
 
+# The same database file opened through the async driver, for testing the API in async mode (DB_MODE=async).
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL))
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 @pytest.fixture(scope="function", autouse=True)
 def setup_and_teardown_db():
     """
@@ -31,6 +49,30 @@ def setup_and_teardown_db():
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
+    # Cached tokens, responses, rate limit buckets and revocations must not leak into the next test,
+    # which starts with an empty database.
+    principal_cache.clear()
+    asyncio.run(response_cache.clear())
+    asyncio.run(token_buckets.clear())
+    revoked_tokens.clear()
+
+@pytest.fixture
+def test_engine():
+    """
+    Provides the engine behind the test database, e.g. for listening to the SQL the API runs.
+    """
+    return engine
+
+@pytest.fixture
+def db():
+    """
+    Provides a session on the test database for tests that need to inspect or change rows directly.
+    """
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
 
 @pytest.fixture
 def client():
@@ -43,6 +85,16 @@ def client():
         yield test_client
     app.dependency_overrides.clear()
 
+@pytest.fixture
+def async_client():
+    """
+    Provides a TestClient whose endpoints get an AsyncSession, exactly as they do when DB_MODE=async.
+    """
+    app.dependency_overrides[get_db] = override_get_async_db
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
 @pytest.fixture
 def authenticated_client(client: TestClient):
     """
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+
+# These tests run the regular endpoints with an AsyncSession, the way they run when DB_MODE=async.
+
+def login(client: TestClient):
+    client.post(
+        "/v1/users/",
+        json={"email": "async@example.com", "password": "testpassword"}
+    )
+    login_response = client.post(
+        "/v1/users/token",
+        data={"username": "async@example.com", "password": "testpassword"}
+    )
+    assert login_response.status_code == 200
+    client.headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+def test_habit_crud_in_async_mode(async_client: TestClient):
+    login(async_client)
+
+    create_response = async_client.post("/v1/habits/", json={"name": "Stretch"})
+    assert create_response.status_code == 201
+    habit_id = create_response.json()["id"]
+
+    update_response = async_client.put(f"/v1/habits/{habit_id}", json={"name": "Stretch more"})
+    assert update_response.status_code == 200
+    assert update_response.json()["name"] == "Stretch more"
+
+    assert async_client.get(f"/v1/habits/{habit_id}").json()["name"] == "Stretch more"
+    assert async_client.delete(f"/v1/habits/{habit_id}").status_code == 204
+    assert async_client.get(f"/v1/habits/{habit_id}").status_code == 404
+
+def test_read_habits_in_async_mode(async_client: TestClient):
+    login(async_client)
+    for i in range(3):
+        async_client.post("/v1/habits/", json={"name": f"Habit {i}"})
+
+    page = async_client.get("/v1/habits/", params={"limit": 2})
+    assert [h["name"] for h in page.json()] == ["Habit 0", "Habit 1"]
+    assert "x-next-cursor" in page.headers
+
+    stream = async_client.get("/v1/habits/", params={"format": "ndjson"})
+    assert len(stream.text.strip().split("\n")) == 3
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import change_feed
+from app.core.change_feed import ChangeHub, RESYNC_FRAME, sse_frame
+from app.core.config import settings
+from app.main import app
+
+def parse_events(body: bytes) -> list:
+    events = []
+    for block in body.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+# Opens a stream, makes changes once it is connected, then ends every stream and returns the events the first one got.
+async def stream_while(make_changes):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/v1/users/", json={"email": "stream@example.com", "password": "testpassword"})
+        token = (await client.post(
+            "/v1/users/token", data={"username": "stream@example.com", "password": "testpassword"}
+        )).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        stream = asyncio.create_task(client.get("/v1/habits/stream"))
+        while change_feed.hub.connection_count() == 0:
+            await asyncio.sleep(0.01)
+        result = await make_changes(client)
+        change_feed.hub.close()
+        response = await stream
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    return parse_events(response.content), result
+
+@pytest.mark.parametrize("db_mode", ["client", "async_client"])
+def test_stream_pushes_every_change_of_the_user(request, db_mode):
+    request.getfixturevalue(db_mode)
+
+    async def make_changes(api):
+        habit = (await api.post("/v1/habits/", json={"name": "Read"})).json()
+        await api.put(f"/v1/habits/{habit['id']}", json={"name": "Read more"})
+        await api.post(f"/v1/habits/{habit['id']}/log")
+        other = (await api.post("/v1/habits/batch", json={"create": [{"name": "Walk"}]})).json()["results"][0]["id"]
+        await api.delete(f"/v1/habits/{other}")
+        return habit["id"], other
+
+    events, (habit_id, other_id) = asyncio.run(stream_while(make_changes))
+    assert [(event, data.get("id"), data.get("version")) for event, data in events] == [
+        ("upsert", habit_id, 1), ("upsert", habit_id, 2), ("upsert", habit_id, 3), ("upsert", other_id, 1), ("delete", other_id, None),
+    ]
+    assert events[1][1]["name"] == "Read more"
+    assert events[2][1]["streak"] == 1
+    assert change_feed.hub.connection_count() == 0
+
+def test_imports_ask_streams_to_resync(client: TestClient):
+    async def make_changes(api):
+        await api.post("/v1/habits/import", content=b"name\nOne\nTwo\n", headers={"Content-Type": "text/csv"})
+
+    events, _ = asyncio.run(stream_while(make_changes))
+    assert events == [("resync", {})]
+
+def test_streams_do_not_count_as_requests_in_flight(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_REQUESTS", 1)
+
+    async def make_changes(api):
+        return (await api.get("/v1/habits/")).status_code
+
+    _, status_code = asyncio.run(stream_while(make_changes))
+    assert status_code == 200
+
+def test_streams_beyond_the_limit_are_refused(authenticated_client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_STREAM_CONNECTIONS", 0)
+    response = authenticated_client.get("/v1/habits/stream")
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+
+def test_stream_requires_authentication(client: TestClient):
+    assert client.get("/v1/habits/stream").status_code == 401
+
+def test_slow_streams_are_told_to_resync_instead_of_buffering(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_QUEUE_SIZE", 3)
+
+    async def scenario():
+        hub = ChangeHub()
+        slow, other_user = hub.subscribe(1), hub.subscribe(2)
+        for i in range(10):
+            hub.deliver(1, sse_frame("delete", b'{"id":%d}' % i))
+        received = [await slow.next_frames(0.1) for _ in range(2)]
+        idle = await other_user.next_frames(0.01)
+        hub.close()
+        return received, idle, await slow.next_frames(0.1)
+
+    received, idle, closed = asyncio.run(scenario())
+    assert received == [RESYNC_FRAME, change_feed.KEEPALIVE_FRAME]
+    assert idle == change_feed.KEEPALIVE_FRAME
+    assert closed is None
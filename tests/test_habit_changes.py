@@ -0,0 +1,86 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+def changes(client: TestClient, since: int = 0) -> dict:
+    response = client.get("/v1/habits/changes", params={"since": since})
+    assert response.status_code == 200
+    return response.json()
+
+def test_first_sync_returns_every_habit(authenticated_client: TestClient):
+    ids = [authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"}).json()["id"] for i in range(3)]
+    body = changes(authenticated_client)
+    assert body["full"] is True
+    assert [habit["id"] for habit in body["habits"]] == ids
+    assert body["deleted"] == []
+    assert body["watermark"] == 3
+
+def test_sync_returns_only_what_changed_since_the_watermark(authenticated_client: TestClient):
+    ids = [authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"}).json()["id"] for i in range(4)]
+    watermark = changes(authenticated_client)["watermark"]
+
+    authenticated_client.put(f"/v1/habits/{ids[0]}", json={"name": "Renamed"})
+    authenticated_client.post(f"/v1/habits/{ids[1]}/log")
+    authenticated_client.delete(f"/v1/habits/{ids[2]}")
+    new_id = authenticated_client.post("/v1/habits/", json={"name": "New"}).json()["id"]
+
+    body = changes(authenticated_client, watermark)
+    assert body["full"] is False
+    assert [habit["id"] for habit in body["habits"]] == [ids[0], ids[1], new_id]
+    assert body["habits"][0]["name"] == "Renamed"
+    assert body["deleted"] == [ids[2]]
+
+    # Nothing changed since: nothing comes back, and the watermark stays.
+    assert changes(authenticated_client, body["watermark"]) == {
+        "watermark": body["watermark"], "full": False, "habits": [], "deleted": [],
+    }
+
+def test_batch_and_import_changes_are_synced(authenticated_client: TestClient):
+    ids = [authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"}).json()["id"] for i in range(2)]
+    watermark = changes(authenticated_client)["watermark"]
+
+    authenticated_client.post(
+        "/v1/habits/import", content=b"name,category\nImported,health\n", headers={"Content-Type": "text/csv"}
+    )
+    authenticated_client.post("/v1/habits/batch", json={"update": [{"id": ids[0], "name": "Batch"}], "delete": [ids[1]]})
+    body = changes(authenticated_client, watermark)
+    assert [habit["name"] for habit in body["habits"]] == ["Imported", "Batch"]
+    assert body["deleted"] == [ids[1]]
+
+def test_other_users_changes_are_not_synced(authenticated_client: TestClient, client: TestClient):
+    authenticated_client.post("/v1/habits/", json={"name": "Mine"})
+    headers = dict(authenticated_client.headers)
+
+    client.headers = {}
+    client.post("/v1/users/", json={"email": "other@example.com", "password": "testpassword"})
+    token = client.post("/v1/users/token", data={"username": "other@example.com", "password": "testpassword"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {token}"}
+    other_id = client.post("/v1/habits/", json={"name": "Theirs"}, headers=other_headers).json()["id"]
+    client.delete(f"/v1/habits/{other_id}", headers=other_headers)
+
+    body = client.get("/v1/habits/changes", params={"since": 0}, headers=headers).json()
+    assert [habit["name"] for habit in body["habits"]] == ["Mine"]
+    body = client.get("/v1/habits/changes", params={"since": 1}, headers=headers).json()
+    assert body["habits"] == [] and body["deleted"] == []
+
+def test_a_watermark_ahead_of_the_server_gets_a_full_sync(authenticated_client: TestClient):
+    authenticated_client.post("/v1/habits/", json={"name": "Habit"})
+    body = changes(authenticated_client, 50)
+    assert body["full"] is True
+    assert len(body["habits"]) == 1
+
+def test_unchanged_sync_reads_no_habits(authenticated_client: TestClient, test_engine):
+    for i in range(3):
+        authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"})
+    watermark = changes(authenticated_client)["watermark"]
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        changes(authenticated_client, watermark)
+    finally:
+        event.remove(test_engine, "before_cursor_execute", before_cursor_execute)
+    assert not any("FROM habits" in statement or "habit_tombstones" in statement for statement in statements)
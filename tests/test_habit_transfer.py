@@ -0,0 +1,114 @@
+import asyncio
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from app.core import habit_transfer
+
+def log_in(client: TestClient, email: str) -> dict:
+    client.post("/v1/users/", json={"email": email, "password": "testpassword"})
+    token = client.post("/v1/users/token", data={"username": email, "password": "testpassword"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def without_identity(habits: list) -> list:
+    return [{key: value for key, value in habit.items() if key not in ("id", "user_id", "version")} for habit in habits]
+
+def test_csv_export_can_be_imported_again(authenticated_client: TestClient):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": 'Stretch, then "relax"', "category": "health"}).json()["id"]
+    authenticated_client.post(f"/v1/habits/{habit_id}/log")
+    authenticated_client.post("/v1/habits/", json={"name": "Read\nslowly", "frequency": "weekly"})
+
+    export = authenticated_client.get("/v1/habits/export")
+    assert export.status_code == 200
+    assert export.headers["content-type"].startswith("text/csv")
+    assert 'filename="habits.csv"' in export.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(export.text)))
+    assert [row["name"] for row in rows] == ['Stretch, then "relax"', "Read\nslowly"]
+
+    other = log_in(authenticated_client, "restore@example.com")
+    response = authenticated_client.post(
+        "/v1/habits/import", content=export.content, headers={**other, "Content-Type": "text/csv"}
+    )
+    assert response.status_code == 201
+    assert response.json() == {"imported": 2}
+
+    original = authenticated_client.get("/v1/habits/").json()
+    restored = authenticated_client.get("/v1/habits/", headers=other).json()
+    assert without_identity(restored) == without_identity(original)
+    assert {habit["user_id"] for habit in restored} != {habit["user_id"] for habit in original}
+
+def test_ndjson_export_can_be_imported_again(authenticated_client: TestClient):
+    for i in range(3):
+        authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}", "category": "mind" if i % 2 else None})
+
+    export = authenticated_client.get("/v1/habits/export", params={"format": "ndjson", "category": "mind"})
+    assert export.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["name"] for line in export.text.splitlines()] == ["Habit 1"]
+
+    response = authenticated_client.post(
+        "/v1/habits/import", content=export.content, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.json() == {"imported": 1}
+    assert [habit["name"] for habit in authenticated_client.get("/v1/habits/").json()] == ["Habit 0", "Habit 1", "Habit 2", "Habit 1"]
+    # The stats count the imported habits too.
+    assert authenticated_client.get("/v1/habits/stats").json()["habit_count"] == 4
+
+def test_import_is_all_or_nothing(authenticated_client: TestClient, monkeypatch):
+    monkeypatch.setattr(habit_transfer, "IMPORT_CHUNK_SIZE", 2)
+    body = "name,category,streak\nWalk,health,\nRun,health,3\nSwim,health,lots\n"
+
+    response = authenticated_client.post("/v1/habits/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 422
+    (error,) = response.json()["detail"]
+    assert error["loc"] == ["body", 3, "streak"]
+    # The first chunk was valid, but nothing is inserted until the whole file is.
+    assert authenticated_client.get("/v1/habits/").json() == []
+
+def test_import_rejects_other_content_types(authenticated_client: TestClient):
+    response = authenticated_client.post("/v1/habits/import", json=[{"name": "Walk"}])
+    assert response.status_code == 415
+
+def test_import_reads_the_body_in_chunks(authenticated_client: TestClient):
+    rows = 2500
+    lines = (f'{{"name": "Habit {i}", "streak": {i % 7}}}\n'.encode() for i in range(rows))
+
+    response = authenticated_client.post(
+        "/v1/habits/import", content=lines, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.json() == {"imported": rows}
+    export = authenticated_client.get("/v1/habits/export").text
+    assert len(export.splitlines()) == rows + 1
+
+def test_upload_holds_no_connection(authenticated_client: TestClient, test_engine):
+    checked_out = []
+
+    def slow_upload():
+        for i in range(3):
+            checked_out.append(test_engine.pool.checkedout())
+            yield f'{{"name": "Habit {i}"}}\n'.encode()
+
+    response = authenticated_client.post("/v1/habits/import", content=slow_upload(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.json() == {"imported": 3}
+    assert checked_out == [0, 0, 0]
+
+def test_import_is_limited_in_rows(authenticated_client: TestClient, monkeypatch):
+    monkeypatch.setattr(habit_transfer, "MAX_IMPORT_ROWS", 2)
+    monkeypatch.setattr(habit_transfer, "IMPORT_CHUNK_SIZE", 1)
+    body = "name\nWalk\nRun\nSwim\n"
+    response = authenticated_client.post("/v1/habits/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 413
+    assert authenticated_client.get("/v1/habits/").json() == []
+
+def test_text_lines_handle_any_chunk_boundaries():
+    data = "name\r\nCafé ☕\n\"two\nlines\"\nlast".encode()
+
+    async def one_byte_at_a_time():
+        for i in range(len(data)):
+            yield data[i:i + 1]
+
+    async def collect():
+        return [record async for records in habit_transfer.csv_records(one_byte_at_a_time()) for record in records]
+
+    assert asyncio.run(collect()) == [{"name": "Café ☕"}, {"name": "two\nlines"}, {"name": "last"}]
@@ -1,4 +1,13 @@
+import base64
+import json
+import re
+from datetime import timedelta
+
 from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.core.streaks import utcnow
+from app.schemas.habit import MAX_BATCH_SIZE, HabitRow, Habit as HabitSchema
 
 def test_create_habit(authenticated_client: TestClient):
     response = authenticated_client.post(
@@ -67,4 +76,327 @@ def test_delete_habit(authenticated_client: TestClient):
     
     # Try to retrieve it to confirm deletion
     check_response = authenticated_client.get(f"/v1/habits/{habit_id}")
-    assert check_response.status_code == 404
\ No newline at end of file
+    assert check_response.status_code == 404
+
+
+def test_read_habits_pagination(authenticated_client: TestClient):
+    for i in range(5):
+        authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"})
+
+    first_page = authenticated_client.get("/v1/habits/", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert [h["name"] for h in first_page.json()] == ["Habit 0", "Habit 1"]
+    assert 'rel="next"' in first_page.headers["link"]
+
+    # Follow the cursor until there are no pages left.
+    names = [h["name"] for h in first_page.json()]
+    cursor = first_page.headers["x-next-cursor"]
+    while cursor:
+        page = authenticated_client.get("/v1/habits/", params={"limit": 2, "after": cursor})
+        names += [h["name"] for h in page.json()]
+        cursor = page.headers.get("x-next-cursor")
+    assert names == [f"Habit {i}" for i in range(5)]
+
+def test_read_habits_invalid_cursor(authenticated_client: TestClient):
+    response = authenticated_client.get("/v1/habits/", params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_read_habits_ndjson_stream(authenticated_client: TestClient):
+    for i in range(3):
+        authenticated_client.post("/v1/habits/", json={"name": f"Habit {i}"})
+
+    response = authenticated_client.get("/v1/habits/", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.strip().split("\n")
+    assert len(lines) == 3
+    assert json.loads(lines[2])["name"] == "Habit 2"
+
+def test_batch_habits(authenticated_client: TestClient):
+    keep_id = authenticated_client.post("/v1/habits/", json={"name": "Keep"}).json()["id"]
+    drop_id = authenticated_client.post("/v1/habits/", json={"name": "Drop"}).json()["id"]
+
+    response = authenticated_client.post("/v1/habits/batch", json={
+        "create": [{"name": "New 1"}, {"name": "New 2", "category": "health"}],
+        "update": [{"id": keep_id, "name": "Kept", "streak": 3}, {"id": 999, "name": "Missing"}],
+        "delete": [drop_id, 999],
+    })
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(r["op"], r["status"]) for r in results] == [
+        ("create", 201), ("create", 201), ("update", 200), ("update", 404), ("delete", 204), ("delete", 404),
+    ]
+    assert results[1]["habit"]["category"] == "health"
+    assert results[2]["habit"]["streak"] == 3
+
+    names = sorted(h["name"] for h in authenticated_client.get("/v1/habits/").json())
+    assert names == ["Kept", "New 1", "New 2"]
+
+def test_batch_cannot_touch_other_users_habits(client: TestClient):
+    for email in ["owner@example.com", "other@example.com"]:
+        client.post("/v1/users/", json={"email": email, "password": "testpassword"})
+
+    def login(email):
+        token = client.post("/v1/users/token", data={"username": email, "password": "testpassword"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    habit_id = client.post("/v1/habits/", json={"name": "Mine"}, headers=login("owner@example.com")).json()["id"]
+
+    response = client.post(
+        "/v1/habits/batch",
+        json={"update": [{"id": habit_id, "name": "Hijacked"}], "delete": [habit_id]},
+        headers=login("other@example.com"),
+    )
+    assert [r["status"] for r in response.json()["results"]] == [404, 404]
+    owner_view = client.get(f"/v1/habits/{habit_id}", headers=login("owner@example.com"))
+    assert owner_view.json()["name"] == "Mine"
+
+def test_batch_size_counts_every_operation(authenticated_client: TestClient):
+    half = MAX_BATCH_SIZE // 2
+    response = authenticated_client.post("/v1/habits/batch", json={
+        "create": [{"name": f"New {i}"} for i in range(half)],
+        "delete": list(range(1, MAX_BATCH_SIZE - half + 2)),
+    })
+    assert response.status_code == 422
+    assert authenticated_client.get("/v1/habits/").json() == []
+
+    response = authenticated_client.post("/v1/habits/batch", json={
+        "create": [{"name": f"New {i}"} for i in range(half)],
+        "delete": list(range(1, MAX_BATCH_SIZE - half + 1)),
+    })
+    assert response.status_code == 200
+
+def test_habit_name_cannot_be_null(authenticated_client: TestClient):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+
+    assert authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": None}).status_code == 422
+    response = authenticated_client.post("/v1/habits/batch", json={"update": [{"id": habit_id, "name": None}]})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "update", 0, "name"]
+    assert authenticated_client.get(f"/v1/habits/{habit_id}").json()["name"] == "Walk"
+
+def test_log_habit_starts_and_keeps_streak(authenticated_client: TestClient):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk", "frequency": "daily"}).json()["id"]
+
+    first = authenticated_client.post(f"/v1/habits/{habit_id}/log")
+    assert first.status_code == 201
+    assert first.json()["streak"] == 1
+    assert first.json()["last_logged"] is not None
+
+    # A second check-in in the same day doesn't extend the streak.
+    second = authenticated_client.post(f"/v1/habits/{habit_id}/log")
+    assert second.json()["streak"] == 1
+
+def test_log_habit_extends_or_resets_streak(authenticated_client: TestClient):
+    now = utcnow()
+    yesterday = (now - timedelta(days=1)).isoformat()
+    last_week = (now - timedelta(days=8)).isoformat()
+    on_track = authenticated_client.post("/v1/habits/", json={"name": "Read", "frequency": "daily"}).json()["id"]
+    missed = authenticated_client.post("/v1/habits/", json={"name": "Run", "frequency": "daily"}).json()["id"]
+    authenticated_client.put(f"/v1/habits/{on_track}", json={"name": "Read", "streak": 4, "last_logged": yesterday})
+    authenticated_client.put(f"/v1/habits/{missed}", json={"name": "Run", "streak": 4, "last_logged": last_week})
+
+    assert authenticated_client.post(f"/v1/habits/{on_track}/log").json()["streak"] == 5
+    assert authenticated_client.post(f"/v1/habits/{missed}/log").json()["streak"] == 1
+
+def test_log_nonexistent_habit(authenticated_client: TestClient):
+    response = authenticated_client.post("/v1/habits/999/log")
+    assert response.status_code == 404
+
+def habit_statements(test_engine, send_request):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if re.search(r"\bhabits\b", statement):
+            statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = send_request()
+    finally:
+        event.remove(test_engine, "before_cursor_execute", before_cursor_execute)
+    return response, statements
+
+def test_conditional_get_returns_not_modified(authenticated_client: TestClient, test_engine):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+
+    for url in ("/v1/habits/", f"/v1/habits/{habit_id}"):
+        response = authenticated_client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        # A 304 is answered from the habit version alone, without reading the habits table.
+        response, statements = habit_statements(
+            test_engine, lambda: authenticated_client.get(url, headers={"If-None-Match": etag})
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert statements == []
+
+def test_etag_changes_after_every_write(authenticated_client: TestClient):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+    etags = [authenticated_client.get("/v1/habits/").headers["ETag"]]
+
+    authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Run"})
+    etags.append(authenticated_client.get("/v1/habits/").headers["ETag"])
+    authenticated_client.post(f"/v1/habits/{habit_id}/log")
+    etags.append(authenticated_client.get("/v1/habits/").headers["ETag"])
+    authenticated_client.post("/v1/habits/batch", json={"create": [{"name": "Swim"}]})
+    etags.append(authenticated_client.get("/v1/habits/").headers["ETag"])
+    authenticated_client.delete(f"/v1/habits/{habit_id}")
+    etags.append(authenticated_client.get("/v1/habits/").headers["ETag"])
+    assert len(set(etags)) == len(etags)
+
+    # The old ETag no longer matches, so the client gets the new data.
+    response = authenticated_client.get("/v1/habits/", headers={"If-None-Match": etags[0]})
+    assert response.status_code == 200
+    assert [habit["name"] for habit in response.json()] == ["Swim"]
+
+def test_unchanged_habits_are_served_from_response_cache(authenticated_client: TestClient, test_engine):
+    authenticated_client.post("/v1/habits/", json={"name": "Walk"})
+    first = authenticated_client.get("/v1/habits/?limit=1")
+
+    second, statements = habit_statements(test_engine, lambda: authenticated_client.get("/v1/habits/?limit=1"))
+    assert statements == []
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+def test_update_and_delete_are_single_statements(authenticated_client: TestClient, test_engine):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+
+    response, statements = habit_statements(
+        test_engine, lambda: authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Run"})
+    )
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert [statement.split()[0] for statement in statements] == ["UPDATE"]
+
+    response, statements = habit_statements(test_engine, lambda: authenticated_client.delete(f"/v1/habits/{habit_id}"))
+    assert response.status_code == 204
+    assert statements[0].startswith("DELETE")
+
+def test_if_match_prevents_lost_updates(authenticated_client: TestClient):
+    created = authenticated_client.post("/v1/habits/", json={"name": "Walk"})
+    habit_id = created.json()["id"]
+    etag = authenticated_client.get(f"/v1/habits/{habit_id}").headers["ETag"]
+    assert etag == created.headers["ETag"]
+
+    response = authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Run"}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+
+    # A second client still holding the old ETag can neither overwrite nor delete the newer version.
+    response = authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Swim"}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    response = authenticated_client.delete(f"/v1/habits/{habit_id}", headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert authenticated_client.get(f"/v1/habits/{habit_id}").json()["name"] == "Run"
+
+    response = authenticated_client.delete(f"/v1/habits/{habit_id}", headers={"If-Match": new_etag})
+    assert response.status_code == 204
+    response = authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Swim"}, headers={"If-Match": new_etag})
+    assert response.status_code == 404
+
+def test_if_match_for_another_habit_fails(authenticated_client: TestClient):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+    response = authenticated_client.put(f"/v1/habits/{habit_id}", json={"name": "Run"}, headers={"If-Match": '"999.1"'})
+    assert response.status_code == 412
+
+def test_habit_rows_serialize_like_habit_schema(authenticated_client: TestClient):
+    # The read endpoints serialize plain rows through HabitRow, so it has to stay in step with the Habit schema.
+    assert list(HabitRow.__annotations__) == list(HabitSchema.model_fields)
+
+    habit = authenticated_client.post("/v1/habits/", json={"name": "Walk", "category": "health"}).json()
+    authenticated_client.post(f"/v1/habits/{habit['id']}/log")
+    logged = authenticated_client.get(f"/v1/habits/{habit['id']}").json()
+
+    assert list(logged) == list(HabitSchema.model_fields)
+    assert HabitSchema.model_validate(logged).model_dump(mode="json") == logged
+    assert authenticated_client.get("/v1/habits/").json() == [logged]
+    ndjson = authenticated_client.get("/v1/habits/?format=ndjson").text
+    assert [json.loads(line) for line in ndjson.splitlines()] == [logged]
+
+def create_habits_to_filter(client: TestClient):
+    now = utcnow()
+    habits = [
+        ("Morning run", "fitness", "daily", 5, now - timedelta(days=1)),
+        ("meditate", "mind", "daily", 12, now - timedelta(days=10)),
+        ("Read 50% more", "mind", "weekly", 2, now - timedelta(days=3)),
+        ("Mobility", "fitness", "weekly", None, None),
+        ("Journal", "mind", "monthly", 0, now - timedelta(days=40)),
+    ]
+    ids = {}
+    for name, category, frequency, streak, last_logged in habits:
+        habit_id = client.post("/v1/habits/", json={"name": name, "category": category, "frequency": frequency}).json()["id"]
+        client.put(f"/v1/habits/{habit_id}", json={
+            "name": name, "streak": streak, "last_logged": last_logged.isoformat() if last_logged else None,
+        })
+        ids[name] = habit_id
+    return now, ids
+
+def list_names(client: TestClient, **params):
+    response = client.get("/v1/habits/", params=params)
+    assert response.status_code == 200, response.text
+    return [habit["name"] for habit in response.json()]
+
+def test_read_habits_filters_and_search(authenticated_client: TestClient):
+    now, _ = create_habits_to_filter(authenticated_client)
+
+    assert list_names(authenticated_client, category="fitness") == ["Morning run", "Mobility"]
+    assert list_names(authenticated_client, category="mind", frequency="daily") == ["meditate"]
+    assert list_names(authenticated_client, streak_gte=5) == ["Morning run", "meditate"]
+    since = (now - timedelta(days=5)).isoformat()
+    assert list_names(authenticated_client, logged_after=since) == ["Morning run", "Read 50% more"]
+    assert list_names(authenticated_client, logged_before=since) == ["meditate", "Journal"]
+    # Search matches the start of the name, ignoring case, and "%" is not a wildcard.
+    assert list_names(authenticated_client, q="MO") == ["Morning run", "Mobility"]
+    assert list_names(authenticated_client, q="read 50%") == ["Read 50% more"]
+    assert list_names(authenticated_client, q="r%") == []
+
+def test_read_habits_sorting_pages_through_every_habit(authenticated_client: TestClient):
+    create_habits_to_filter(authenticated_client)
+    expected = {
+        "name": ["Journal", "meditate", "Mobility", "Morning run", "Read 50% more"],
+        "-name": ["Read 50% more", "Morning run", "Mobility", "meditate", "Journal"],
+        # Habits without a streak or check-in come last in ascending order and first in descending order.
+        "streak": ["Journal", "Read 50% more", "Morning run", "meditate", "Mobility"],
+        "-streak": ["Mobility", "meditate", "Morning run", "Read 50% more", "Journal"],
+        "last_logged": ["Journal", "meditate", "Read 50% more", "Morning run", "Mobility"],
+        "-last_logged": ["Mobility", "Morning run", "Read 50% more", "meditate", "Journal"],
+        "-id": ["Journal", "Mobility", "Read 50% more", "meditate", "Morning run"],
+    }
+    for sort, names in expected.items():
+        assert list_names(authenticated_client, sort=sort) == names
+
+        # Paging one habit at a time walks the same order, whatever the sort value of the last row was.
+        paged = []
+        params = {"sort": sort, "limit": 1}
+        while True:
+            page = authenticated_client.get("/v1/habits/", params=params)
+            paged += [habit["name"] for habit in page.json()]
+            cursor = page.headers.get("x-next-cursor")
+            if cursor is None:
+                break
+            params["after"] = cursor
+        assert paged == names, sort
+
+def test_read_habits_cursor_belongs_to_its_sort(authenticated_client: TestClient):
+    create_habits_to_filter(authenticated_client)
+    cursor = authenticated_client.get("/v1/habits/", params={"sort": "streak", "limit": 1}).headers["x-next-cursor"]
+    response = authenticated_client.get("/v1/habits/", params={"sort": "name", "after": cursor})
+    assert response.status_code == 400
+
+def test_read_habits_rejects_cursors_with_the_wrong_sort_value(authenticated_client: TestClient):
+    def crafted(sort, sort_value, last_id=1):
+        return base64.urlsafe_b64encode(json.dumps([sort, sort_value, last_id]).encode()).decode().rstrip("=")
+
+    for sort, sort_value in [("name", ["a"]), ("name", None), ("-name", {"t": "x"}), ("streak", {"a": 1}), ("streak", "1"),
+                             ("streak", True), ("last_logged", {}), ("last_logged", {"t": 5}), ("last_logged", 3)]:
+        response = authenticated_client.get("/v1/habits/", params={"sort": sort, "after": crafted(sort, sort_value)})
+        assert response.status_code == 400, (sort, sort_value)
+    assert authenticated_client.get("/v1/habits/", params={"sort": "streak", "after": crafted("streak", None)}).status_code == 200
+    assert authenticated_client.get("/v1/habits/", params={"sort": "name", "after": crafted("name", "b", "2")}).status_code == 400
+
+def test_read_habits_rejects_unknown_sort(authenticated_client: TestClient):
+    assert authenticated_client.get("/v1/habits/", params={"sort": "user_id"}).status_code == 422
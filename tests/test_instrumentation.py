@@ -0,0 +1,69 @@
+import logging
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import settings
+from app.core.instrumentation import RequestMetrics, find_repeated_statements
+
+def parse_server_timing(header: str) -> dict:
+    metrics = {}
+    for part in header.split(","):
+        name, *params = [item.strip() for item in part.split(";")]
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+def test_server_timing_breaks_down_request(authenticated_client: TestClient):
+    authenticated_client.post("/v1/habits/", json={"name": "Walk"})
+
+    response = authenticated_client.get("/v1/habits/")
+    assert response.status_code == 200
+    timing = parse_server_timing(response.headers["Server-Timing"])
+    assert {"auth", "db", "serialize", "total"} <= timing.keys()
+    # The habit version lookup and the page itself.
+    assert timing["db"]["desc"] == '"2 queries"'
+    assert float(timing["total"]["dur"]) >= float(timing["db"]["dur"])
+
+def test_server_timing_includes_hashing_on_login(client: TestClient):
+    client.post("/v1/users/", json={"email": "timing@example.com", "password": "password"})
+    response = client.post("/v1/users/token", data={"username": "timing@example.com", "password": "password"})
+    assert "hash" in parse_server_timing(response.headers["Server-Timing"])
+
+def test_slow_requests_are_logged(authenticated_client: TestClient, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "SLOW_REQUEST_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+        authenticated_client.get("/v1/habits/")
+    assert any("Slow request: GET /v1/habits/ -> 200" in record.getMessage() for record in caplog.records)
+
+def test_repeated_statements_are_reported(monkeypatch):
+    monkeypatch.setattr(settings, "N_PLUS_ONE_THRESHOLD", 3)
+    metrics = RequestMetrics()
+    for _ in range(3):
+        metrics.add_query("SELECT * FROM habit_logs WHERE habit_id = ?", 0.001)
+    metrics.add_query("SELECT * FROM habits WHERE user_id = ?", 0.001)
+
+    assert find_repeated_statements(metrics) == [("SELECT * FROM habit_logs WHERE habit_id = ?", 3)]
+    assert metrics.db_count == 4
+
+def test_failed_statements_leave_nothing_on_the_connection(test_engine):
+    with test_engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("SELECT * FROM no_such_table")
+            connection.rollback()
+        assert connection.exec_driver_sql("SELECT 1").scalar() == 1
+        assert not any(isinstance(value, list) for value in connection.info.values())
+
+def test_debug_header_profiles_request(authenticated_client: TestClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "PROFILE_HEADER_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+
+    response = authenticated_client.get("/v1/habits/", headers={settings.PROFILE_HEADER: "1"})
+    assert response.status_code == 200
+    assert os.path.exists(tmp_path / response.headers["X-Profile-File"])
+
+    # Without the header (and with sampling off) nothing is profiled.
+    response = authenticated_client.get("/v1/habits/")
+    assert "X-Profile-File" not in response.headers
@@ -0,0 +1,50 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.core.config import settings
+from app.database.database import get_engine_options
+from app.database.pool_metrics import TimedQueuePool, instrument_engine, pool_metrics
+
+def test_metrics_endpoint_reports_pools(client: TestClient):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "primary" in response.json()["database_pools"]
+
+def test_pool_metrics_track_checkouts_and_wait_time():
+    engine = create_engine("sqlite:///./test.db", poolclass=TimedQueuePool, pool_size=2, max_overflow=1)
+    metrics = instrument_engine("test_pool", engine)
+    try:
+        with engine.connect() as first:
+            first.execute(text("SELECT 1"))
+            assert metrics.snapshot()["connections_in_use"] == 1
+            with engine.connect() as second:
+                second.execute(text("SELECT 1"))
+                assert metrics.snapshot()["connections_in_use"] == 2
+
+        snapshot = metrics.snapshot()
+        assert snapshot["connections_in_use"] == 0
+        assert snapshot["checkouts"] == 2
+        assert snapshot["pool_size"] == 2
+        assert snapshot["checkout_wait_max_ms"] > 0
+    finally:
+        pool_metrics.pop("test_pool")
+        engine.dispose()
+
+def test_engine_options_for_pgbouncer(monkeypatch):
+    monkeypatch.setattr(settings, "DB_PGBOUNCER_MODE", True)
+    monkeypatch.setattr(settings, "DB_STATEMENT_TIMEOUT_MS", 5000)
+
+    options = get_engine_options("postgresql+psycopg://user:pw@localhost/db")
+    assert options["poolclass"] is NullPool
+    assert options["connect_args"]["prepare_threshold"] is None
+    assert options["connect_args"]["options"] == "-c statement_timeout=5000"
+
+def test_engine_options_for_postgres_pool(monkeypatch):
+    monkeypatch.setattr(settings, "DB_PGBOUNCER_MODE", False)
+    monkeypatch.setattr(settings, "DB_POOL_SIZE", 20)
+
+    options = get_engine_options("postgresql+psycopg://user:pw@localhost/db")
+    assert options["poolclass"] is TimedQueuePool
+    assert options["pool_size"] == 20
+    assert options["pool_pre_ping"] is True
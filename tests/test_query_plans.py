@@ -0,0 +1,137 @@
+"""
+Runs every habit endpoint, captures the SQL it sends, and checks with EXPLAIN that none of those
+statements reads the whole `habits` table. Runs on SQLite, and also on Postgres when TEST_POSTGRES_URL is set.
+"""
+import os
+import re
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base, get_db
+from app.main import app
+
+# Filters and sort orders of GET /v1/habits/, with the index each one should use.
+LIST_FILTER_INDEXES = {
+    "category=health": "ix_habits_user_id_category_id",
+    "streak_gte=1": "ix_habits_user_id_streak_id",
+    "logged_after=2026-01-01T00:00:00": "ix_habits_user_id_last_logged_id",
+    "sort=name&q=hab": "ix_habits_user_id_lower_name_id",
+    "sort=-name": "ix_habits_user_id_lower_name_id",
+    "sort=streak": "ix_habits_user_id_streak_id",
+    "sort=-last_logged": "ix_habits_user_id_last_logged_id",
+}
+LIST_FILTERS = [dict(param.split("=") for param in query.split("&")) for query in LIST_FILTER_INDEXES] + [{"frequency": "daily"}, {"q": "hab"}]
+
+def exercise_habit_endpoints(client: TestClient):
+    client.post("/v1/users/", json={"email": "plans@example.com", "password": "testpassword"})
+    token = client.post(
+        "/v1/users/token", data={"username": "plans@example.com", "password": "testpassword"}
+    ).json()["access_token"]
+    client.headers = {"Authorization": f"Bearer {token}"}
+
+    ids = [client.post("/v1/habits/", json={"name": f"Habit {i}", "category": "health"}).json()["id"] for i in range(5)]
+    cursor = client.get("/v1/habits/", params={"limit": 2}).headers["x-next-cursor"]
+    client.get("/v1/habits/", params={"limit": 2, "after": cursor})
+    client.get("/v1/habits/", params={"format": "ndjson"})
+    for params in LIST_FILTERS:
+        client.get("/v1/habits/", params=params)
+    cursor = client.get("/v1/habits/", params={"sort": "-streak", "limit": 2}).headers["x-next-cursor"]
+    client.get("/v1/habits/", params={"sort": "-streak", "limit": 2, "after": cursor})
+    client.get(f"/v1/habits/{ids[0]}")
+    client.put(f"/v1/habits/{ids[0]}", json={"name": "Renamed"})
+    client.post(f"/v1/habits/{ids[1]}/log")
+    client.get("/v1/habits/stats")
+    client.post("/v1/habits/batch", json={"create": [{"name": "New"}], "update": [{"id": ids[2], "name": "Batch"}], "delete": [ids[3]]})
+    client.delete(f"/v1/habits/{ids[4]}")
+    client.get("/v1/habits/changes", params={"since": 3})
+
+def capture_statements(engine, client: TestClient):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        exercise_habit_endpoints(client)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # Only statements that read habits can scan them; plain INSERTs never do.
+    return [
+        (statement, parameters) for statement, parameters in statements
+        if re.search(r"\bhabits\b", statement) and not statement.lstrip().upper().startswith("INSERT")
+    ]
+
+def test_habit_queries_use_indexes_on_sqlite(client: TestClient, test_engine):
+    statements = capture_statements(test_engine, client)
+    assert statements
+
+    with test_engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            details = [row[-1] for row in plan]
+            # "SCAN habits" is a full table scan; index lookups show up as "SEARCH habits USING ...".
+            assert not any(re.match(r"SCAN habits\b", detail) for detail in details), (statement, details)
+
+def test_habit_filters_use_their_indexes_on_sqlite(client: TestClient, test_engine):
+    exercise_habit_endpoints(client)
+    with test_engine.connect() as connection:
+        for query, index in LIST_FILTER_INDEXES.items():
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+                if re.search(r"FROM habits\b", statement):
+                    statements.append((statement, parameters))
+
+            event.listen(test_engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                client.get(f"/v1/habits/?{query}")
+            finally:
+                event.remove(test_engine, "before_cursor_execute", before_cursor_execute)
+
+            (statement, parameters), = statements
+            plan = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()]
+            assert any(detail.startswith(f"SEARCH habits USING INDEX {index} ") for detail in plan), (query, plan)
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL is not set")
+def test_habit_queries_use_indexes_on_postgres():
+    # TEST_POSTGRES_URL may be a database that is migrated and used by other tests, so the tables of this test
+    # go into a schema of their own, which is dropped afterwards. Everything else in the database is left alone.
+    schema = f"query_plans_{uuid.uuid4().hex[:12]}"
+    admin_engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    with admin_engine.begin() as connection:
+        connection.exec_driver_sql(f"CREATE SCHEMA {schema}")
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"], connect_args={"options": f"-csearch_path={schema}"})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with TestClient(app) as client:
+            statements = capture_statements(engine, client)
+        with engine.connect() as connection:
+            # The test tables are tiny, so Postgres would happily scan them. Disabling sequential scans
+            # makes it use an index whenever one can serve the query, so a remaining Seq Scan means no index fits.
+            connection.exec_driver_sql("SET enable_seqscan = off")
+            for statement, parameters in statements:
+                plan = "\n".join(row[0] for row in connection.exec_driver_sql("EXPLAIN " + statement, parameters))
+                assert "Seq Scan on habits" not in plan, (statement, plan)
+            connection.rollback()
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+        with admin_engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP SCHEMA {schema} CASCADE")
+        admin_engine.dispose()
@@ -0,0 +1,115 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.rate_limit import MAX_LOGIN_BODY_BYTES, Limit, MemoryTokenBuckets, RateLimitMiddleware, _peek_login_email
+
+def login(client: TestClient, email: str):
+    return client.post("/v1/users/token", data={"username": email, "password": "wrong-password"})
+
+def test_logins_are_limited_per_email(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN_BURST", 2)
+
+    assert login(client, "victim@example.com").status_code == 401
+    assert login(client, "Victim@example.com").status_code == 401
+    response = login(client, "victim@example.com")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # Other accounts can still be logged into from the same address.
+    assert login(client, "someone-else@example.com").status_code == 401
+
+def test_auth_endpoints_are_limited_per_ip(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_AUTH_IP_BURST", 2)
+
+    assert login(client, "first@example.com").status_code == 401
+    assert client.post("/v1/users/", json={"email": "second@example.com", "password": "password"}).status_code == 201
+    assert login(client, "third@example.com").status_code == 429
+
+def test_authenticated_requests_are_limited_per_user(authenticated_client: TestClient, monkeypatch):
+    other_client = TestClient(authenticated_client.app)
+    other_client.post("/v1/users/", json={"email": "other@example.com", "password": "password"})
+    token = other_client.post("/v1/users/token", data={"username": "other@example.com", "password": "password"}).json()["access_token"]
+    other_client.headers = {"Authorization": f"Bearer {token}"}
+
+    monkeypatch.setattr(settings, "RATE_LIMIT_BURST", 3)
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_SECOND", 0.01)
+    for _ in range(3):
+        assert authenticated_client.get("/v1/habits/").status_code == 200
+    assert authenticated_client.get("/v1/habits/").status_code == 429
+
+    # Same address, different user: a separate bucket.
+    assert other_client.get("/v1/habits/").status_code == 200
+
+def test_anonymous_requests_are_limited_per_ip(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_BURST", 1)
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_SECOND", 0.01)
+    assert client.get("/").status_code == 200
+    assert client.get("/").status_code == 429
+    # A forged token doesn't get a fresh bucket.
+    assert client.get("/", headers={"Authorization": "Bearer not-a-token"}).status_code == 429
+
+def test_memory_buckets_refill_and_stay_bounded():
+    buckets = MemoryTokenBuckets(maxsize=2)
+    limit = Limit(rate=1000, burst=1)
+    assert asyncio.run(buckets.take("a", limit)) == 0
+    assert 0 < asyncio.run(buckets.take("a", Limit(rate=1, burst=1))) <= 1
+    for key in ("b", "c", "d"):
+        asyncio.run(buckets.take(key, limit))
+    assert len(buckets) == 2
+
+def test_requests_beyond_the_concurrency_limit_are_shed(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_REQUESTS", 1)
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = RateLimitMiddleware(slow_app)
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [], "client": ("127.0.0.1", 1)}
+
+        async def request():
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await middleware(scope, None, send)
+            return messages[0]
+
+        first = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        shed = await request()
+        release.set()
+        return (await first), shed
+
+    first, shed = asyncio.run(scenario())
+    assert first["status"] == 200
+    assert shed["status"] == 503
+    assert (b"retry-after", b"1") in shed["headers"]
+
+def test_oversized_login_bodies_are_not_buffered():
+    chunk = b"x" * 4096
+    received = []
+
+    async def receive():
+        received.append(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def scenario():
+        scope = {"headers": [(b"content-type", b"application/x-www-form-urlencoded")]}
+        email, replay = await _peek_login_email(scope, receive)
+        return email, await replay(), await replay()
+
+    email, replayed, rest = asyncio.run(scenario())
+    assert email is None
+    # Reading stopped just past the limit; the endpoint gets what was read, then the rest as it arrives.
+    assert len(received) == MAX_LOGIN_BODY_BYTES // len(chunk) + 2
+    assert replayed["more_body"] is True and len(replayed["body"]) > MAX_LOGIN_BODY_BYTES
+    assert rest["body"] == chunk
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.core import security
+from app.core.config import settings
+from app.models import RefreshToken
+
+def log_in(client: TestClient, email: str = "refresh@example.com") -> dict:
+    client.post("/v1/users/", json={"email": email, "password": "testpassword"})
+    return client.post("/v1/users/token", data={"username": email, "password": "testpassword"}).json()
+
+def refresh(client: TestClient, refresh_token: str):
+    return client.post("/v1/users/token/refresh", json={"refresh_token": refresh_token})
+
+def test_login_uses_the_configured_access_token_lifetime(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "ACCESS_TOKEN_EXPIRE_MINUTES", 5)
+    tokens = log_in(client)
+    expires = datetime.fromtimestamp(jwt.get_unverified_claims(tokens["access_token"])["exp"], timezone.utc)
+    assert timedelta(minutes=4) < expires - datetime.now(timezone.utc) <= timedelta(minutes=5)
+    assert tokens["expires_in"] == 300
+    assert tokens["refresh_token"]
+
+def test_refresh_rotates_tokens_without_hashing_a_password(client: TestClient, monkeypatch):
+    tokens = log_in(client)
+
+    def no_bcrypt(*args):
+        raise AssertionError("refreshing must not run bcrypt")
+
+    monkeypatch.setattr(security, "_run_in_hashing_pool", no_bcrypt)
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    assert jwt.get_unverified_claims(refreshed["access_token"])["sid"] == jwt.get_unverified_claims(tokens["access_token"])["sid"]
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {refreshed['access_token']}"}).status_code == 200
+
+    # The new refresh token works in turn.
+    assert refresh(client, refreshed["refresh_token"]).status_code == 200
+
+def test_only_hashes_of_refresh_tokens_are_stored(client: TestClient, db):
+    tokens = log_in(client)
+    stored = db.query(RefreshToken.token_hash).all()
+    assert [row.token_hash for row in stored] == [security.hash_refresh_token(tokens["refresh_token"])]
+
+def test_reusing_a_refresh_token_revokes_its_whole_family(client: TestClient):
+    tokens = log_in(client)
+    other_session = log_in(client)
+    stolen = tokens["refresh_token"]
+    legitimate = refresh(client, stolen).json()
+
+    # The copy is presented again: both it and the token it was exchanged for stop working.
+    assert refresh(client, stolen).status_code == 401
+    assert refresh(client, legitimate["refresh_token"]).status_code == 401
+    # Other logins of the same user are not affected.
+    assert refresh(client, other_session["refresh_token"]).status_code == 200
+
+def test_expired_and_unknown_refresh_tokens_are_rejected(client: TestClient, monkeypatch):
+    assert refresh(client, "not-a-token").status_code == 401
+    monkeypatch.setattr(settings, "REFRESH_TOKEN_EXPIRE_DAYS", -1)
+    tokens = log_in(client)
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+
+def test_logout_ends_the_refresh_token_family(client: TestClient):
+    tokens = log_in(client)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.post("/v1/users/logout", headers=headers).status_code == 204
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
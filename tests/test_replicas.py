@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.database import replicas
+
+@pytest.fixture
+def replica_urls():
+    """
+    Configures read replicas for one test. The "replica" is the test database itself, opened through its own engine,
+    so it has the same data and the statements it runs can be told apart from the primary's.
+    """
+    def configure(*urls):
+        replicas.configure_replicas(list(urls))
+        return replicas.replica_router.replicas
+
+    yield configure
+    replicas.configure_replicas([])
+    replicas.recent_writers.clear()
+
+@pytest.fixture
+def count_habit_reads():
+    """
+    Starts counting the statements that read habits on an engine, and returns a function that gives the count so far.
+    """
+    listeners = []
+
+    def count(engine):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        listeners.append((engine, before_cursor_execute))
+        return lambda: len([statement for statement in statements if "FROM habits" in statement])
+
+    yield count
+    for engine, listener in listeners:
+        event.remove(engine, "before_cursor_execute", listener)
+
+def test_reads_go_to_replica(authenticated_client: TestClient, replica_urls, count_habit_reads, monkeypatch, test_engine):
+    monkeypatch.setattr(settings, "REPLICA_STICKY_SECONDS", 0)
+    [replica] = replica_urls("sqlite:///./test.db")
+    replica_reads, primary_reads = count_habit_reads(replica.engine), count_habit_reads(test_engine)
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+
+    assert authenticated_client.get("/v1/habits/").json()[0]["name"] == "Walk"
+    assert authenticated_client.get(f"/v1/habits/{habit_id}").status_code == 200
+    assert replica_reads() == 2
+    assert primary_reads() == 0
+
+def test_reads_after_a_write_go_to_primary(authenticated_client: TestClient, replica_urls, count_habit_reads, test_engine):
+    [replica] = replica_urls("sqlite:///./test.db")
+    replica_reads, primary_reads = count_habit_reads(replica.engine), count_habit_reads(test_engine)
+
+    authenticated_client.post("/v1/habits/", json={"name": "Walk"})
+    assert authenticated_client.get("/v1/habits/").json()[0]["name"] == "Walk"
+    assert replica_reads() == 0
+    assert primary_reads() == 1
+
+def test_failing_replica_falls_back_to_primary(authenticated_client: TestClient, replica_urls, monkeypatch):
+    monkeypatch.setattr(settings, "REPLICA_STICKY_SECONDS", 0)
+    authenticated_client.post("/v1/habits/", json={"name": "Walk"})
+    [replica] = replica_urls("sqlite:////nonexistent-directory/replica.db")
+
+    response = authenticated_client.get("/v1/habits/")
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Walk"
+    assert not replica.is_available()
+
+def test_replicas_rotate_and_skip_failed_ones(replica_urls):
+    first, second, third = replica_urls("sqlite://", "sqlite://", "sqlite://")
+    assert [replicas.replica_router.choose() for _ in range(3)] == [first, second, third]
+
+    second.mark_down()
+    assert [replicas.replica_router.choose() for _ in range(3)] == [first, third, first]
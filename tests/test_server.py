@@ -0,0 +1,50 @@
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+
+from app.database import database, replicas, sharding
+from app.database.migrate import ALEMBIC_INI, migrate_if_behind
+from app.server import available_cpus, dispose_pools_after_fork, event_loop_settings
+
+def test_migrations_only_run_when_behind(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'migrate.db'}"
+
+    assert migrate_if_behind(database_url) is True
+    engine = create_engine(database_url)
+    assert "habits" in inspect(engine).get_table_names()
+    engine.dispose()
+
+    # Already at head: nothing to do on the next boot.
+    assert migrate_if_behind(database_url) is False
+
+def test_migrations_downgrade_to_base(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'downgrade.db'}"
+    migrate_if_behind(database_url)
+
+    config = Config(ALEMBIC_INI)
+    config.attributes["database_url"] = database_url
+    command.downgrade(config, "base")
+    engine = create_engine(database_url)
+    assert set(inspect(engine).get_table_names()) <= {"alembic_version"}
+    engine.dispose()
+
+    # And back up again, from nothing.
+    assert migrate_if_behind(database_url) is True
+
+def test_worker_settings():
+    assert available_cpus() >= 1
+    settings = event_loop_settings()
+    assert settings["loop"] in ("uvloop", "asyncio")
+    assert settings["http"] in ("httptools", "h11")
+
+def test_forked_workers_get_fresh_pools(tmp_path):
+    replicas.configure_replicas([f"sqlite:///{tmp_path / 'replica.db'}"])
+    sharding.configure_shards({1: f"sqlite:///{tmp_path / 'shard_1.db'}"})
+    try:
+        [replica], shard = replicas.replica_router.replicas, sharding.shard_set.get(1)
+        pools = [database.engine.pool, replica.engine.pool, shard.engine.pool]
+        dispose_pools_after_fork()
+        assert all(pool is not engine.pool for pool, engine in zip(pools, [database.engine, replica.engine, shard.engine]))
+    finally:
+        replicas.configure_replicas([])
+        sharding.configure_shards({})
@@ -0,0 +1,131 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import sessionmaker
+
+from app.database import crud, rebalance, sharding
+from app.database.database import Base
+from app.database.migrate import migrate_shards
+from app.models import Habit, HabitLog, User
+
+@pytest.fixture
+def shard_1(tmp_path, test_engine):
+    """
+    Adds shard 1, an empty database with the whole schema, to the test database as shard 0.
+    Returns a session factory for shard 1, for looking at its rows.
+    """
+    url = f"sqlite:///{tmp_path / 'shard_1.db'}"
+    shard_engine = create_engine(url)
+    Base.metadata.create_all(shard_engine)
+    sharding.configure_shards({1: url}, primary_session_factory=sessionmaker(bind=test_engine, autoflush=False))
+    yield sessionmaker(bind=shard_engine)
+    sharding.configure_shards({})
+    shard_engine.dispose()
+
+def sign_up(client: TestClient, monkeypatch, email: str, shard_id: int) -> dict:
+    monkeypatch.setattr(sharding.shard_set, "place", lambda user_id: shard_id)
+    user_id = client.post("/v1/users/", json={"email": email, "password": "testpassword"}).json()["id"]
+    token = client.post("/v1/users/token", data={"username": email, "password": "testpassword"}).json()["access_token"]
+    client.headers = {"Authorization": f"Bearer {token}"}
+    return {"id": user_id, "headers": {"Authorization": f"Bearer {token}"}}
+
+def test_hash_ring_spreads_users_and_moves_few_when_a_shard_is_added():
+    three = sharding.HashRing([0, 1, 2], virtual_nodes=128)
+    placements = [three.shard_for(user_id) for user_id in range(30_000)]
+    assert all(8_000 < placements.count(shard_id) < 12_000 for shard_id in (0, 1, 2))
+    assert placements == [three.shard_for(user_id) for user_id in range(30_000)]
+
+    four = sharding.HashRing([0, 1, 2, 3], virtual_nodes=128)
+    moved = [user_id for user_id in range(30_000) if four.shard_for(user_id) != placements[user_id]]
+    assert 5_000 < len(moved) < 10_000
+    assert all(four.shard_for(user_id) == 3 for user_id in moved)
+
+def test_shard_urls_are_parsed_and_checked():
+    assert sharding.parse_shard_urls(" 1=sqlite:///a.db, 2=postgresql://h/db?x=1 ") == {1: "sqlite:///a.db", 2: "postgresql://h/db?x=1"}
+    assert sharding.parse_shard_urls("") == {}
+    for value in ("sqlite:///a.db", "0=sqlite:///a.db", "1024=sqlite:///a.db", "one=sqlite:///a.db"):
+        with pytest.raises(ValueError):
+            sharding.parse_shard_urls(value)
+
+@pytest.mark.parametrize("db_mode", ["client", "async_client"])
+def test_habits_live_on_the_users_shard(request, db_mode, shard_1, monkeypatch, db):
+    client = request.getfixturevalue(db_mode)
+    sign_up(client, monkeypatch, "sharded@example.com", shard_id=1)
+    habit = client.post("/v1/habits/", json={"name": "Walk", "category": "Health"}).json()
+    assert client.post(f"/v1/habits/{habit['id']}/log").status_code == 201
+
+    assert [h["name"] for h in client.get("/v1/habits/").json()] == ["Walk"]
+    assert client.get("/v1/habits/stats").json()["total_checkins"] == 1
+    assert client.get("/v1/habits/changes?since=0").json()["habits"][0]["id"] == habit["id"]
+
+    # The primary has the user and the directory; the habits are on shard 1, next to a placeholder user row.
+    assert db.scalar(select(Habit.id)) is None
+    user_id = db.scalar(select(User.id).where(User.email == "sharded@example.com"))
+    assert crud.get_user_shard(db, user_id).shard_id == 1
+    with shard_1() as shard_db:
+        assert shard_db.scalar(select(Habit.name)) == "Walk"
+        assert shard_db.scalar(select(HabitLog.habit_id)) == habit["id"]
+        assert shard_db.scalar(select(User.email)) == f"{user_id}@shard.invalid"
+
+def test_a_move_keeps_the_users_habits_and_sync_state(client: TestClient, shard_1, monkeypatch, db):
+    user = sign_up(client, monkeypatch, "mover@example.com", shard_id=0)
+    habit = client.post("/v1/habits/", json={"name": "Read", "category": "Mind"}).json()
+    client.post(f"/v1/habits/{habit['id']}/log")
+    deleted = client.post("/v1/habits/", json={"name": "Nap"}).json()
+    client.delete(f"/v1/habits/{deleted['id']}")
+    before = client.get("/v1/habits/")
+    watermark = client.get("/v1/habits/changes?since=0").json()["watermark"]
+
+    result = rebalance.move_user(user["id"], 1, grace_seconds=0, batch_size=1)
+    assert result.users == 1 and result.rows > 0
+
+    after = client.get("/v1/habits/")
+    assert after.json() == before.json()
+    assert after.headers["ETag"] == before.headers["ETag"]
+    assert client.get("/v1/habits/stats").json()["total_checkins"] == 1
+    assert client.get(f"/v1/habits/changes?since={watermark}").json() == {"watermark": watermark, "full": False, "habits": [], "deleted": []}
+    assert client.get(f"/v1/habits/changes?since={watermark - 1}").json()["deleted"] == [deleted["id"]]
+
+    # Writes now land on shard 1, and nothing is left on the primary but the user.
+    assert client.post(f"/v1/habits/{habit['id']}/log").status_code == 201
+    assert db.scalar(select(Habit.id)) is None
+    assert db.get(User, user["id"]) is not None
+    with shard_1() as shard_db:
+        assert shard_db.scalar(select(Habit.name)) == "Read"
+
+def test_writes_wait_while_the_user_is_being_moved(client: TestClient, shard_1, monkeypatch, db):
+    user = sign_up(client, monkeypatch, "waiting@example.com", shard_id=1)
+    client.post("/v1/habits/", json={"name": "Stretch"})
+
+    crud.set_user_shard(db, user["id"], 1, moving=True)
+    sharding.shard_directory.clear()
+    assert client.get("/v1/habits/").json()[0]["name"] == "Stretch"
+    response = client.post("/v1/habits/", json={"name": "Run"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+    crud.set_user_shard(db, user["id"], 1)
+    sharding.shard_directory.clear()
+    assert client.post("/v1/habits/", json={"name": "Run"}).status_code == 201
+
+def test_rebalance_moves_users_to_their_ring_shard(client: TestClient, shard_1, monkeypatch):
+    users = [sign_up(client, monkeypatch, f"user{i}@example.com", shard_id=0) for i in range(6)]
+    for user in users:
+        client.post("/v1/habits/", json={"name": f"Habit of {user['id']}"}, headers=user["headers"])
+    monkeypatch.undo()
+
+    moves = rebalance.plan_rebalance()
+    assert moves == [rebalance.Move(user["id"], 0, sharding.shard_set.place(user["id"])) for user in users if sharding.shard_set.place(user["id"]) != 0]
+    assert rebalance.rebalance(group_size=2, grace_seconds=0).users == len(moves)
+    assert rebalance.plan_rebalance() == []
+    for user in users:
+        assert client.get("/v1/habits/", headers=user["headers"]).json()[0]["name"] == f"Habit of {user['id']}"
+
+def test_migrations_run_on_every_shard(tmp_path):
+    primary_url, shard_url = f"sqlite:///{tmp_path / 'primary.db'}", f"sqlite:///{tmp_path / 'shard_1.db'}"
+    assert migrate_shards({1: shard_url}, primary_url=primary_url) == {0: True, 1: True}
+    for url in (primary_url, shard_url):
+        engine = create_engine(url)
+        assert {"habits", "user_shards"} <= set(inspect(engine).get_table_names())
+        engine.dispose()
+    assert migrate_shards({1: shard_url}, primary_url=primary_url) == {0: False, 1: False}
@@ -0,0 +1,70 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from app.database import rollups
+from app.models import HabitStats
+
+def test_stats_for_new_user(authenticated_client: TestClient):
+    response = authenticated_client.get("/v1/habits/stats")
+    assert response.status_code == 200
+    assert response.json()["habit_count"] == 0
+    assert response.json()["daily"]["checkins"] == 0
+
+def test_stats_follow_checkins_and_habit_changes(authenticated_client: TestClient):
+    walk = authenticated_client.post("/v1/habits/", json={"name": "Walk", "category": "fitness"}).json()["id"]
+    read = authenticated_client.post("/v1/habits/", json={"name": "Read", "category": "mind"}).json()["id"]
+    authenticated_client.post(f"/v1/habits/{walk}/log")
+    authenticated_client.post(f"/v1/habits/{walk}/log")
+
+    stats = authenticated_client.get("/v1/habits/stats").json()
+    assert stats["habit_count"] == 2
+    assert stats["total_checkins"] == 2
+    assert stats["current_streak"] == 1
+    assert stats["longest_streak"] == 1
+    # Two check-ins, but only one of the two habits has been done today.
+    assert stats["daily"]["checkins"] == 2
+    assert stats["daily"]["completed"] == 1
+    assert stats["daily"]["completion_rate"] == 0.5
+    categories = {c["category"]: c for c in stats["categories"]}
+    assert categories["fitness"]["total_checkins"] == 2
+    assert categories["mind"]["total_checkins"] == 0
+
+    # Moving a habit to another category and deleting one are reflected in the counts.
+    authenticated_client.put(f"/v1/habits/{read}", json={"name": "Read", "category": "fitness"})
+    assert {c["category"]: c["habit_count"] for c in authenticated_client.get("/v1/habits/stats").json()["categories"]} == {"fitness": 2}
+    authenticated_client.delete(f"/v1/habits/{read}")
+    assert authenticated_client.get("/v1/habits/stats").json()["habit_count"] == 1
+
+def test_backfill_rebuilds_stats(authenticated_client: TestClient, db):
+    walk = authenticated_client.post("/v1/habits/", json={"name": "Walk", "category": "fitness"}).json()["id"]
+    authenticated_client.post("/v1/habits/", json={"name": "Read"})
+    authenticated_client.post(f"/v1/habits/{walk}/log")
+    before = authenticated_client.get("/v1/habits/stats").json()
+
+    assert rollups.backfill(db) == 2
+    after = authenticated_client.get("/v1/habits/stats").json()
+    assert after == before
+
+def test_backfill_pages_through_users(authenticated_client: TestClient, db, monkeypatch):
+    authenticated_client.post("/v1/habits/", json={"name": "Walk", "category": "fitness"})
+    authenticated_client.post("/v1/users/", json={"email": "other@example.com", "password": "testpassword"})
+    before = authenticated_client.get("/v1/habits/stats").json()
+
+    monkeypatch.setattr(rollups, "BACKFILL_USERS_PER_PAGE", 1)
+    assert rollups.backfill(db) == 2
+    assert authenticated_client.get("/v1/habits/stats").json() == before
+
+def test_checkins_count_for_users_without_rollup_rows(authenticated_client: TestClient, db):
+    walk = authenticated_client.post("/v1/habits/", json={"name": "Walk", "category": "fitness"}).json()["id"]
+    authenticated_client.post("/v1/habits/", json={"name": "Read"})
+    # As for users whose habits are older than the rollups, when nobody ran the backfill.
+    db.execute(delete(HabitStats))
+    db.commit()
+
+    authenticated_client.post(f"/v1/habits/{walk}/log")
+    stats = authenticated_client.get("/v1/habits/stats").json()
+    assert stats["habit_count"] == 2
+    assert stats["total_checkins"] == 1
+    assert stats["current_streak"] == 1
+    assert stats["daily"]["completion_rate"] == 0.5
+    assert [(c["category"], c["habit_count"], c["total_checkins"]) for c in stats["categories"]] == [("fitness", 1, 1)]
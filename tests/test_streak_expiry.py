@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
+
+from app.database.locks import try_advisory_lock
+from app.database.sharding import SHARD_ID_STRIDE
+from app.database.streak_expiry import STREAK_EXPIRY_LOCK_ID, expire_overdue_streaks
+from app.models import Habit
+
+# A Wednesday. The previous periods start on Tuesday 2026-03-10, Monday 2026-03-02 and 2026-02-01.
+NOW = datetime(2026, 3, 11, 9, 30)
+
+def create_habit(client: TestClient, name: str, frequency: str, streak: int, last_logged, db) -> int:
+    habit_id = client.post("/v1/habits/", json={"name": name, "frequency": frequency}).json()["id"]
+    db.execute(update(Habit).where(Habit.id == habit_id).values(streak=streak, last_logged=last_logged))
+    db.commit()
+    return habit_id
+
+def test_only_overdue_streaks_are_reset(authenticated_client: TestClient, db, test_engine):
+    habits = {
+        "daily, logged yesterday": ("daily", 4, datetime(2026, 3, 10, 23, 0), 4),
+        "daily, missed yesterday": ("daily", 4, datetime(2026, 3, 9, 23, 59), 0),
+        "weekly, logged last week": ("weekly", 2, datetime(2026, 3, 2, 8, 0), 2),
+        "weekly, missed last week": ("weekly", 2, datetime(2026, 3, 1, 8, 0), 0),
+        "monthly, logged last month": ("monthly", 3, datetime(2026, 2, 1, 0, 0), 3),
+        "monthly, missed last month": ("monthly", 3, datetime(2026, 1, 31, 0, 0), 0),
+        "never logged": ("daily", 5, None, 5),
+    }
+    ids = {name: create_habit(authenticated_client, name, frequency, streak, logged, db) for name, (frequency, streak, logged, _) in habits.items()}
+    watermark = authenticated_client.get("/v1/habits/changes").json()["watermark"]
+
+    result = expire_overdue_streaks(sessionmaker(bind=test_engine), chunk_size=3, now=NOW)
+    assert result.ran
+    assert result.chunks == 3
+    assert result.expired == 3
+    assert len(result.user_ids) == 1
+
+    streaks = {habit["name"]: habit["streak"] for habit in authenticated_client.get("/v1/habits/").json()}
+    assert streaks == {name: expected for name, (_, _, _, expected) in habits.items()}
+
+    # Expiring is a change like any other: synced clients get the reset habits, at a new version.
+    changes = authenticated_client.get("/v1/habits/changes", params={"since": watermark}).json()
+    assert sorted(habit["id"] for habit in changes["habits"]) == sorted(ids[name] for name in habits if habits[name][3] == 0)
+    assert all(habit["version"] == 2 for habit in changes["habits"])
+
+def test_chunks_hold_habits_not_ids(authenticated_client: TestClient, db, test_engine):
+    # With sharding, habit ids go up by SHARD_ID_STRIDE, so ranges of ids would be nearly empty.
+    ids = [create_habit(authenticated_client, f"Habit {i}", "daily", 2, datetime(2026, 1, 1), db) for i in range(5)]
+    for habit_id in reversed(ids):
+        db.execute(update(Habit).where(Habit.id == habit_id).values(id=habit_id * SHARD_ID_STRIDE))
+    db.commit()
+
+    result = expire_overdue_streaks(sessionmaker(bind=test_engine), chunk_size=2, now=NOW)
+    assert result.chunks == 3
+    assert result.expired == 5
+
+def test_expiry_updates_the_streak_stats(authenticated_client: TestClient, db, test_engine):
+    habit_id = authenticated_client.post("/v1/habits/", json={"name": "Walk"}).json()["id"]
+    authenticated_client.post(f"/v1/habits/{habit_id}/log")
+    assert authenticated_client.get("/v1/habits/stats").json()["current_streak"] == 1
+
+    expire_overdue_streaks(sessionmaker(bind=test_engine), now=datetime(2099, 1, 1))
+    stats = authenticated_client.get("/v1/habits/stats").json()
+    assert stats["current_streak"] == 0
+    assert stats["longest_streak"] == 1
+
+def test_running_again_changes_nothing(authenticated_client: TestClient, db, test_engine):
+    create_habit(authenticated_client, "Walk", "daily", 3, datetime(2026, 1, 1), db)
+    assert expire_overdue_streaks(sessionmaker(bind=test_engine), now=NOW).expired == 1
+    again = expire_overdue_streaks(sessionmaker(bind=test_engine), now=NOW)
+    assert (again.expired, again.user_ids) == (0, [])
+
+def test_only_one_process_runs_the_job_at_a_time(authenticated_client: TestClient, db, test_engine):
+    create_habit(authenticated_client, "Walk", "daily", 3, datetime(2026, 1, 1), db)
+    with try_advisory_lock(test_engine, STREAK_EXPIRY_LOCK_ID) as acquired:
+        assert acquired
+        skipped = expire_overdue_streaks(sessionmaker(bind=test_engine), now=NOW)
+    assert not skipped.ran
+    assert skipped.expired == 0
+    assert expire_overdue_streaks(sessionmaker(bind=test_engine), now=NOW).expired == 1
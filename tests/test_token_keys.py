@@ -0,0 +1,161 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi.testclient import TestClient
+from jose import JWTError, jwt
+from sqlalchemy import event
+
+from app.core import jwt_keys
+from app.core.auth import create_access_token, decode_access_token
+from app.core.config import settings
+from app.core.revocation import BloomFilter, RevokedTokens, revoked_tokens
+from app.core.streaks import utcnow
+
+def write_private_key(directory, kid: str, algorithm: str):
+    if algorithm == "RS256":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        key = ec.generate_private_key(ec.SECP256R1())
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    (directory / f"{kid}.pem").write_bytes(pem)
+
+@pytest.fixture
+def rsa_keys(tmp_path, monkeypatch):
+    """
+    Signs tokens with RS256, using the newest of two keys in a key directory.
+    """
+    write_private_key(tmp_path, "2026-01", "RS256")
+    write_private_key(tmp_path, "2026-02", "RS256")
+    monkeypatch.setattr(jwt_keys, "key_ring", jwt_keys.load_key_ring("RS256", "unused", str(tmp_path)))
+    return tmp_path
+
+def log_in(client: TestClient, email: str = "keys@example.com") -> str:
+    client.post("/v1/users/", json={"email": email, "password": "testpassword"})
+    return client.post("/v1/users/token", data={"username": email, "password": "testpassword"}).json()["access_token"]
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256"])
+def test_tokens_are_signed_with_the_active_key(tmp_path, monkeypatch, algorithm):
+    write_private_key(tmp_path, "old", algorithm)
+    write_private_key(tmp_path, "new", algorithm)
+    monkeypatch.setattr(jwt_keys, "key_ring", jwt_keys.load_key_ring(algorithm, "unused", str(tmp_path), active_kid="new"))
+
+    token = create_access_token({"sub": "someone@example.com", "uid": 1})
+    assert jwt.get_unverified_header(token)["kid"] == "new"
+    assert jwt.get_unverified_header(token)["alg"] == algorithm
+    assert decode_access_token(token)["sub"] == "someone@example.com"
+
+def test_tokens_of_rotated_out_keys_stay_valid_until_the_key_is_removed(rsa_keys, monkeypatch):
+    old_token = create_access_token({"sub": "someone@example.com", "uid": 1})
+    assert jwt.get_unverified_header(old_token)["kid"] == "2026-02"
+
+    write_private_key(rsa_keys, "2026-03", "RS256")
+    monkeypatch.setattr(jwt_keys, "key_ring", jwt_keys.load_key_ring("RS256", "unused", str(rsa_keys)))
+    assert jwt.get_unverified_header(create_access_token({"sub": "x"}))["kid"] == "2026-03"
+    assert decode_access_token(old_token)["uid"] == 1
+
+    (rsa_keys / "2026-02.pem").unlink()
+    monkeypatch.setattr(jwt_keys, "key_ring", jwt_keys.load_key_ring("RS256", "unused", str(rsa_keys)))
+    with pytest.raises(JWTError):
+        decode_access_token(old_token)
+
+def test_public_key_cannot_be_used_as_an_hmac_secret(rsa_keys):
+    # The classic algorithm confusion attack: sign with HS256, using the published public key as the secret.
+    # python-jose refuses to sign like this, so the token is put together by hand.
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+
+    signing_input = f"{encode({'alg': 'HS256', 'typ': 'JWT', 'kid': '2026-02'})}.{encode({'sub': 'someone@example.com', 'uid': 1})}"
+    public_pem = jwt_keys.key_ring.active.public.to_pem()
+    signature = base64.urlsafe_b64encode(hmac.new(public_pem, signing_input.encode(), hashlib.sha256).digest()).decode().rstrip("=")
+    forged = f"{signing_input}.{signature}"
+    with pytest.raises(JWTError):
+        decode_access_token(forged)
+
+def test_jwks_lets_other_services_verify_tokens(client: TestClient, rsa_keys):
+    token = log_in(client)
+    jwks = client.get("/.well-known/jwks.json").json()
+    assert sorted(key["kid"] for key in jwks["keys"]) == ["2026-01", "2026-02"]
+    assert all("d" not in key for key in jwks["keys"])
+
+    # Offline verification, with nothing but the published keys.
+    claims = jwt.decode(token, jwks, algorithms=["RS256"])
+    assert claims["sub"] == "keys@example.com"
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+def test_jwks_is_empty_with_a_shared_secret(client: TestClient):
+    assert client.get("/.well-known/jwks.json").json() == {"keys": []}
+
+def test_logout_revokes_only_that_token(client: TestClient):
+    first, second = log_in(client), log_in(client)
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {first}"}).status_code == 200
+
+    assert client.post("/v1/users/logout", headers={"Authorization": f"Bearer {first}"}).status_code == 204
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {first}"}).status_code == 401
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {second}"}).status_code == 200
+
+def test_other_processes_learn_of_revocations_by_syncing(client: TestClient):
+    token = log_in(client)
+    client.post("/v1/users/logout", headers={"Authorization": f"Bearer {token}"})
+
+    # A fresh process has an empty filter; its first request loads the revocations.
+    revoked_tokens.clear()
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+
+def test_valid_tokens_never_look_up_revocations(client: TestClient, test_engine):
+    token = log_in(client)
+    client.get("/v1/habits/", headers={"Authorization": f"Bearer {token}"})
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for _ in range(3):
+            fresh_token = log_in(client)
+            assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {fresh_token}"}).status_code == 200
+    finally:
+        event.remove(test_engine, "before_cursor_execute", before_cursor_execute)
+    assert not any("revoked_tokens" in statement for statement in statements)
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"revoked-{i}")
+    assert all(f"revoked-{i}" in bloom for i in range(1000))
+    false_positives = sum(f"valid-{i}" in bloom for i in range(10_000))
+    assert false_positives < 300
+
+def test_sync_timer_only_advances_once_a_sync_is_done():
+    tokens = RevokedTokens()
+    assert tokens.claim_sync()
+    assert not tokens.claim_sync()
+
+    # A sync that failed is retried by the next request.
+    tokens.sync_failed()
+    assert tokens.claim_sync()
+    tokens.synced(["revoked"], utcnow(), tokens.sync_from())
+    assert tokens.might_be_revoked("revoked")
+    assert not tokens.claim_sync()
+
+def test_full_bloom_filter_is_rebuilt_from_the_table(monkeypatch):
+    monkeypatch.setattr(settings, "REVOCATION_BLOOM_CAPACITY", 10)
+    monkeypatch.setattr(settings, "REVOCATION_SYNC_SECONDS", 0)
+    tokens = RevokedTokens()
+    tokens.synced([], utcnow(), None)
+    for i in range(10):
+        tokens.add(f"expired-{i}")
+    assert tokens.sync_from() is None
+
+    assert tokens.claim_sync()
+    tokens.add("revoked-meanwhile")
+    tokens.synced(["still-revoked"], utcnow(), None)
+    assert tokens.might_be_revoked("still-revoked") and tokens.might_be_revoked("revoked-meanwhile")
+    assert not any(tokens.might_be_revoked(f"expired-{i}") for i in range(10))
+    assert tokens.sync_from() is not None
@@ -1,4 +1,12 @@
+import threading
+
 from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.core import security
+from app.core.cache import principal_cache
+from app.core.config import settings
+from app.database import crud
 
 # The fixtures from conftest.py are automatically available here.
 
@@ -38,4 +46,76 @@ def test_login_for_access_token(client: TestClient):
     )
     assert login_response.status_code == 200
     assert "access_token" in login_response.json()
-    assert login_response.json()["token_type"] == "bearer"
\ No newline at end of file
+    assert login_response.json()["token_type"] == "bearer"
+
+
+def test_access_token_carries_user_id(client: TestClient):
+    create_response = client.post(
+        "/v1/users/",
+        json={"email": "claims@example.com", "password": "testpassword"}
+    )
+    login_response = client.post(
+        "/v1/users/token",
+        data={"username": "claims@example.com", "password": "testpassword"}
+    )
+    token = login_response.json()["access_token"]
+    claims = jwt.get_unverified_claims(token)
+    assert claims["sub"] == "claims@example.com"
+    assert claims["uid"] == create_response.json()["id"]
+
+def test_deleted_user_token_is_rejected(authenticated_client: TestClient, db):
+    # The first call verifies the token and caches the principal.
+    assert authenticated_client.get("/v1/habits/").status_code == 200
+
+    user = crud.get_user_by_email(db, email="testuser@example.com")
+    crud.delete_user(db, user)
+
+    # Deleting the user invalidated the cached entry, so the token is checked again and rejected.
+    response = authenticated_client.get("/v1/habits/")
+    assert response.status_code == 401
+
+def test_login_rehashes_outdated_password_hash(client: TestClient, db):
+    # Store a hash made with a lower bcrypt cost than the configured one.
+    weak_hash = security.pwd_context.hash("testpassword", rounds=4)
+    crud.create_user(db, email="rehash@example.com", password_hash=weak_hash)
+
+    login_response = client.post(
+        "/v1/users/token",
+        data={"username": "rehash@example.com", "password": "testpassword"}
+    )
+    assert login_response.status_code == 200
+
+    db.expire_all()
+    user = crud.get_user_by_email(db, email="rehash@example.com")
+    assert user.password_hash != weak_hash
+    assert not security.pwd_context.needs_update(user.password_hash)
+
+def test_rehashing_keeps_cached_tokens(client: TestClient, db):
+    client.post("/v1/users/", json={"email": "rehash@example.com", "password": "testpassword"})
+    token = client.post("/v1/users/token", data={"username": "rehash@example.com", "password": "testpassword"}).json()["access_token"]
+    assert client.get("/v1/habits/", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert principal_cache.get(token) is not None
+
+    user = crud.get_user_by_email(db, email="rehash@example.com")
+    crud.rehash_user_password(db, user, security.pwd_context.hash("testpassword", rounds=4))
+    client.post("/v1/users/token", data={"username": "rehash@example.com", "password": "testpassword"})
+
+    db.expire_all()
+    assert not security.pwd_context.needs_update(crud.get_user_by_email(db, email="rehash@example.com").password_hash)
+    assert principal_cache.get(token) is not None
+
+def test_login_returns_503_when_hashing_pool_is_saturated(client: TestClient, monkeypatch):
+    client.post(
+        "/v1/users/",
+        json={"email": "busy@example.com", "password": "testpassword"}
+    )
+    # A semaphore with no free slots behaves like a pool whose queue is already full.
+    monkeypatch.setattr(security, "_hashing_slots", threading.BoundedSemaphore(1))
+    security._hashing_slots.acquire()
+
+    response = client.post(
+        "/v1/users/token",
+        data={"username": "busy@example.com", "password": "testpassword"}
+    )
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(settings.HASHING_RETRY_AFTER_SECONDS)